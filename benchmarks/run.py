@@ -0,0 +1,177 @@
+"""
+Run the shapyro benchmarks
+
+    python -m benchmarks.run                      # everything, results as JSON on stdout
+    python -m benchmarks.run -o new.json get_depth template_keys
+    python -m benchmarks.run --compare old.json   # exits 1 on a regression
+
+For every scenario, this reports ops/sec, per-op latency percentiles
+(in microseconds) and the peak memory tracemalloc saw during one pass
+over the scenario's sources. Timing and memory are measured in separate
+passes, since tracemalloc slows everything down a lot.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from benchmarks.scenarios import SCENARIOS
+
+
+FORMAT_VERSION = 1
+
+PERCENTILES = (50, 90, 99)
+
+
+def measure(run, sources, min_time, loop):
+    """
+    Time run over sources, round and round, for at least min_time seconds
+
+    Returns:
+        dict: the results for one scenario
+    """
+    timer = time.perf_counter_ns
+    call_async = loop.run_until_complete
+    # Warm up (and let Get chains compile themselves)
+    for src in sources[:20] * 2:
+        result = run(src)
+        if asyncio.iscoroutine(result):
+            call_async(result)
+
+    latencies = []
+    deadline = timer() + int(min_time * 1e9)
+    started = timer()
+    while True:
+        for src in sources:
+            start = timer()
+            result = run(src)
+            if asyncio.iscoroutine(result):
+                call_async(result)
+            latencies.append(timer() - start)
+        if timer() >= deadline:
+            break
+    elapsed = timer() - started
+
+    latencies.sort()
+    return {
+        "ops": len(latencies),
+        "ops_per_sec": len(latencies) / (elapsed / 1e9),
+        "latency_us": dict(
+            {f"p{p}": percentile(latencies, p) / 1e3 for p in PERCENTILES},
+            min=latencies[0] / 1e3,
+            max=latencies[-1] / 1e3,
+        ),
+        "peak_memory_bytes": peak_memory(run, sources, loop),
+    }
+
+
+def percentile(ordered, p):
+    """
+    The p'th percentile of the sorted list ordered (nearest rank)
+    """
+    index = max(0, -(-len(ordered) * p // 100) - 1)
+    return ordered[index]
+
+
+def peak_memory(run, sources, loop):
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        for src in sources:
+            result = run(src)
+            if asyncio.iscoroutine(result):
+                loop.run_until_complete(result)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmarks(names, min_time):
+    loop = asyncio.new_event_loop()
+    try:
+        results = {}
+        for name in names:
+            run, sources = SCENARIOS[name]()
+            results[name] = measure(run, sources, min_time, loop)
+            print(f"{name}: {results[name]['ops_per_sec']:,.0f} ops/sec", file=sys.stderr)
+        return results
+    finally:
+        loop.close()
+
+
+def compare(old, new, threshold):
+    """
+    Print how new's ops/sec compares with old's for every scenario in both
+
+    Returns:
+        list: the names of the scenarios that got slower by more than threshold
+    """
+    regressions = []
+    for name, result in new["results"].items():
+        if name not in old["results"]:
+            continue
+        before = old["results"][name]["ops_per_sec"]
+        change = result["ops_per_sec"] / before - 1
+        flag = ""
+        if change < -threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:40} {before:14,.0f} -> {result['ops_per_sec']:14,.0f} ops/sec "
+              f"({change:+.1%}){flag}", file=sys.stderr)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the shapyro benchmarks")
+    parser.add_argument("scenarios", nargs="*",
+                        help="only run scenarios whose names start with one of these")
+    parser.add_argument("-o", "--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--min-time", type=float, default=1.0,
+                        help="seconds to spend timing each scenario (default: 1)")
+    parser.add_argument("--compare", metavar="RESULTS",
+                        help="earlier JSON results to compare ops/sec against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="slowdown (as a fraction) that counts as a regression (default: 0.1)")
+    parser.add_argument("--list", action="store_true", help="just list the scenarios")
+    args = parser.parse_args(argv)
+
+    names = [
+        name for name in SCENARIOS
+        if not args.scenarios or name.startswith(tuple(args.scenarios))
+    ]
+    if args.list:
+        print("\n".join(names))
+        return 0
+    if not names:
+        parser.error("no scenarios match")
+
+    report = {
+        "format_version": FORMAT_VERSION,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": sys.version,
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "min_time": args.min_time,
+        "results": run_benchmarks(names, args.min_time),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if compare(old, report, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+The benchmark scenarios
+
+Each scenario is a function that sets up whatever it needs and
+returns (run, sources): run gets called once per source, and one
+call is what counts as an op. If run returns a coroutine, it's an
+op once it's been awaited.
+
+Scenarios are registered with @scenario under a name that says
+what they vary, so that results from different builds line up.
+"""
+import asyncio
+
+import shapyro
+
+
+SCENARIOS = {}
+
+
+def scenario(name, **params):
+    """
+    Register the decorated function as scenario name, called with params
+    """
+    def register(func):
+        SCENARIOS[name] = lambda: func(**params)
+        return func
+    return register
+
+
+def _nested(depth, leaf):
+    src = leaf
+    for _ in range(depth):
+        src = {"next": src}
+    return src
+
+
+def _get_depth(depth):
+    chain = shapyro.Get
+    for _ in range(depth):
+        chain = chain["next"]
+    sources = [_nested(depth, i) for i in range(100)]
+    return chain, sources
+
+
+for _depth in (1, 10, 100):
+    scenario(f"get_depth_{_depth}", depth=_depth)(_get_depth)
+
+
+def _template_keys(keys):
+    plan = shapyro.compile({f"out{i}": shapyro.Get[f"in{i}"] for i in range(keys)})
+    sources = [{f"in{i}": i + n for i in range(keys)} for n in range(10)]
+    return plan, sources
+
+
+for _keys in (10, 100, 1000, 10000):
+    scenario(f"template_keys_{_keys}", keys=_keys)(_template_keys)
+
+
+@scenario("template_keys_100_uncompiled", keys=100)
+def _template_keys_uncompiled(keys):
+    template = {f"out{i}": shapyro.Get[f"in{i}"] for i in range(keys)}
+    sources = [{f"in{i}": i + n for i in range(keys)} for n in range(10)]
+    return (lambda src: shapyro.port(src, template)), sources
+
+
+@scenario("nested_template_shared_prefixes")
+def _nested_template():
+    container = shapyro.Get['spec']['template']['spec']['containers'][0]
+    plan = shapyro.compile({
+        "name": shapyro.Get['metadata']['name'],
+        "image": container['image'],
+        "command": container['command'],
+        "ports": [container['ports'][0]['containerPort'], shapyro.OnlyIfExists(container['ports'][1])],
+        "env": {"first": container['env'][0]['value'], "count": container['env'][1]['value']},
+        "replicas": shapyro.Get['spec']['replicas'],
+    })
+    sources = [{
+        "metadata": {"name": f"app{n}"},
+        "spec": {
+            "replicas": n,
+            "template": {"spec": {"containers": [{
+                "image": "img:latest",
+                "command": ["run"],
+                "ports": [{"containerPort": 8080}],
+                "env": [{"value": "a"}, {"value": "b"}],
+            }]}},
+        },
+    } for n in range(10)]
+    return plan, sources
+
+
+@scenario("only_if_exists_1000_half_skipped", keys=1000)
+def _only_if_exists(keys):
+    template = {f"out{i}": shapyro.OnlyIfExists(shapyro.Get[f"in{i}"]) for i in range(keys)}
+    template["list"] = [shapyro.OnlyIfExists(f"in{i}") for i in range(keys)]
+    plan = shapyro.compile(template)
+    sources = [{f"in{i}": i for i in range(n % 2, keys, 2)} for n in range(10)]
+    return plan, sources
+
+
+def _static_manifest_template():
+    return {
+        "apiVersion": "apps/v1",
+        "kind": "Deployment",
+        "metadata": {
+            "name": shapyro.Get['name'],
+            "labels": {"app": "web", "tier": "frontend", "team": "platform"},
+            "annotations": {f"example.com/note{i}": f"value{i}" for i in range(20)},
+        },
+        "spec": {
+            "selector": {"matchLabels": {"app": "web"}},
+            "ports": [{"port": 80, "protocol": "TCP"}, {"port": 443, "protocol": "TCP"}],
+            "tolerations": [
+                {"key": "dedicated", "operator": "Exists", "effect": effect}
+                for effect in ("NoSchedule", "NoExecute")
+            ],
+            "image": shapyro.Get['image'],
+            "args": ("--verbose", "--port=80", "--tls"),
+        },
+    }
+
+
+@scenario("static_manifest")
+def _static_manifest():
+    plan = shapyro.compile(_static_manifest_template())
+    return plan, [{"name": f"app{n}", "image": f"img{n}"} for n in range(10)]
+
+
+@scenario("static_manifest_shared_constants")
+def _static_manifest_shared():
+    plan = shapyro.compile(_static_manifest_template(), shared_constants=True)
+    return plan, [{"name": f"app{n}", "image": f"img{n}"} for n in range(10)]
+
+
+@scenario("string_template")
+def _string_template():
+    template = shapyro.StringTemplate("{name} <{email}> has {count} items in {place}")
+    sources = [
+        {"name": f"user{n}", "email": f"user{n}@example.com", "count": n, "place": "cart"}
+        for n in range(100)
+    ]
+    return template, sources
+
+
+async def _sleep_and_return(src):
+    await asyncio.sleep(0.001)
+    return src["n"]
+
+
+def _async_sleeps(coroutines):
+    plan = shapyro.compile({f"out{i}": _sleep_and_return for i in range(coroutines)})
+    sources = [{"n": n} for n in range(10)]
+    return plan, sources
+
+
+for _coroutines in (10, 100, 1000):
+    scenario(f"async_sleep_{_coroutines}", coroutines=_coroutines)(_async_sleeps)
@@ -1,6 +1,12 @@
 
 from shapyro.op import *
-from shapyro.getobj import Get
-from shapyro.utils import Template, port
+from shapyro.getobj import Each, Get
+from shapyro.profiling import profile
+from shapyro.analysis import analyze
+from shapyro.incremental import IncrementalPort
+from shapyro.utils import (
+    Template, compile, port, port_columns, port_lazy, port_many, port_many_async,
+    port_parallel, port_stream
+)
 
 name = "shapyro"
@@ -0,0 +1,311 @@
+
+#
+# Static analysis of templates
+#
+
+import asyncio
+import collections
+import functools
+import inspect
+
+from shapyro.getobj import Each, _Each, _GetChainLink, _chain_steps, _get_bracket
+from shapyro.op import Batched, Blocking, Cached, FromAttr, KeyOrDefault, OnlyIfExists, Pure, StringTemplate
+from shapyro.op import _FORMATTER, _split_field_name
+from shapyro.utils import Template, _path_join
+
+
+__all__ = ["analyze", "Analysis", "Attr"]
+
+
+# An attribute access in a source path (anything else in one is a key or index)
+Attr = collections.namedtuple("Attr", ["name"])
+
+
+class Analysis(object):
+    """
+    What analyze() found out about a template
+
+    Source paths are tuples of the keys/indexes (and Attrs) that get
+    looked up one after another, starting from the source itself, with
+    shapyro.Each standing for every element of what's there so far; ()
+    is the source as a whole. Template paths are strings like the ones
+    shapyro.profile uses ("spec.containers[0].image").
+
+    Attributes:
+        reads: list: Every source path whose value gets used, in the
+            order the template uses them
+        opaque: list: Source paths whose values get handed to callables
+            that analyze can't see into (which might read anything under
+            them), in the same order
+        entries: dict: Each non-constant template path, mapped to the
+            source paths it reads (opaque ones included)
+        async_entries: list: Template paths whose values may be coroutines
+            (because there's an async callable in them)
+        constants: list: Template paths whose values are just constants
+    """
+    def __init__(self):
+        self.reads = []
+        self.opaque = []
+        self.entries = {}
+        self.async_entries = []
+        self.constants = []
+
+    def projection(self):
+        """
+        projection
+
+        Everything the template needs from a source, as a nested dict:
+        each key (or index, or Attr) that gets looked up maps to the dict
+        of what's needed from under it, or to True if all of it is.
+
+        analyze({"a": Get['x']['y'], "b": Get['z']}).projection()
+        # {"x": {"y": True}, "z": True}
+
+        A step that can't be a dict key (like a slice) counts as
+        needing all of what it's taken from.
+
+        Returns:
+            dict, or True if the whole source is needed
+        """
+        mask = {}
+        for path in self.reads + self.opaque:
+            if not path:
+                return True
+            level = mask
+            # The level that level is under, and its step there
+            above = None
+            for index, step in enumerate(path):
+                try:
+                    below = level.get(step)
+                except TypeError:
+                    # unhashable (e.g. a slice): all of what it's taken from is needed
+                    if above is None:
+                        return True
+                    above[0][above[1]] = True
+                    break
+                if below is True:
+                    break
+                if index == len(path) - 1:
+                    level[step] = True
+                    break
+                if below is None:
+                    below = level[step] = {}
+                above = (level, step)
+                level = below
+        return mask
+
+    def __repr__(self):
+        return (
+            f"Analysis(reads={self.reads!r}, opaque={self.opaque!r}, "
+            f"async_entries={self.async_entries!r}, constants={self.constants!r})"
+        )
+
+
+def analyze(template):
+    """
+    analyze
+
+    Parameters:
+        template: The "destination" object, exactly as you'd give it to port
+
+    Work out, without running anything, which parts of a source
+    template would read when ported:
+
+    analysis = shapyro.analyze({
+        "image": shapyro.Get['spec']['containers'][0]['image'],
+        "owner": shapyro.OnlyIfExists(shapyro.FromAttr("owner")),
+        "kind": "Pod"
+    })
+    analysis.reads          # [("spec", "containers", 0, "image"), (Attr("owner"),)]
+    analysis.constants      # ["kind"]
+    analysis.projection()   # {"spec": {"containers": {0: {"image": True}}}, Attr("owner"): True}
+
+    so that whatever loads the sources can load just those fields.
+
+    Get chains, KeyOrDefault, FromAttr, OnlyIfExists, StringTemplate
+    (without a resolver), Pure, Cached, Blocking and Batched get looked
+    into; any other callable is opaque, since it could read anything
+    from the value it's given.
+    Anything after an opaque callable in a Get chain reads from what
+    the callable returned rather than from the source, so it doesn't
+    count.
+
+    An entry can only be called async here if it has an async callable
+    (or a Blocking or Batched) in it; a sync callable can still return
+    a coroutine (and so can a Get chain, if the source holds one).
+
+    Returns:
+        shapyro.analysis.Analysis (Attr is in shapyro.analysis too)
+    """
+    analysis = Analysis()
+    if isinstance(template, Template):
+        template = template.template
+    _analyze_node(template, "", analysis)
+    return analysis
+
+
+def _analyze_node(dst, path, analysis):
+    # An explicit stack, so that templates can go as deep as port lets them;
+    # each item is (template, path, whether it's a callable dict key)
+    stack = [(dst, path, False)]
+    while stack:
+        dst, path, is_key = stack.pop()
+        if is_key:
+            # A callable key counts as part of its entry
+            _analyze_entry(dst, path, analysis)
+            continue
+        which_type = type(dst)
+        below = []
+        if which_type is dict:
+            for k, v in dst.items():
+                v_path = _path_join(path, k)
+                if callable(k) or asyncio.iscoroutine(k):
+                    below.append((k, v_path, True))
+                below.append((v, v_path, False))
+        elif which_type in (list, tuple, set):
+            for index, item in enumerate(dst):
+                below.append((item, f"{path}[{index}]", False))
+        elif isinstance(dst, Template):
+            below.append((dst.template, path, False))
+        elif callable(dst) or asyncio.iscoroutine(dst):
+            _analyze_entry(dst, path, analysis)
+        else:
+            analysis.constants.append(path or "<template>")
+        # In template order
+        stack.extend(reversed(below))
+
+
+def _analyze_entry(fn, path, analysis):
+    reads = []
+    opaque = []
+    is_async = _analyze_callable(fn, (), reads, opaque)
+    path = path or "<template>"
+    entry = analysis.entries.setdefault(path, [])
+    for source_path in reads:
+        if source_path not in entry:
+            entry.append(source_path)
+        if source_path not in analysis.reads:
+            analysis.reads.append(source_path)
+    for source_path in opaque:
+        if source_path not in entry:
+            entry.append(source_path)
+        if source_path not in analysis.opaque:
+            analysis.opaque.append(source_path)
+    if is_async and path not in analysis.async_entries:
+        analysis.async_entries.append(path)
+
+
+def _analyze_callable(fn, base, reads, opaque):
+    """
+    Add what fn reads, when it's called with the value at source path
+    base, to reads (or opaque)
+
+    Returns:
+        bool: whether fn might be async
+    """
+    path, is_async = _follow(fn, base, reads, opaque)
+    if path is not None:
+        reads.append(path)
+    return is_async
+
+
+def _follow(fn, base, reads, opaque):
+    """
+    Where fn (called on the value at base) gets its result from
+
+    Returns:
+        (path, is_async): path is the source path that fn's result is
+        the value at, or None if it's something else (in which case
+        everything it reads has already been added to reads/opaque)
+    """
+    if asyncio.iscoroutine(fn):
+        return None, True
+
+    if isinstance(fn, _GetChainLink):
+        path = base
+        is_async = False
+        for op, op_arg in _chain_steps(fn):
+            if type(op_arg) is _Each:
+                # Everything after it reads from every element
+                path += (Each,)
+                if op_arg.predicate is not None:
+                    is_async = _analyze_callable(op_arg.predicate, path, reads, opaque) or is_async
+            elif callable(op_arg):
+                path, step_async = _follow(op_arg, path, reads, opaque)
+                is_async = is_async or step_async
+                if path is None:
+                    return None, is_async
+            elif op is _get_bracket:
+                path += (op_arg,)
+            elif op is getattr:
+                path += (Attr(op_arg),)
+        return path, is_async
+
+    if isinstance(fn, Pure):
+        return _follow(fn.fn, base, reads, opaque)
+    elif isinstance(fn, Batched):
+        # The result comes from batch_fn, which only sees the key
+        if fn.key is None:
+            reads.append(base)
+        else:
+            _analyze_callable(fn.key, base, reads, opaque)
+        return None, True
+    elif isinstance(fn, Blocking):
+        # async whenever it's ported with offload=True
+        path, _ = _follow(fn.fn, base, reads, opaque)
+        return path, True
+    elif isinstance(fn, Cached):
+        is_async = False
+        if fn.key is not None:
+            is_async = _analyze_callable(fn.key, base, reads, opaque)
+        path, fn_async = _follow(fn.fn, base, reads, opaque)
+        return path, is_async or fn_async
+
+    composite = getattr(fn, "composite", None)
+    args = getattr(fn, "args", ())
+    kwargs = getattr(fn, "kwargs", {})
+    if composite is KeyOrDefault and args:
+        return base + (args[0],), False
+    elif composite is FromAttr and args and isinstance(args[0], str):
+        return base + (Attr(args[0]),), False
+    elif composite is OnlyIfExists and len(args) == 1 and not kwargs:
+        key = args[0]
+        if callable(key):
+            return _follow(key, base, reads, opaque)
+        return base + (key,), False
+    elif composite is StringTemplate and args and isinstance(args[0], str) \
+            and len(args) == 1 and kwargs.get("resolver") is None:
+        reads.extend(_format_reads(args[0], base))
+        return None, False
+
+    opaque.append(base)
+    return None, _is_async_callable(fn)
+
+
+def _format_reads(template, base):
+    """
+    The source paths that template.format(*source or **source) reads
+    """
+    reads = []
+    auto_number = 0
+    for _, field, spec, _ in _FORMATTER.parse(template):
+        if field is None:
+            continue
+        first, rest = _split_field_name(field)
+        if first == "":
+            first = auto_number
+            auto_number += 1
+        path = base + (first,)
+        for is_attr, key in rest:
+            path += (Attr(key),) if is_attr else (key,)
+        reads.append(path)
+        if spec and "{" in spec:
+            reads.extend(_format_reads(spec, base))
+    return reads
+
+
+def _is_async_callable(fn):
+    while isinstance(fn, functools.partial):
+        fn = fn.func
+    return inspect.iscoroutinefunction(fn) or \
+        inspect.iscoroutinefunction(getattr(fn, "__call__", None))
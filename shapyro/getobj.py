@@ -4,17 +4,335 @@
 #
 
 import asyncio
+import keyword
+import operator
+import weakref
 
 from shapyro.op import SkipIteration
+from shapyro.profiling import _PROFILERS, _timed
 
 
-__all__ = ["Get"]
+__all__ = ["Get", "Each"]
+
+
+# How many times a chain gets called before it compiles
+# itself into a flat evaluator (see _GetChainLink.compile)
+_COMPILE_THRESHOLD = 16
+
+# Types that can never be coroutines. asyncio.iscoroutine()
+# is comparatively slow for anything that *isn't* a coroutine,
+# and it runs once per link on every call, so we check these first.
+_SYNC_TYPES = frozenset({
+    dict, list, tuple, set, frozenset, str, bytes,
+    int, float, bool, type(None)
+})
+
+
+def _iscoroutine(obj):
+    return type(obj) not in _SYNC_TYPES and asyncio.iscoroutine(obj)
 
 
 def _get_bracket(target, target_name):
     return target[target_name]
 
 
+def _apply_step(op, op_arg, current, skips=False):
+    """
+    Resolve a single link's op against current
+
+    skips lets a SkipIteration out as-is (for the rest of a chain
+    after an Each, where it drops the element) instead of raising
+    whatever got SkipIteration'd
+    """
+    if callable(op_arg):
+        # Means we want to do an operation
+        # while we're doing the get
+        # The operation will completely
+        # transform the result, and that
+        # transformation is what should go
+        # down the line
+        try:
+            return op_arg(current)
+        except SkipIteration as e:
+            # SkipIteration doesn't have any
+            # special meaning to shapyro.Get
+            # see shapyro.op for more details
+            # but we want to raise whatever
+            # got SkipIteration'd
+            if skips:
+                raise
+            e.reraise()
+    elif op is None:
+        # noop: identity
+        return current
+    else:
+        return op(current, op_arg)
+
+
+def _run_steps(steps, current, skips=False):
+    """
+    Run every (op, op_arg) step in order against current
+
+    As soon as anything in the chain turns out to be a
+    coroutine, we hand the rest of the chain off to
+    _resume_steps and return the coroutine that it makes.
+    An Each hands the rest of the chain to its fan_out.
+    """
+    if _iscoroutine(current):
+        return _resume_steps(steps, current, 0, skips)
+    for index, (op, op_arg) in enumerate(steps):
+        if type(op_arg) is _Each:
+            return op_arg.fan_out(current, _rest_function(steps[index + 1:]))
+        current = _apply_step(op, op_arg, current, skips)
+        if _iscoroutine(current):
+            return _resume_steps(steps, current, index + 1, skips)
+    return current
+
+
+def _rest_function(rest):
+    """
+    What an Each runs on each element: the rest of the chain,
+    letting SkipIteration out so that the element gets dropped
+    """
+    if not rest:
+        return None
+
+    def run_rest(element):
+        return _run_steps(rest, element, True)
+    return run_rest
+
+
+def _run_maybe_steps(steps, current, missing):
+    """
+    _run_steps, except that a dict key or attribute that isn't
+    there gives back missing instead of raising KeyError or
+    AttributeError (for shapyro.utils' OnlyIfExists handling,
+    where the exception would only get caught and thrown away)
+    """
+    if _iscoroutine(current):
+        return _resume_steps(steps, current, 0)
+    for index, (op, op_arg) in enumerate(steps):
+        if type(op_arg) is _Each:
+            return op_arg.fan_out(current, _rest_function(steps[index + 1:]))
+        if op is _get_bracket and type(current) is dict and not callable(op_arg):
+            current = current.get(op_arg, missing)
+        elif op is getattr and type(op_arg) is str:
+            current = getattr(current, op_arg, missing)
+        else:
+            current = _apply_step(op, op_arg, current)
+        if current is missing:
+            return missing
+        if _iscoroutine(current):
+            return _resume_steps(steps, current, index + 1)
+    return current
+
+
+async def _resume_steps(steps, current, start, skips=False):
+    """
+    The async fallback: await whatever was pending,
+    then keep going from steps[start], awaiting any
+    link that hands back another coroutine
+    """
+    current = await current
+    for index in range(start, len(steps)):
+        op, op_arg = steps[index]
+        if type(op_arg) is _Each:
+            current = op_arg.fan_out(current, _rest_function(steps[index + 1:]))
+            if asyncio.iscoroutine(current):
+                current = await current
+            return current
+        current = _apply_step(op, op_arg, current, skips)
+        if asyncio.iscoroutine(current):
+            current = await current
+    return current
+
+
+class _Each(object):
+    """
+    shapyro.Each: in a Get chain, runs the rest of the chain on every
+    element of what's there so far, giving back a list
+
+    shapyro.Get['spec']['containers'][shapyro.Each]['name']
+    # ["app", "sidecar"]
+
+    An element that the rest of the chain raises SkipIteration for
+    (say, from shapyro.OnlyIfExists) gets left out, so
+    Get['containers'][Each][OnlyIfExists('ports')] is the ports of just
+    the containers that have them. Any other exception gets raised as
+    usual. Each.where(predicate) only keeps the elements that
+    predicate(element) is true for, and Each.flat chains the results
+    together (they need to be iterable) instead of listing them.
+    If any of the results are coroutines, you get back a coroutine
+    that awaits them all (concurrently) for the list.
+    """
+    def __init__(self, predicate=None, flatten=False):
+        self.predicate = predicate
+        self.flatten = flatten
+
+    def where(self, predicate):
+        """
+        where
+
+        Parameters:
+            predicate: callable(element): Whether to keep the element
+                (checked before the rest of the chain runs on it)
+
+        Returns:
+            An Each that only keeps elements that predicate is true for
+            (and that the predicate this one already had is true for, if any)
+        """
+        if not callable(predicate):
+            raise TypeError(f"Each.where needs a callable, not {predicate!r}")
+        if self.predicate is not None:
+            predicate = _both(self.predicate, predicate)
+        return _Each(predicate, self.flatten)
+
+    @property
+    def flat(self):
+        return _Each(self.predicate, True)
+
+    def fan_out(self, iterable, rest):
+        """
+        rest(element) (or the element, if rest is None) for every element
+        """
+        predicate = self.predicate
+        results = []
+        has_coroutines = False
+        for element in iterable:
+            if predicate is not None and not predicate(element):
+                continue
+            if rest is not None:
+                try:
+                    element = rest(element)
+                except SkipIteration:
+                    continue
+                if _iscoroutine(element):
+                    has_coroutines = True
+            results.append(element)
+        if has_coroutines:
+            return _gather_fan_out(results, self.flatten)
+        if self.flatten:
+            return [item for result in results for item in result]
+        return results
+
+    def __eq__(self, other):
+        if type(other) is not _Each:
+            return NotImplemented
+        return self.predicate == other.predicate and self.flatten == other.flatten
+
+    def __hash__(self):
+        return hash((_Each, self.predicate, self.flatten))
+
+    def __repr__(self):
+        text = "shapyro.Each"
+        if self.predicate is not None:
+            name = getattr(self.predicate, "__name__", type(self.predicate).__name__)
+            text += f".where({name})"
+        if self.flatten:
+            text += ".flat"
+        return text
+
+    def __reduce__(self):
+        return (_Each, (self.predicate, self.flatten))
+
+
+def _both(first, second):
+    def both(element):
+        return first(element) and second(element)
+    return both
+
+
+async def _gather_fan_out(results, flatten):
+    pending = [index for index, result in enumerate(results) if asyncio.iscoroutine(result)]
+    done = await asyncio.gather(*(results[index] for index in pending))
+    for index, result in zip(pending, done):
+        results[index] = result
+    if flatten:
+        return [item for result in results for item in result]
+    return results
+
+
+Each = _Each()
+
+
+def _compile_steps(steps, missing=None, skips=False):
+    """
+    Generate one flat function equivalent to _run_steps(steps, source, skips)
+    (or to _run_maybe_steps(steps, source, missing) if missing is given)
+
+    Each step becomes a single statement -- a subscript, an
+    attribute load or a call -- so the exceptions that get raised
+    are the same ones you'd get from doing the access eagerly.
+    An Each ends the function: the rest of the chain gets compiled
+    on its own, for the Each to run on every element.
+    """
+    namespace = {
+        "iscoroutine": asyncio.iscoroutine,
+        "sync_types": _SYNC_TYPES,
+        "SkipIteration": SkipIteration,
+        "resume": _resume_steps,
+        "steps": steps,
+        "missing": missing,
+        "skips": skips
+    }
+
+    def check_coroutine(index):
+        return [
+            "    if type(current) not in sync_types and iscoroutine(current):",
+            f"        return resume(steps, current, {index}, skips)"
+        ]
+
+    lines = ["def evaluate(source):", "    current = source"]
+    lines += check_coroutine(0)
+    for index, (op, op_arg) in enumerate(steps):
+        arg_name = f"arg{index}"
+        namespace[arg_name] = op_arg
+        if type(op_arg) is _Each:
+            rest = steps[index + 1:]
+            namespace["rest"] = _compile_steps(rest, skips=True) if rest else None
+            lines.append(f"    return {arg_name}.fan_out(current, rest)")
+            break
+        if callable(op_arg) and skips:
+            lines.append(f"    current = {arg_name}(current)")
+        elif callable(op_arg):
+            lines += [
+                "    try:",
+                f"        current = {arg_name}(current)",
+                "    except SkipIteration as e:",
+                "        e.reraise()"
+            ]
+        elif missing is not None and op is _get_bracket:
+            lines += [
+                "    if type(current) is dict:",
+                f"        current = current.get({arg_name}, missing)",
+                "        if current is missing:",
+                "            return missing",
+                "    else:",
+                f"        current = current[{arg_name}]"
+            ]
+        elif missing is not None and op is getattr and isinstance(op_arg, str):
+            lines += [
+                f"    current = getattr(current, {arg_name}, missing)",
+                "    if current is missing:",
+                "        return missing"
+            ]
+        elif op is getattr and isinstance(op_arg, str) \
+                and op_arg.isidentifier() and not keyword.iskeyword(op_arg):
+            lines.append(f"    current = current.{op_arg}")
+        elif op is _get_bracket:
+            lines.append(f"    current = current[{arg_name}]")
+        else:
+            op_name = f"op{index}"
+            namespace[op_name] = op
+            lines.append(f"    current = {op_name}(current, {arg_name})")
+        lines += check_coroutine(index + 1)
+    else:
+        lines.append("    return current")
+
+    exec("\n".join(lines), namespace)
+    return namespace["evaluate"]
+
+
 class _GetChainLink(object):
     """
     _GetChainLink
@@ -54,9 +372,33 @@ class _GetChainLink(object):
     data to extract from) and use them in the square brackets to apply
     that operation at that particular point in time.
 
+    Resolving a chain used to mean one nested call per link on
+    the way back up through its parents. Instead, each chain flattens
+    itself into a list of (op, op_arg) steps and runs them in a loop;
+    after it's been called _COMPILE_THRESHOLD times (or as soon as you
+    call .compile() on it), it swaps that loop for a generated function
+    with one statement per step. Either way, if anything along the way
+    turns out to be a coroutine, the rest of the chain gets resolved
+    asynchronously and you get a coroutine back.[2]
+
+    Links are small (__slots__) and interned: building the same chain
+    twice, anywhere, gives back the same link (as long as its keys are
+    hashable), so identical chains share their steps and compiled code.
+    Chains compare and hash by the steps they run, so they can be used
+    as dict keys (e.g. for caches and tries).
+
     [1] If your source dict key is a callable, you will have to use
         shapyro.Get[shapyro.KeyOrDefault(your_callable)] to get at it.
+
+    [2] Because of this, shapyro.Get.compile is the method rather than
+        a deferred getattr(source, "compile"); use
+        shapyro.Get[shapyro.FromAttr("compile")] if you need the latter.
     """
+    __slots__ = (
+        "__parent", "__op", "__op_arg", "__steps", "__evaluate", "__calls",
+        "__hash", "__weakref__"
+    )
+
     def __init__(self, parent=None, op=None, op_arg=None):
         """
         parent is the previous access step
@@ -66,109 +408,36 @@ class _GetChainLink(object):
             it's expected to transform the result into something to
             pass down the line
         """
-        def _call(source):
-            """
-            Run the entire chain on source
-
-            This will recurse up the chain (i.e. each
-            _GetChainLink calling into its self.__parent)
-            before running this chain link's operation with
-            op arg and returning the result (either to its
-            child or to the actual caller)
-            """
-            def _shapyro_Get_resolve_from_current(current):
-                """
-                This part will just resolve what the current op
-                on the current link is. We're defining it here
-                so that we can re-use the functionality if we
-                happen to hit an asyncio coroutine vs. inlining
-                the whole thing.
-                """
-                if callable(op_arg):
-                    # Means we want to do an operation
-                    # while we're doing the get
-                    # The operation will completely
-                    # transform the result, and that
-                    # transformation is what should go
-                    # down the line
-                    try:
-                        result = op_arg(current)
-                    except SkipIteration as e:
-                        # SkipIteration doesn't have any
-                        # special meaning to shapyro.Get
-                        # see shapyro.op for more details
-                        # but we want to raise whatever
-                        # got SkipIteration'd
-                        e.reraise()
-                elif op is None:
-                    # noop: identity
-                    result = current
-                else:
-                    result = op(current, op_arg)
-                
-                return result
-
-            async def _shapyro_async_Get_resolve(current, result=None):
-                """
-                Either parent or current link is asyncio coroutine
-                So we must await the parent or the current or both
-                """
-
-                # maybe await parent
-                if asyncio.iscoroutine(current):
-                    current = await current
-                
-                if result is None:
-                    # XXX: if it turned out the result of the current
-                    # op is None, we technically take a slight perf hit
-                    # here from doing it again ¯\_(ツ)_/¯
-                    result = _shapyro_Get_resolve_from_current(current)
-
-                if asyncio.iscoroutine(result):
-                    result = await result
-                
-                return result
-            
-
-            # Recurse up the chain
-            if parent:
-                current = parent(source)
-            else:
-                current = source
+        self.__parent = parent
+        self.__op = op
+        self.__op_arg = op_arg
+        # Filled in lazily: the flattened steps on first call,
+        # the generated evaluator on compile()
+        self.__steps = None
+        self.__evaluate = None
+        self.__calls = 0
+        self.__hash = None
 
-            if asyncio.iscoroutine(current):
-                # We have to return the coroutine that
-                # resolves this chain
-                return _shapyro_async_Get_resolve(current)
-            else:
-                # Parent was fine, let's try this link
-                result = _shapyro_Get_resolve_from_current(current)
-                if asyncio.iscoroutine(result):
-                    # We have to return the coroutine that
-                    # resolves this chain
-                    return _shapyro_async_Get_resolve(current, result)
-                else:
-                    # We're all sync, so we're all good
-                    return result
-        
-        def _repr():
-            if op is None and parent is None:
-                return "shapyro.Get"
-            else:
-                if op is getattr:
-                    return f"{parent.__repr__()}.{op_arg}"
-                elif op is _get_bracket:
-                    if callable(op_arg):
-                        return f"{parent.__repr__()}[{op_arg.__name__}(...)]"
-                    else:
-                        return f"{parent.__repr__()}[{op_arg.__repr__()}]"
-        self.__call_repr = (_call, _repr)
+    def __get_steps(self):
+        """
+        Flatten the chain into (op, op_arg) steps, root first
+        """
+        if self.__steps is None:
+            steps = []
+            link = self
+            while link is not None:
+                if link.__op is not None or callable(link.__op_arg):
+                    steps.append((link.__op, link.__op_arg))
+                link = link.__parent
+            steps.reverse()
+            self.__steps = tuple(steps)
+        return self.__steps
 
     def __getattr__(self, target_attr):
         """
         shapyro.Get.something
         """
-        return _GetChainLink(self, getattr, target_attr)
+        return _link(self, getattr, target_attr)
 
     def __getitem__(self, target_whatever):
         """
@@ -176,15 +445,223 @@ class _GetChainLink(object):
         or
         shapyro.Get[FromAttr("something","default")]
         """
-        return _GetChainLink(self, _get_bracket, target_whatever)
+        return _link(self, _get_bracket, target_whatever)
     
     def __repr__(self):
-        _, _repr = self.__call_repr
-        return _repr()
-    
+        op, op_arg, parent = self.__op, self.__op_arg, self.__parent
+        if op is None and parent is None:
+            return "shapyro.Get"
+        else:
+            if op is getattr:
+                return f"{parent.__repr__()}.{op_arg}"
+            elif op is _get_bracket:
+                if callable(op_arg):
+                    name = getattr(op_arg, "__name__", type(op_arg).__name__)
+                    return f"{parent.__repr__()}[{name}(...)]"
+                else:
+                    return f"{parent.__repr__()}[{op_arg.__repr__()}]"
+
+    def __eq__(self, other):
+        if type(other) is not _GetChainLink:
+            return NotImplemented
+        if hash(self) != hash(other):
+            return False
+        link = self
+        while link is not other:
+            if link is None or other is None:
+                return False
+            # types are part of it so e.g. [1] and [True] stay apart
+            if link.__op is not other.__op or not _same_arg(link.__op_arg, other.__op_arg):
+                return False
+            link, other = link.__parent, other.__parent
+        return True
+
+    def __hash__(self):
+        if self.__hash is None:
+            # From the nearest link that already has one down to
+            # this one, so that long chains don't recurse
+            unhashed = []
+            link = self
+            while link is not None and link.__hash is None:
+                unhashed.append(link)
+                link = link.__parent
+            parent_hash = None if link is None else link.__hash
+            for link in reversed(unhashed):
+                op_arg = link.__op_arg
+                try:
+                    arg_hash = hash(op_arg)
+                except TypeError:
+                    # unhashable (e.g. a slice): equal chains still hash the same
+                    arg_hash = None
+                parent_hash = link.__hash = hash((parent_hash, link.__op, type(op_arg), arg_hash))
+        return self.__hash
+
+    def __reduce__(self):
+        # Pickle by what the chain *is* rather than the closures
+        # and generated code it may have picked up along the way
+        if self.__parent is None:
+            return "Get"
+        return (_link, (self.__parent, self.__op, self.__op_arg))
+
+    def compile(self):
+        """
+        compile
+
+        Turn this chain into a single flat evaluator right away
+        rather than waiting for it to be called _COMPILE_THRESHOLD
+        times. Behavior (results, exceptions, async fallback) is
+        unchanged; only the per-call overhead goes down.
+
+        Returns:
+            self, so it can be used inline:
+            get_image = shapyro.Get['spec']['containers'][0]['image'].compile()
+        """
+        if self.__evaluate is None:
+            self.__evaluate = _compile_steps(self.__get_steps())
+        return self
+
     def __call__(self, source):
-        _call, _ = self.__call_repr
-        return _call(source)
+        if _PROFILERS:
+            return _timed("chain", repr(self), self.compile().__evaluate, source)
+        evaluate = self.__evaluate
+        if evaluate is None:
+            self.__calls += 1
+            if self.__calls < _COMPILE_THRESHOLD:
+                return _run_steps(self.__get_steps(), source)
+            evaluate = self.compile().__evaluate
+        return evaluate(source)
 
 
 Get = _GetChainLink()
+
+
+# Every link that's been made (and is still in use), by its parent
+# and step; see _link
+_LINKS = weakref.WeakValueDictionary()
+
+
+def _link(parent, op, op_arg):
+    """
+    The link for op(op_arg) after parent: the one that's already
+    been made, if there is one, or a new one
+    """
+    if not _internable(op_arg):
+        return _GetChainLink(parent, op, op_arg)
+    # parent is kept alive by the link itself (which is all
+    # that keeps this entry around), so its id can't be reused
+    key = (id(parent), op, _arg_types(op_arg), op_arg)
+    link = _LINKS.get(key)
+    if link is None:
+        link = _LINKS.setdefault(key, _GetChainLink(parent, op, op_arg))
+    return link
+
+
+# Types whose equal values can always stand in for each other as keys
+# (as long as the types match too, which is part of a link's key)
+_INTERNED_TYPES = frozenset((str, int, float, bytes, bool, type(None)))
+
+
+def _internable(op_arg):
+    """
+    Whether a link for op_arg can be shared with every other link for
+    an equal one: it's a str, int, float, bytes, bool or None, something
+    only equal to itself (like a function), or a tuple of those. Anything
+    else might be equal to an arg that a __getitem__ treats differently
+    (e.g. numpy telling bool indexes from ints), or might not be hashable.
+    """
+    which_type = type(op_arg)
+    if which_type is tuple:
+        return all(_internable(item) for item in op_arg)
+    return which_type in _INTERNED_TYPES or which_type.__eq__ is object.__eq__
+
+
+def _arg_types(op_arg):
+    """
+    op_arg's type, or for a tuple the types of its items (all the
+    way down), so that (1,) and (True,) can be told apart
+    """
+    if type(op_arg) is tuple:
+        return tuple(_arg_types(item) for item in op_arg)
+    return type(op_arg)
+
+
+def _same_arg(arg, other):
+    """
+    Whether arg and other are equal and the same types all the way down
+    """
+    if type(arg) is not type(other):
+        return False
+    if type(arg) is tuple:
+        return len(arg) == len(other) and all(map(_same_arg, arg, other))
+    return arg == other
+
+
+def _chain_steps(chain):
+    """
+    The (op, op_arg) steps that chain runs, root first
+    """
+    return chain._GetChainLink__get_steps()
+
+
+def _chain_from_steps(steps):
+    """
+    A new chain that runs steps (the inverse of _chain_steps)
+    """
+    chain = Get
+    for op, op_arg in steps:
+        chain = _link(chain, op, op_arg)
+    return chain
+
+
+def _maybe_steps_function(steps, missing):
+    """
+    A function that does what _run_maybe_steps(steps, source, missing)
+    would, and compiles itself once it's been called enough (like a chain)
+    """
+    evaluate = None
+    calls = 0
+
+    def maybe_steps(source):
+        nonlocal evaluate, calls
+        if evaluate is None:
+            calls += 1
+            if calls < _COMPILE_THRESHOLD:
+                return _run_maybe_steps(steps, source, missing)
+            evaluate = _compile_steps(steps, missing)
+        return evaluate(source)
+    return maybe_steps
+
+
+def _steps_function(steps):
+    """
+    A plain function that does what _chain_from_steps(steps) would
+
+    Calling a function is cheaper than going through a chain's
+    __call__, which matters for callers (like shapyro.utils) that
+    run lots of short chains. Plain subscripts and attributes become
+    operator.itemgetter/attrgetter calls in a loop; anything with a
+    callable in it goes through a chain (and so gets compiled, etc).
+    """
+    getters = []
+    for op, op_arg in steps:
+        if callable(op_arg) or type(op_arg) is _Each:
+            break
+        elif op is _get_bracket:
+            getters.append(operator.itemgetter(op_arg))
+        elif op is getattr and isinstance(op_arg, str) and "." not in op_arg:
+            getters.append(operator.attrgetter(op_arg))
+        else:
+            break
+    else:
+        def run_getters(current):
+            if type(current) not in _SYNC_TYPES and asyncio.iscoroutine(current):
+                return _resume_steps(steps, current, 0)
+            index = 0
+            for getter in getters:
+                current = getter(current)
+                index += 1
+                if type(current) not in _SYNC_TYPES and asyncio.iscoroutine(current):
+                    return _resume_steps(steps, current, index)
+            return current
+        return run_getters
+    return _chain_from_steps(steps)
@@ -0,0 +1,348 @@
+
+#
+# Incremental re-porting
+#
+
+import asyncio
+import collections
+
+from shapyro.analysis import Attr, analyze
+from shapyro.getobj import Each
+from shapyro.op import SkipIteration
+from shapyro.utils import Template, _gather_into, compile
+
+
+__all__ = ["IncrementalPort", "Update"]
+
+
+# What an IncrementalPort call gives back
+Update = collections.namedtuple("Update", ["output", "patch"])
+
+
+class _Removed(object):
+    def __repr__(self):
+        return "IncrementalPort.REMOVED"
+
+
+# Stands in for a value that didn't come out of the last run
+_ABSENT = object()
+
+
+class IncrementalPort(object):
+    """
+    IncrementalPort
+
+    Parameters:
+        template: The "destination" object, exactly as you'd give it to port
+        key: callable(src): Which object a source is a version of (e.g.
+            shapyro.Get['metadata']['uid']); each one gets its own last
+            output. By default every source is a version of the same one.
+
+    Port new versions of the same objects over and over, redoing only
+    the parts of the template that read something that changed:
+
+    incremental = shapyro.IncrementalPort(template, key=shapyro.Get['metadata']['uid'])
+    for event in watch():
+        output, patch = incremental(event.object)
+        reconcile(patch)
+
+    The template is split into entries: every value in its dicts that
+    isn't a dict with constant keys itself (or the whole template, if
+    it isn't one of those). Each entry's source paths come from
+    shapyro.analyze. When a new version of an object comes in, its
+    source gets compared with the last one's (only where the template
+    reads it), and only entries that read something under a changed
+    path (or that something changed under) get run again. Pass the
+    changed source paths yourself, as tuples like the ones analyze gives,
+    to skip the comparison.
+
+    Unchanged parts of the output are shared with the last output
+    rather than copied, and the last source is kept as-is to compare
+    the next one against, so change neither in place (or pass changed).
+
+    Returns:
+        Calling it gives an Update(output, patch): output is what port
+        would have given, and patch maps the output path (a tuple of
+        keys) of every entry whose value changed to its new value, or
+        to IncrementalPort.REMOVED if it's been skipped this time. On
+        an object's first version, every entry is in the patch. If any
+        entry that ran gave back a coroutine, you get a coroutine for
+        the Update.
+    """
+    REMOVED = _Removed()
+
+    def __init__(self, template, key=None):
+        if isinstance(template, Template):
+            template = template.template
+        self.template = template
+        self.key = key
+        self._layout, self._entries = _split(template)
+        self._mask = analyze(template).projection()
+        # First step of a source path -> the entries that read under it;
+        # entries that read the whole source (or every element of it)
+        # get run for any change
+        self._by_step = {}
+        self._anywhere = []
+        for entry in self._entries:
+            try:
+                steps = {path[0] if path else None for path in entry.reads}
+            except TypeError:
+                # unhashable (e.g. a slice)
+                steps = {None}
+            if None in steps or Each in steps:
+                self._anywhere.append(entry)
+                continue
+            for step in steps:
+                self._by_step.setdefault(step, []).append(entry)
+        # key -> (src, {output path: value}, output)
+        self._last = {}
+
+    def __call__(self, src, changed=None):
+        """
+        Parameters:
+            src: The new version of the object
+            changed: iterable: The source paths that changed since the
+                last version, if you already know them
+        """
+        key = None if self.key is None else self.key(src)
+        last = self._last.get(key)
+        if last is None:
+            entries = self._entries
+        else:
+            if changed is None:
+                changed = self.diff(last[0], src)
+            entries = self._affected(changed)
+        results = []
+        must_async_resolve = False
+        for entry in entries:
+            try:
+                result = entry.plan(src)
+            except SkipIteration:
+                if not entry.path:
+                    raise
+                result = _ABSENT
+            if asyncio.iscoroutine(result):
+                must_async_resolve = True
+            results.append(result)
+        if must_async_resolve:
+            return self._finish_async(key, last, src, entries, results)
+        return self._finish(key, last, src, entries, results)
+
+    def diff(self, old, new):
+        """
+        diff
+
+        Parameters:
+            old: A source
+            new: A newer version of it
+
+        Returns:
+            list: The source paths, out of the ones the template reads,
+            that are different between old and new. A list (or anything
+            else that gets iterated with shapyro.Each) that changed length
+            counts as changed as a whole.
+        """
+        changed = []
+        _diff(old, new, self._mask, (), changed)
+        return changed
+
+    def forget(self, key=None):
+        """
+        forget
+
+        Parameters:
+            key: The object to drop the last output of (e.g. once it's
+                been deleted); its next version gets ported in full
+        """
+        self._last.pop(key, None)
+
+    def _affected(self, changed):
+        affected = set()
+        for path in changed:
+            path = tuple(path)
+            candidates = self._entries
+            if path and path[0] is not Each:
+                try:
+                    candidates = self._anywhere + self._by_step.get(path[0], [])
+                except TypeError:
+                    # unhashable (e.g. a slice)
+                    pass
+            for entry in candidates:
+                if entry not in affected and entry.reads_under(path):
+                    affected.add(entry)
+        # In template order
+        return [entry for entry in self._entries if entry in affected]
+
+    async def _finish_async(self, key, last, src, entries, results):
+        return self._finish(key, last, src, entries, await _gather_into(results))
+
+    def _finish(self, key, last, src, entries, results):
+        if last is None:
+            values = {}
+            output = None
+        else:
+            _, values, output = last
+        patch = {}
+        for entry, result in zip(entries, results):
+            path = entry.path
+            old = values.get(path, _ABSENT)
+            if result is _ABSENT:
+                if old is not _ABSENT:
+                    del values[path]
+                    patch[path] = self.REMOVED
+            else:
+                values[path] = result
+                if old is _ABSENT or _differs(old, result):
+                    patch[path] = result
+        if output is None or patch:
+            dirty = None if output is None else _dirty(patch)
+            output = _assemble(self._layout, values, output, dirty, ())
+        self._last[key] = (src, values, output)
+        return Update(output, patch)
+
+    def __repr__(self):
+        return f"shapyro.IncrementalPort({self.template!r})"
+
+
+class _Entry(object):
+    """
+    One separately re-run piece of an IncrementalPort's template
+    """
+    def __init__(self, path, template):
+        self.path = path
+        self.plan = compile(template)
+        analysis = analyze(template)
+        self.reads = analysis.reads + analysis.opaque
+
+    def reads_under(self, changed):
+        """
+        Whether anything this reads is at, under or over the source path changed
+        """
+        for path in self.reads:
+            for step, changed_step in zip(path, changed):
+                if step != changed_step and step is not Each and changed_step is not Each:
+                    break
+            else:
+                return True
+        return False
+
+
+def _split(template):
+    """
+    The layout of template's output (nested dicts of
+    constant keys, with an _Entry at every leaf) and its entries
+    """
+    entries = []
+    # An explicit stack, so that templates can go as deep as port lets
+    # them; each item is (template, path, the layout it goes in, key)
+    top = {}
+    stack = [(template, (), top, None)]
+    while stack:
+        template, path, parent, key = stack.pop()
+        if type(template) is dict and not any(
+                callable(k) or asyncio.iscoroutine(k) for k in template):
+            # Keys go in now so that they stay in template order
+            layout = parent[key] = dict.fromkeys(template)
+            stack.extend((v, path + (k,), layout, k) for k, v in reversed(template.items()))
+        else:
+            entry = parent[key] = _Entry(path, template)
+            entries.append(entry)
+    return top[None], entries
+
+
+def _dirty(patch):
+    """
+    Every output path that something in patch is at or under, as
+    nested dicts (one level per step, so that long paths don't
+    get hashed over and over)
+    """
+    dirty = {}
+    for path in patch:
+        level = dirty
+        for step in path:
+            level = level.setdefault(step, {})
+    return dirty
+
+
+def _assemble(layout, values, last_output, dirty, path):
+    """
+    The output for layout at path, reusing last_output
+    for everything that isn't dirty
+    """
+    if isinstance(layout, _Entry):
+        return values[path]
+    top = {}
+    # Like _split: (layout, last_output, dirty, path, the output it goes in, key)
+    stack = [(layout, last_output, dirty, path, top, None)]
+    while stack:
+        layout, last_output, dirty, path, parent, key = stack.pop()
+        output = parent[key] = {}
+        for k, below in layout.items():
+            below_path = path + (k,)
+            if isinstance(below, _Entry):
+                value = values.get(below_path, _ABSENT)
+                if value is not _ABSENT:
+                    output[k] = value
+            elif last_output is None or k in dirty:
+                # Filled in once it's off the stack; in place now to keep the order
+                output[k] = None
+                stack.append((
+                    below, None if last_output is None else last_output[k],
+                    None if last_output is None else dirty[k], below_path, output, k
+                ))
+            else:
+                output[k] = last_output[k]
+    return top[None]
+
+
+def _differs(old, new):
+    if old is new:
+        return False
+    try:
+        return bool(old != new)
+    except Exception:
+        # e.g. numpy arrays, which won't say
+        return True
+
+
+def _diff(old, new, mask, path, changed):
+    """
+    Add the paths under path (out of the ones in mask,
+    a projection) where old and new differ to changed
+    """
+    if old is new:
+        return
+    if mask is True:
+        if _differs(old, new):
+            changed.append(path)
+        return
+    for step, below in mask.items():
+        if step is Each:
+            try:
+                old_items = list(old)
+                new_items = list(new)
+            except TypeError:
+                changed.append(path)
+                return
+            if len(old_items) != len(new_items):
+                changed.append(path)
+                return
+            for index, (old_item, new_item) in enumerate(zip(old_items, new_items)):
+                _diff(old_item, new_item, below, path + (index,), changed)
+            continue
+        old_value = _step(old, step)
+        new_value = _step(new, step)
+        if old_value is _ABSENT or new_value is _ABSENT:
+            if old_value is not new_value:
+                changed.append(path + (step,))
+            continue
+        _diff(old_value, new_value, below, path + (step,), changed)
+
+
+def _step(value, step):
+    if type(step) is Attr:
+        return getattr(value, step.name, _ABSENT)
+    try:
+        return value[step]
+    except (KeyError, IndexError, TypeError):
+        return _ABSENT
@@ -1,12 +1,29 @@
 
+import asyncio
+import collections
+import collections.abc
+import concurrent.futures
+import contextvars
 import functools
+import keyword
+import os
+import re
+import string
+import threading
+import time
+import weakref
 
 __all__ = [
     "FromAttr",
     "KeyOrDefault",
+    "Batched",
+    "Blocking",
+    "Cached",
     "OnlyIfExists",
+    "Pure",
     "StringTemplate",
-    "SkipIteration"
+    "SkipIteration",
+    "format_many"
 ]
 
 
@@ -40,6 +57,45 @@ class SkipIteration(Exception):
             raise TypeError("SkipIteration without cause told to reraise")
 
 
+# What shapyro.utils' plans hand back internally, instead of raising
+# SkipIteration, for an OnlyIfExists entry that isn't there. Building
+# and unwinding exceptions is most of what a missing optional key
+# costs; SkipIteration is still how anything else asks to skip.
+_SKIPPED = object()
+
+
+class _CompositeCall(object):
+    """
+    What calling a @Composite function gives you: something that
+    takes source and calls the original function with source and
+    the parameters it was given.
+
+    This is a class rather than a closure so that it can be pickled
+    (as the composite function plus its parameters) and so that
+    shapyro.compile can see what it was built from.
+    """
+    def __init__(self, composite, func, args, kwargs):
+        functools.update_wrapper(self, func)
+        self.composite = composite
+        self.args = args
+        self.kwargs = kwargs
+
+    def __call__(self, source):
+        # Call the composite with the source
+        # data and the parameters
+        return self.__wrapped__(source, *self.args, **self.kwargs)
+
+    def __reduce__(self):
+        if self.kwargs:
+            return (functools.partial(self.composite, **self.kwargs), self.args)
+        return (self.composite, self.args)
+
+    def __repr__(self):
+        params = [repr(arg) for arg in self.args]
+        params += [f"{k}={v!r}" for k, v in self.kwargs.items()]
+        return f"{self.__name__}({', '.join(params)})"
+
+
 def Composite(func):
     """
     Composite
@@ -54,7 +110,7 @@ def Composite(func):
 
     The composite_func captures the subsequent parameters
     for callable (like a partial, but for the tail
-    rather than the head) and returns a function source_data
+    rather than the head) and returns a callable source_data
     with signature:
     
     source_data(source)
@@ -74,20 +130,20 @@ def Composite(func):
     *function* is what is called on the input data to get
     the actual final result.
 
+    As long as the decorated function lives at the top level
+    of its module and its parameters can be pickled, so can
+    source_data (e.g. to send templates to other processes).
+
     For documented @shapyro.Composite functions, an *ultimate*
     return will be documented instead of the direct return,
     which will always be a function that takes one parameter:
     the value to operate on.
     """
     # Take the parameters
+    @functools.wraps(func)
     def composite_func(*args, **kwargs):
         # Take the data to apply to
-        @functools.wraps(func)
-        def source_data(source):
-            # Call the composite with the source
-            # data and the parameters
-            return func(source, *args, **kwargs)
-        return source_data
+        return _CompositeCall(composite_func, func, args, kwargs)
     return composite_func
 
 
@@ -168,6 +224,9 @@ def KeyOrDefault(source, key_name, *default):
         If no default: KeyError for dicts, IndexError for sequences
         (if you're not using a default, you should use shapyro.Get[])
     """
+    if default and type(source) is dict:
+        # Same as below, minus the KeyError
+        return source.get(key_name, default[0])
     try:
         return source[key_name]
     except (KeyError, IndexError) as e:
@@ -195,6 +254,12 @@ def StringTemplate(source, template, resolver=None):
     You *can* use it in shapyro.Get[] like shapyro.Get[shapyro.StringTemplate(...)]
     but it's probably more readable on its own.
 
+    Each template string only gets parsed once: for a plain dict, list or
+    tuple source, the fields it uses ({a[b][0]}, {user.email} and so on)
+    are looked up straight from source, rather than unpacking all of
+    source into template.format. Anything else goes to template.format
+    as-is. To fill in the same template from many sources, see format_many.
+
     Example:
 
     a = shapyro.StringTemplate("Hello, {name}")
@@ -208,12 +273,214 @@ def StringTemplate(source, template, resolver=None):
     """
     if callable(resolver):
         source = resolver(source)
+    which_type = type(source)
+    if which_type is dict:
+        render = _format_renderers(template)[0]
+    elif which_type is list or which_type is tuple:
+        render = _format_renderers(template)[1]
+    else:
+        render = None
+    if render is not None:
+        return render(source)
     if isinstance(source, dict):
         return template.format(**source)
     else:
         return template.format(*source)
 
 
+def format_many(template, sources, resolver=None):
+    """
+    format_many
+
+    Parameters:
+        template: str: A string template to be filled with values from each source
+        sources: iterable: The sources (see StringTemplate)
+        resolver: Callable[obj => list/dict]: resolver(source) -- convert each
+            source to a .format'able data type
+
+    StringTemplate(template, resolver)(source) for every source, in one go:
+
+    shapyro.format_many("{kind}/{name}", objects)   # ["Pod/web", "Service/web", ...]
+
+    Returns:
+        list: The strings, in the same order as sources
+    """
+    for_dict, for_seq = _format_renderers(template)
+    rendered = []
+    for source in sources:
+        if resolver is not None:
+            source = resolver(source)
+        which_type = type(source)
+        if which_type is dict and for_dict is not None:
+            rendered.append(for_dict(source))
+        elif (which_type is list or which_type is tuple) and for_seq is not None:
+            rendered.append(for_seq(source))
+        elif isinstance(source, dict):
+            rendered.append(template.format(**source))
+        else:
+            rendered.append(template.format(*source))
+    return rendered
+
+
+# Format specs that can go straight into generated f-strings
+_PLAIN_SPEC = re.compile(r"[\w<>=^+\- .,%#]*")
+
+
+@functools.lru_cache(maxsize=1024)
+def _format_renderers(template):
+    """
+    Functions that do what template.format(**source) would for a
+    plain dict source, and what template.format(*source) would for a
+    list or tuple source, without parsing template again or unpacking
+    source. Each is one generated f-string that looks up just the fields
+    template uses, straight from source.
+
+    Returns:
+        (for_dict, for_seq): either of them is None if template
+        would fail for that kind of source, or can't be compiled
+        (so that str.format gets to raise whatever it would)
+    """
+    try:
+        fields = _format_fields(template, [0])
+    except (ValueError, TypeError):
+        # Not a valid template; leave it to str.format to say why
+        return None, None
+    named = any(type(first) is str for first in fields)
+    positional = any(type(first) is int for first in fields)
+    namespace = {}
+    code = f"lambda source: f'{_format_code(template, namespace, [0])}'"
+    try:
+        render = eval(code, namespace)
+    except SyntaxError:
+        # Something str.format takes that an f-string doesn't (like specs
+        # nested too deeply); str.format can do it (or raise) itself
+        return None, None
+    return (None if positional else render), (None if named else render)
+
+
+def _format_fields(template, auto):
+    """
+    The first part of every field in template (and in their specs),
+    after checking them all over like str.format would
+
+    Raises:
+        ValueError for anything str.format wouldn't take
+    """
+    fields = []
+    for _, field, spec, conversion in _FORMATTER.parse(template):
+        if field is None:
+            continue
+        if conversion not in (None, "r", "s", "a"):
+            raise ValueError(f"Unknown conversion specifier {conversion}")
+        first, _ = _split_field_name(field)
+        if first == "":
+            if auto[0] is None:
+                raise ValueError("can't switch from manual field numbering to automatic")
+            first = auto[0]
+            auto[0] += 1
+        elif type(first) is int:
+            if auto[0]:
+                raise ValueError("can't switch from automatic field numbering to manual")
+            auto[0] = None
+        fields.append(first)
+        if spec:
+            fields += _format_fields(spec, auto)
+    return fields
+
+
+def _format_code(template, namespace, auto):
+    """
+    The inside of an f-string that does what template.format does,
+    with every key and attribute it looks up put into namespace
+    """
+    parts = []
+    for literal, field, spec, conversion in _FORMATTER.parse(template):
+        if literal:
+            literal = literal.encode("unicode_escape").decode("ascii")
+            parts.append(literal.replace("'", "\\'").replace("{", "{{").replace("}", "}}"))
+        if field is None:
+            continue
+        first, rest = _split_field_name(field)
+        if first == "":
+            first = auto[0]
+            auto[0] += 1
+        expression = f"source[{_format_constant(first, namespace)}]"
+        for is_attr, key in rest:
+            # (Only ASCII names, since the parser would normalize any others)
+            if is_attr and key.isascii() and key.isidentifier() and not keyword.iskeyword(key):
+                expression += f".{key}"
+            elif is_attr:
+                expression = f"getattr({expression}, {_format_constant(key, namespace)})"
+            else:
+                expression += f"[{_format_constant(key, namespace)}]"
+        if conversion:
+            expression += f"!{conversion}"
+        if spec:
+            if "{" in spec:
+                expression += f":{_format_code(spec, namespace, auto)}"
+            elif _PLAIN_SPEC.fullmatch(spec):
+                expression += f":{spec}"
+            else:
+                expression += f":{{{_format_constant(spec, namespace)}}}"
+        parts.append(f"{{{expression}}}")
+    return "".join(parts)
+
+
+def _format_constant(value, namespace):
+    name = f"k{len(namespace)}"
+    namespace[name] = value
+    return name
+
+
+_FORMATTER = string.Formatter()
+
+
+def _split_field_name(field):
+    """
+    What str.format looks up for a field name: its first part (an int
+    if it's a number, "" for an automatically numbered one) and then
+    (is_attr, key) for each .attr or [key] after that, with keys that
+    are numbers as ints
+
+    Raises:
+        ValueError for a field name that str.format wouldn't take
+    """
+    end = len(field)
+    for index, char in enumerate(field):
+        if char == "." or char == "[":
+            end = index
+            break
+    first = field[:end]
+    if first.isdecimal():
+        first = int(first)
+    rest = []
+    index = end
+    while index < len(field):
+        if field[index] == ".":
+            start = index + 1
+            index = start
+            while index < len(field) and field[index] not in ".[":
+                index += 1
+            is_attr = True
+            key = field[start:index]
+        else:
+            start = index + 1
+            index = field.find("]", start)
+            if index == -1:
+                raise ValueError("Missing ']' in format string")
+            is_attr = False
+            key = field[start:index]
+            index += 1
+            if index < len(field) and field[index] not in ".[":
+                raise ValueError("Only '.' or '[' may follow ']' in format field specifier")
+        if not key:
+            raise ValueError("Empty attribute in format string")
+        if not is_attr and key.isdecimal():
+            key = int(key)
+        rest.append((is_attr, key))
+    return first, rest
+
+
 @Composite
 def OnlyIfExists(source, key):
     """
@@ -271,3 +538,436 @@ def OnlyIfExists(source, key):
     except (KeyError, AttributeError, IndexError,
             ValueError, TypeError, SkipIteration) as e:
         raise SkipIteration(e)
+
+
+class Pure(object):
+    """
+    Pure
+
+    Parameters:
+        fn: callable(source): The callable to mark as pure
+
+    Pure wraps a callable that depends on nothing but its source
+    and has no side effects, so that shapyro.port (and friends)
+    with memo=True may call it just once per source no matter how
+    many times it appears in the template:
+
+    owner = shapyro.Pure(lookup_owner)
+    tpl = {"owner": owner, "contact": {"name": owner, "id": shapyro.Get['id']}}
+    shapyro.port(src, tpl, memo=True)   # lookup_owner(src) gets called once
+
+    If fn is async, its coroutine gets awaited once and everything
+    that uses it shares the result. Wrapping the same fn twice
+    gives two Pures that compare equal, so they're shared as well.
+
+    Without memo, a Pure is called just like fn would be.
+
+    Ultimate return:
+        object: fn(source)
+    """
+    def __init__(self, fn):
+        if not callable(fn):
+            raise TypeError(f"Pure needs a callable, not {type(fn).__name__}")
+        self.fn = fn
+
+    def __call__(self, source):
+        return self.fn(source)
+
+    def __eq__(self, other):
+        if type(other) is not Pure:
+            return NotImplemented
+        return self.fn == other.fn
+
+    def __hash__(self):
+        return hash(self.fn)
+
+    def __repr__(self):
+        return f"Pure({self.fn!r})"
+
+
+class Blocking(object):
+    """
+    Blocking
+
+    Parameters:
+        fn: callable(source): A callable that blocks (file or database
+            reads, CPU-heavy parsing...)
+        executor: concurrent.futures.Executor: Where to run fn when it
+            gets offloaded (default: a thread pool shared by every
+            Blocking, with at most _BLOCKING_WORKERS threads)
+
+    Blocking wraps a callable that would otherwise stall the event
+    loop when it's called from an async port:
+
+    tpl = {"owner": shapyro.Blocking(lookup_owner_in_sqlite), "quota": fetch_quota}
+    await shapyro.port(src, tpl, offload=True)   # lookup_owner_in_sqlite runs in a thread
+
+    In a port with offload=True (which has to be awaited inside an
+    event loop), fn runs in executor and you get a coroutine for its
+    result (so the port goes async, and fn overlaps with whatever
+    else it's waiting on, within its max_concurrency). Otherwise fn
+    just gets called right there, so a port that was sync stays sync
+    whether or not there happens to be an event loop running.
+
+    Ultimate return:
+        object: fn(source), or a coroutine for it
+    """
+    def __init__(self, fn, executor=None):
+        if not callable(fn):
+            raise TypeError(f"Blocking needs a callable, not {type(fn).__name__}")
+        self.fn = fn
+        self.executor = executor
+
+    def __call__(self, source):
+        if _offloading.get():
+            return self._offload(source)
+        return self.fn(source)
+
+    async def _offload(self, source):
+        executor = self.executor
+        if executor is None:
+            executor = _blocking_executor()
+        # Like asyncio.to_thread, fn sees the caller's context variables
+        call = functools.partial(contextvars.copy_context().run, self.fn, source)
+        return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+    def __reduce__(self):
+        return (Blocking, (self.fn, self.executor))
+
+    def __repr__(self):
+        return f"Blocking({self.fn!r})"
+
+
+# Whether the port that's running asked for Blocking callables to be offloaded
+_offloading = contextvars.ContextVar("shapyro_offloading", default=False)
+
+# The most threads the default Blocking executor will use
+_BLOCKING_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+_blocking_pool = None
+_blocking_pool_lock = threading.Lock()
+
+
+def _blocking_executor():
+    """
+    The default Blocking executor, started the first time it's needed
+    """
+    global _blocking_pool
+    if _blocking_pool is None:
+        with _blocking_pool_lock:
+            if _blocking_pool is None:
+                _blocking_pool = concurrent.futures.ThreadPoolExecutor(
+                    _BLOCKING_WORKERS, thread_name_prefix="shapyro-blocking"
+                )
+    return _blocking_pool
+
+
+CacheInfo = collections.namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class Cached(object):
+    """
+    Cached
+
+    Parameters:
+        fn: callable(source): The (expensive) callable to cache the results of
+        key: callable(source): What to cache fn's results by, e.g. a
+            shapyro.Get chain (default: source itself)
+        maxsize: int: How many results to keep, dropping the least
+            recently used ones first (None for no limit)
+        ttl: float: How many seconds a result is good for (None for forever);
+            expired results get dropped as new ones come in, even with
+            maxsize None
+
+    Cached remembers what fn returned across calls -- and so across
+    ports of different sources -- for sources with the same key:
+
+    owner = shapyro.Cached(lookup_owner, key=shapyro.Get['owner_id'], maxsize=10000, ttl=60)
+    tpl = {"id": shapyro.Get['id'], "owner": owner}
+    [shapyro.port(src, tpl) for src in sources]   # one lookup per owner_id
+    owner.cache_info()   # CacheInfo(hits=..., misses=..., maxsize=10000, currsize=...)
+
+    It works anywhere a callable does, e.g. shapyro.Get['user'][Cached(...)].
+
+    If fn is async, what gets cached is its coroutine (run once, the
+    first time something awaits it), so callers that want the same key
+    while it's still running all wait on that one run rather than
+    starting their own. (Exceptions don't
+    get cached, whether fn is async or not.) A source whose key can't
+    be hashed just gets passed to fn every time, and counts as a miss.
+
+    Ultimate return:
+        object: fn(source), or what it was the last time for the same key
+    """
+    def __init__(self, fn, key=None, maxsize=1024, ttl=None):
+        if not callable(fn):
+            raise TypeError(f"Cached needs a callable, not {type(fn).__name__}")
+        if maxsize is not None and (not isinstance(maxsize, int) or maxsize < 1):
+            raise ValueError(f"maxsize must be a positive int or None, not {maxsize!r}")
+        if ttl is not None and ttl <= 0:
+            raise ValueError(f"ttl must be positive or None, not {ttl!r}")
+        self.fn = fn
+        self.key = key
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (expiry or None, result), least recently used first
+        self._results = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def __call__(self, source):
+        key = source if self.key is None else self.key(source)
+        now = time.monotonic() if self.ttl is not None else None
+        try:
+            with self._lock:
+                cached = self._results.get(key)
+                if cached is not None and (now is None or cached[0] > now):
+                    self._results.move_to_end(key)
+                    self._hits += 1
+                    return self._result(cached[1])
+                self._misses += 1
+        except TypeError:
+            # unhashable key
+            with self._lock:
+                self._misses += 1
+            return self.fn(source)
+
+        result = self.fn(source)
+        if asyncio.iscoroutine(result):
+            result = _SharedCall(result, functools.partial(self._forget_failure, key))
+        with self._lock:
+            self._results[key] = (None if now is None else now + self.ttl, result)
+            self._results.move_to_end(key)
+            if now is not None:
+                self._drop_expired(now)
+            if self.maxsize is not None and len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+        return self._result(result)
+
+    def _drop_expired(self, now, everywhere=False):
+        """
+        Drop expired results from the least recently used end, up to
+        the first one that hasn't expired (or all of them, everywhere)
+        """
+        results = self._results
+        if everywhere:
+            for key in [key for key, (expiry, _) in results.items() if expiry <= now]:
+                del results[key]
+            return
+        while results:
+            key, (expiry, _) = next(iter(results.items()))
+            if expiry > now:
+                return
+            del results[key]
+
+    @staticmethod
+    def _result(result):
+        if type(result) is _SharedCall:
+            return result.get()
+        return result
+
+    def _forget_failure(self, key, shared):
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[1] is shared:
+                del self._results[key]
+
+    def cache_info(self):
+        """
+        Returns:
+            CacheInfo: hits, misses, maxsize and currsize (like functools.lru_cache)
+        """
+        with self._lock:
+            if self.ttl is not None:
+                self._drop_expired(time.monotonic(), everywhere=True)
+            return CacheInfo(self._hits, self._misses, self.maxsize, len(self._results))
+
+    def cache_clear(self):
+        """
+        Forget every result (and reset the stats)
+        """
+        with self._lock:
+            self._results.clear()
+            self._hits = 0
+            self._misses = 0
+
+    def __reduce__(self):
+        # The cache itself stays behind
+        return (Cached, (self.fn, self.key, self.maxsize, self.ttl))
+
+    def __repr__(self):
+        return f"Cached({self.fn!r}, key={self.key!r}, maxsize={self.maxsize!r}, ttl={self.ttl!r})"
+
+
+class _SharedCall(object):
+    """
+    A coroutine that any number of callers can await (each through
+    their own get()), which only runs once
+
+    It only turns into a task once something awaits it, since it may
+    well have been made outside of any event loop. If it fails,
+    on_failure(self) gets called.
+    """
+    def __init__(self, coro, on_failure):
+        self.coro = coro
+        self.on_failure = on_failure
+        self.task = None
+
+    async def get(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.coro)
+            self.task.add_done_callback(self._done)
+        # Shielded, so that one caller getting cancelled
+        # doesn't cancel it for everyone else
+        return await asyncio.shield(self.task)
+
+    def _done(self, task):
+        if task.cancelled() or task.exception() is not None:
+            self.on_failure(self)
+
+
+class Batched(object):
+    """
+    Batched
+
+    Parameters:
+        batch_fn: callable(keys): Looks up a list of keys all at once
+            (async or not), giving back either a list of results in the
+            same order or a dict (or other mapping) of key to result
+        key: callable(source): What to look up for a source, e.g. a
+            shapyro.Get chain (default: source itself)
+        max_batch: int: The most keys to give batch_fn at once
+        max_wait_ms: float: How long to wait for more keys once there's
+            one (by default, only as long as it takes for everything
+            else that's ready to run to have a go)
+
+    Batched lets the ports that are running at the same time share
+    lookups, so that porting N sources takes a few calls to batch_fn
+    rather than N calls to a single-key lookup:
+
+    owner = shapyro.Batched(fetch_users, key=shapyro.Get['owner_id'], max_batch=500)
+    tpl = {"id": shapyro.Get['id'], "owner": owner}
+    async for row in shapyro.port_many_async(sources, tpl):
+        ...
+
+    Calling it gives a coroutine (so the port goes async). Each key it
+    gets awaited for is queued up along with the others for the same
+    event loop, and once max_wait_ms is up (or there are max_batch of
+    them) they go to batch_fn together, each key only once however
+    many ports asked for it. If batch_fn raises, so does every await
+    of a key in that batch; a key that's missing from a mapping
+    raises KeyError. A key that can't be hashed raises TypeError.
+
+    Ultimate return:
+        object: A coroutine for batch_fn's result for key(source)
+    """
+    def __init__(self, batch_fn, key=None, max_batch=100, max_wait_ms=None):
+        if not callable(batch_fn):
+            raise TypeError(f"Batched needs a callable, not {type(batch_fn).__name__}")
+        if not isinstance(max_batch, int) or max_batch < 1:
+            raise ValueError(f"max_batch must be a positive int, not {max_batch!r}")
+        if max_wait_ms is not None and max_wait_ms < 0:
+            raise ValueError(f"max_wait_ms can't be negative, not {max_wait_ms!r}")
+        self.batch_fn = batch_fn
+        self.key = key
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        # event loop -> its _Batch that's still taking keys
+        self._batches = weakref.WeakKeyDictionary()
+        # batch_fn calls in progress (event loops only keep weak references)
+        self._running = set()
+
+    def __call__(self, source):
+        key = source if self.key is None else self.key(source)
+        return self._load(key)
+
+    async def _load(self, key):
+        hash(key)
+        loop = asyncio.get_running_loop()
+        batch = self._batches.get(loop)
+        if batch is None:
+            batch = self._batches[loop] = _Batch()
+            if self.max_wait_ms is None:
+                batch.handle = loop.call_soon(self._dispatch, loop, batch)
+            else:
+                batch.handle = loop.call_later(self.max_wait_ms / 1000, self._dispatch, loop, batch)
+        future = batch.futures.get(key)
+        if future is None:
+            future = batch.futures[key] = loop.create_future()
+            if len(batch.futures) >= self.max_batch:
+                batch.handle.cancel()
+                self._dispatch(loop, batch)
+        # Shielded, so that one caller getting cancelled
+        # doesn't cancel it for everyone else
+        return await asyncio.shield(future)
+
+    def _dispatch(self, loop, batch):
+        if self._batches.get(loop) is batch:
+            del self._batches[loop]
+        task = loop.create_task(self._run(batch.futures))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, futures):
+        keys = list(futures)
+        try:
+            results = self.batch_fn(keys)
+            if asyncio.iscoroutine(results):
+                results = await results
+            if isinstance(results, collections.abc.Mapping):
+                results = [
+                    results[key] if key in results else _Missing(KeyError(key))
+                    for key in keys
+                ]
+            else:
+                results = list(results)
+                if len(results) != len(keys):
+                    raise ValueError(
+                        f"batch_fn gave {len(results)} results for {len(keys)} keys"
+                    )
+        except asyncio.CancelledError:
+            for future in futures.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, result in zip(keys, results):
+            future = futures[key]
+            if future.done():
+                continue
+            if type(result) is _Missing:
+                future.set_exception(result.error)
+            else:
+                future.set_result(result)
+
+    def __reduce__(self):
+        # Anything that's queued up stays behind
+        return (Batched, (self.batch_fn, self.key, self.max_batch, self.max_wait_ms))
+
+    def __repr__(self):
+        return (
+            f"Batched({self.batch_fn!r}, key={self.key!r}, "
+            f"max_batch={self.max_batch!r}, max_wait_ms={self.max_wait_ms!r})"
+        )
+
+
+class _Batch(object):
+    """
+    The keys a Batched has queued up on one event loop (each with the
+    future its result goes to), and the handle for sending them off
+    """
+    def __init__(self):
+        self.futures = {}
+        self.handle = None
+
+
+class _Missing(object):
+    """
+    A key batch_fn's mapping didn't have
+    """
+    def __init__(self, error):
+        self.error = error
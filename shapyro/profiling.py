@@ -0,0 +1,177 @@
+
+#
+# Profiling for port and Get
+#
+
+import asyncio
+import contextlib
+import time
+
+from shapyro.op import _SKIPPED, SkipIteration
+
+
+__all__ = ["profile", "ProfileStats", "EntryStats"]
+
+
+# What gets told about every profiled call: one record(kind, key,
+# elapsed, outcome) per active profile() (and per hook). Everything
+# that can be profiled checks this is empty before doing anything
+# else, which is all that profiling costs while it's off.
+_PROFILERS = []
+
+_timer = time.perf_counter_ns
+
+
+class EntryStats(object):
+    """
+    The counts and times for one template path (or one Get chain)
+
+    calls is everything; sync, coroutines, skips and errors split it
+    up by how each call ended (a result, a coroutine to await, a
+    SkipIteration or any other exception). Times are in seconds, and
+    only cover the call itself -- not awaiting any coroutine it returned.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.sync = 0
+        self.coroutines = 0
+        self.skips = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed, outcome):
+        self.calls += 1
+        if outcome == "sync":
+            self.sync += 1
+        elif outcome == "coroutine":
+            self.coroutines += 1
+        elif outcome == "skip":
+            self.skips += 1
+        else:
+            self.errors += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+
+    def __repr__(self):
+        return (
+            f"EntryStats(calls={self.calls}, sync={self.sync}, "
+            f"coroutines={self.coroutines}, skips={self.skips}, errors={self.errors}, "
+            f"total_time={self.total_time:.6f}, max_time={self.max_time:.6f})"
+        )
+
+
+class ProfileStats(object):
+    """
+    Everything a profile() saw
+
+    paths maps each template path (like "spec.containers[0].image")
+    to its EntryStats, and chains does the same for Get chains (by
+    their repr), wherever they got called from.
+    """
+    def __init__(self):
+        self.paths = {}
+        self.chains = {}
+
+    def record(self, kind, key, elapsed, outcome):
+        entries = self.paths if kind == "path" else self.chains
+        stats = entries.get(key)
+        if stats is None:
+            stats = entries[key] = EntryStats()
+        stats.record(elapsed, outcome)
+
+    def report(self, limit=None):
+        """
+        report
+
+        Parameters:
+            limit: int: Only show this many of each (the slowest ones)
+
+        Returns:
+            str: A table of paths and then chains, by total time, slowest first
+        """
+        lines = []
+        for title, entries in (("path", self.paths), ("chain", self.chains)):
+            if not entries:
+                continue
+            lines.append(
+                f"{title:40} {'calls':>8} {'skips':>8} {'coros':>8} {'errors':>8} "
+                f"{'total ms':>10} {'max ms':>10}"
+            )
+            ranked = sorted(entries.items(), key=lambda item: item[1].total_time, reverse=True)
+            for key, stats in ranked[:limit]:
+                lines.append(
+                    f"{key:40} {stats.calls:8} {stats.skips:8} {stats.coroutines:8} "
+                    f"{stats.errors:8} {stats.total_time * 1e3:10.3f} {stats.max_time * 1e3:10.3f}"
+                )
+        return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def profile(hook=None):
+    """
+    profile
+
+    Parameters:
+        hook: callable(kind, key, elapsed, outcome): Also called for every
+            profiled call, e.g. to pass it on to a metrics exporter.
+            kind is "path" or "chain", key is the path or the chain's
+            repr, elapsed is in seconds and outcome is one of "sync",
+            "coroutine", "skip" or "error"
+
+    Profile every port (and Get chain call) in the with block:
+
+    with shapyro.profile() as stats:
+        shapyro.port(src, template)
+    stats.paths["spec.containers[0].image"].calls   # 1
+    print(stats.report())
+
+    Each non-constant entry in a template gets its own stats under its
+    path. To keep one entry's time from showing up under another's,
+    templates run every entry in full while they're being profiled
+    (no shared prefixes or memo). Profiling applies to all threads,
+    and profiles can be nested (each one sees everything).
+
+    Returns:
+        A context manager that gives a ProfileStats, filled in as calls happen
+    """
+    stats = ProfileStats()
+    profilers = [stats.record]
+    if hook is not None:
+        profilers.append(hook)
+    _PROFILERS.extend(profilers)
+    try:
+        yield stats
+    finally:
+        for profiler in profilers:
+            _PROFILERS.remove(profiler)
+
+
+def _timed(kind, key, run, src):
+    """
+    run(src), told to everything in _PROFILERS
+    """
+    start = _timer()
+    try:
+        result = run(src)
+    except SkipIteration:
+        _record(kind, key, start, "skip")
+        raise
+    except BaseException:
+        _record(kind, key, start, "error")
+        raise
+    if result is _SKIPPED:
+        outcome = "skip"
+    elif asyncio.iscoroutine(result):
+        outcome = "coroutine"
+    else:
+        outcome = "sync"
+    _record(kind, key, start, outcome)
+    return result
+
+
+def _record(kind, key, start, outcome):
+    elapsed = (_timer() - start) / 1e9
+    for profiler in list(_PROFILERS):
+        profiler(kind, key, elapsed, outcome)
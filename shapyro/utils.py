@@ -1,9 +1,31 @@
-
+import array
 import asyncio
-from shapyro.op import Composite, SkipIteration
+import codecs
+import collections.abc
+import concurrent.futures
+import contextvars
+import dataclasses
+import io
+import itertools
+import json
+import os
+import re
+
+from shapyro.getobj import (
+    _Each, _GetChainLink, _SYNC_TYPES, _arg_types, _chain_steps, _iscoroutine, _maybe_steps_function,
+    _steps_function
+)
+from shapyro.op import _SKIPPED, OnlyIfExists, Pure, SkipIteration, _offloading
+from shapyro.profiling import _PROFILERS, _timed
+
+
+# The asyncio.Semaphore (if any) bounding how many of the
+# coroutines returned by template callables get awaited at once
+# for the port currently being resolved; see port's max_concurrency
+_limiter = contextvars.ContextVar("shapyro_port_limiter", default=None)
 
-@Composite
-def Template(src, template):
+
+class Template(object):
     """
     Template
 
@@ -13,17 +35,239 @@ def Template(src, template):
 
     x = shapyro.Template({"a": shapyro.Get['name']})
     x({"name": "Fx"})   # {"a": "Fx"}
+
+    A Template is also the compiled form of its template (an
+    "execution plan"): every node in the template gets classified
+    exactly once, up front, as a constant, a callable, an
+    OnlyIfExists-style skip, a dict or a seq, and calling the
+    Template just runs that plan against the source. Nothing has
+    to look at type(node) again per source, which is where
+    port spends most of its time on big templates.
+
+    Since the template is only looked at once, changes made to it
+    after the Template was built won't be picked up.
+
+    Get chains in the template that start out the same way share
+    the work: each prefix they have in common gets evaluated once
+    per source rather than once per chain. A shared prefix only
+    goes as far as the first callable step in it, unless that
+    callable is wrapped in shapyro.Pure (or memo is True), since
+    calling it fewer times is only safe if it has no side effects.
+
+    Parts of the template without any callables in them get
+    folded into constants up front. Ported containers are always
+    new ones, so a callable-free dict, list or set (or a tuple
+    with one of those in it) still gets copied on every call, but
+    in one go rather than item by item; anything else (e.g. a tuple
+    of strings) is given back as-is. With shared_constants=True, the
+    copies get skipped too and every call gives back the template's
+    own containers for those parts, so they mustn't be changed.
+
+    With record, a dict template (with constant str keys) gets ported
+    into a record per source instead of a dict, built straight from
+    the entries' values with nothing in between: record can be a
+    dataclass (ideally with slots=True) or a NamedTuple class whose
+    fields are the template's keys, or True for a slotted dataclass
+    made from the keys (Template.record). Fields that aren't in the
+    template get their defaults, and so do ones whose entries get
+    skipped; a record that would be missing a field without a default
+    gets skipped as a whole (SkipIteration). Entries that might get
+    skipped (like shapyro.OnlyIfExists ones) default to None in a
+    record made from the keys. Records made from the keys don't pickle.
+
+    With memo=True, the run also gets a memo scope: Get chains
+    that appear more than once are evaluated once per source however
+    short they are, and so are callables wrapped in shapyro.Pure
+    (an async one's coroutine gets awaited once, and everything
+    that uses it waits on that).
+
+    Inside a `with shapyro.profile()` block, calls get timed entry
+    by entry (see shapyro.profile).
+
+    Calling a Template takes the same max_concurrency and offload
+    keywords as port.
     """
-    return port(src, template)
+    def __init__(self, template, memo=False, shared_constants=False, record=None):
+        self._setup(template, memo, shared_constants, record, reused=True)
+
+    @classmethod
+    def _once(cls, template, memo=False, shared_constants=False, record=None):
+        """
+        A plan for running template just the once (like port does),
+        which skips setting up anything that only pays for itself
+        over many runs
+        """
+        plan = cls.__new__(cls)
+        plan._setup(template, memo, shared_constants, record, reused=False)
+        return plan
 
+    def _setup(self, template, memo, shared_constants, record, reused):
+        self.template = template
+        self.memo = memo
+        self.shared_constants = shared_constants
+        self._record_from_keys = record is True
+        root = _plan(template)
+        if record is not None:
+            root = _record_node(root, record)
+            record = root.cls
+        self.record = record
+        if reused or shared_constants:
+            # (Run once, a folded container costs about what it saves)
+            root = _fold_constants(root, shared_constants)
+        if memo:
+            self._prefixes = _share_prefixes(root, min_steps=1, share_calls=True)
+            self._prefixes += _share_pure_calls(root)
+        elif reused:
+            self._prefixes = _share_prefixes(root)
+        else:
+            self._prefixes = []
+        self._root = _build(root)
+        # Built the first time this gets profiled
+        self._profiled_root = None
+        # Built the first time port_lazy needs it
+        self._unshared_root = None
 
-def port(src, dst):
+    def __call__(self, src, max_concurrency=None, offload=False):
+        if offload or _offloading.get():
+            # Set either way, so that a port inside one of another
+            # port's callables only offloads if it asks to itself
+            token = _offloading.set(offload)
+            try:
+                result = self._run_profiled(src) if _PROFILERS else self._run(src)
+            finally:
+                _offloading.reset(token)
+        elif _PROFILERS:
+            result = self._run_profiled(src)
+        else:
+            result = self._run(src)
+        if _iscoroutine(result):
+            return _resolve(result, max_concurrency, offload)
+        return result
+
+    def _run(self, src):
+        if not self._prefixes:
+            return self._root.run(src)
+        try:
+            return self._root.run(src)
+        finally:
+            self._forget()
+
+    def _run_profiled(self, src):
+        root = self._profiled_root
+        if root is None:
+            root = _plan(self.template)
+            if self.record is not None:
+                root = _record_node(root, self.record)
+            root = self._profiled_root = _build_profiled(root, "")
+        return root.run(src)
+
+    def _lazy_root(self):
+        """
+        A root for port_lazy: one without any shared prefixes, since
+        their values would outlive the run that's meant to forget them
+        """
+        if not self._prefixes:
+            return self._root
+        root = self._unshared_root
+        if root is None:
+            root = _plan(self.template)
+            if self.record is not None:
+                root = _record_node(root, self.record)
+            root = _fold_constants(root, self.shared_constants)
+            root = self._unshared_root = _build(root)
+        return root
+
+    def _forget(self):
+        """
+        Drop the shared prefixes' values from the last run
+        """
+        for prefix in self._prefixes:
+            prefix.cached = None
+
+    def __reduce__(self):
+        # The plan is all closures; recompile it on the other end
+        record = True if self._record_from_keys else self.record
+        return (Template, (self.template, self.memo, self.shared_constants, record))
+
+    def _has(self, memo, shared_constants, record):
+        """
+        Whether this does everything that a Template made with these would
+        """
+        return (not memo or self.memo) and \
+            (not shared_constants or self.shared_constants) and \
+            (record is None or record is self.record or (record is True and self._record_from_keys))
+
+    def __repr__(self):
+        options = ""
+        if self.memo:
+            options += ", memo=True"
+        if self.shared_constants:
+            options += ", shared_constants=True"
+        if self._record_from_keys:
+            options += ", record=True"
+        elif self.record is not None:
+            options += f", record={self.record.__qualname__}"
+        return f"shapyro.Template({self.template!r}{options})"
+
+
+def compile(template, memo=False, shared_constants=False, record=None):
+    """
+    compile
+
+    Parameters:
+        template: The "destination" object, exactly as you'd give it to port
+        memo: bool: Evaluate repeated Get chains and shapyro.Pure
+            callables once per source (see shapyro.Template)
+        shared_constants: bool: Give back the template's own containers
+            for the parts of it without callables, rather than copies
+            (see shapyro.Template)
+        record: A dataclass or NamedTuple class to port into instead
+            of a dict, or True for one made from the template's keys
+            (see shapyro.Template)
+    
+    Classify every node of template once and return the resulting
+    plan, which can then be run against as many sources as you like:
+
+    plan = shapyro.compile({"author": shapyro.Get['user']['name']})
+    [plan(src) for src in sources]   # same as port(src, template) for each
+
+    Returns:
+        shapyro.Template: the plan (template itself if it already
+        is one, unless it doesn't do something that's asked for)
+    """
+    if isinstance(template, Template):
+        if template._has(memo, shared_constants, record):
+            return template
+        if record is None:
+            record = True if template._record_from_keys else template.record
+        return Template(
+            template.template, memo or template.memo,
+            shared_constants or template.shared_constants, record
+        )
+    return Template(template, memo, shared_constants, record)
+
+
+def port(src, dst, max_concurrency=None, memo=False, shared_constants=False, record=None,
+         offload=False):
     """
     port
     
     Parameters:
         src: The source data object
         dst: The "destination" object (more like a template)
+        max_concurrency: int: How many coroutines from dst's callables
+            may be awaited at once when the result is async (default: no limit)
+        memo: bool: Evaluate each Get chain that appears more than once
+            in dst, and each callable wrapped in shapyro.Pure, only once
+        shared_constants: bool: Put the parts of dst that don't have any
+            callables in them into the result as they are, instead of
+            copying them (so the result shares them with dst)
+        record: A dataclass or NamedTuple class whose fields are dst's
+            keys, to port into instead of a dict (or True for one made
+            from them; see shapyro.Template)
+        offload: bool: Run dst's shapyro.Blocking callables in their
+            executors, so that they don't hold up the event loop (which
+            makes the result async; see shapyro.Blocking)
     
     port is one of the biggest core features of shapyro.
     The whole purpose of it is to take a source/input 
@@ -57,12 +301,12 @@ def port(src, dst):
         "content": "lorem ipsum..."
     }
 
-    All of the keys and values in the dst object
-    run through port, which eventually delegates them
-    down to port_ident -- which will either return
-    the value if it isn't a callable or, if it is,
-    will return the value of the result of calling the
-    callable with src as a sole argument. This way,
+    Every key and value in the dst object (and in the
+    dicts, lists, tuples and sets inside it) becomes a
+    plan node, which will either give back the value
+    as-is if it isn't a callable or, if it is, the
+    result of calling the callable with src as its
+    sole argument (see shapyro.compile). This way,
     you can define your desired output object and all
     of the accesses you would need to make on an input
     object to build it at the same time, like a template.
@@ -72,7 +316,10 @@ def port(src, dst):
     callable was defined with `async def`), the result
     of the entire operation will also be a coroutine,
     and you just have to `await` it to get your result as 
-    an extra step.
+    an extra step. All of the coroutines in dst get resolved
+    concurrently rather than one after another, so a template with
+    many independent async callables takes about as long as the
+    slowest one; pass max_concurrency to put a cap on that.
 
     Potential gotcha: if a callable in a seq item or a dict
     raises shapyro.SkipIteration, that entire list item or key/value
@@ -81,6 +328,18 @@ def port(src, dst):
     effect (i.e. to only have a k/v pair or a particular
     index if there is such a source value).
 
+    Under the hood, port compiles dst into a shapyro.Template
+    (see shapyro.compile) and runs that once, leaving out whatever
+    only pays for itself over many runs (like sharing Get chain
+    prefixes); if you're going to port the same dst over and over,
+    compile it once yourself.
+
+    Generated templates often repeat the same Get chain or the same
+    expensive callable in several places; with memo=True each of those
+    only gets evaluated once for the port. Callables have to opt in to
+    that by being wrapped in shapyro.Pure, since calling them fewer
+    times is only safe if they don't have side effects.
+
     Returns:
         Either the fully-resolved object in dst
         (i.e. with all callables on input resolved)
@@ -93,98 +352,1959 @@ def port(src, dst):
     Raises:
         Any underlying exception that isn't SkipIteration.
     """
-    portmap = {
-        dict: port_dict,
-        list: port_seq(list),
-        tuple: port_seq(tuple),
-        set: port_seq(set)
-    }
+    if isinstance(dst, Template):
+        plan = compile(dst, memo, shared_constants, record)
+    else:
+        plan = Template._once(dst, memo, shared_constants, record)
+    return plan(src, max_concurrency, offload)
+
+
+def port_lazy(src, template):
+    """
+    port_lazy
+
+    Parameters:
+        src: The source data object
+        template: The "destination" object, exactly as you'd give it to port
+
+    Like port, except that nothing gets run until it's needed:
+    dicts and lists/tuples in the template come back as read-only
+    Mapping/Sequence views over src, and each value in them is only
+    worked out the first time it's read (and then kept). Nested
+    dicts and lists/tuples are views too, so reading a handful of
+    fields out of a big template only costs those fields:
+
+    doc = shapyro.port_lazy(src, big_template)
+    doc["author"]["name"]   # runs just that one Get
+
+    (template can be a shapyro.compile'd one, which saves compiling
+    it on every call, though views never share Get chain prefixes
+    or memo=True results between entries.)
+
+    Which keys/items are there still depends on shapyro.OnlyIfExists,
+    so those get run as soon as the keys are needed (by a lookup,
+    len, iteration or `in`); callable dict keys get run then, too.
+    A callable that raises SkipIteration itself only finds out when
+    its value is read, which raises KeyError (or IndexError) instead.
+
+    src gets read as values are read, so it shouldn't change in the
+    meantime. Sets in the template are ported in one go, since there's
+    nothing to look up in them. If a value turns out to be async,
+    reading it gives a coroutine to await, as many times as you read it.
+
+    Returns:
+        A Mapping view for a dict template, a Sequence view for a list
+        or tuple template, or just what port would give for anything else
+
+    Raises:
+        Whatever the underlying callables raise, when they're run.
+    """
+    if isinstance(template, Template):
+        root = template._lazy_root()
+    else:
+        root = Template._once(template)._root
+    value = _lazy_value(root, src)
+    if type(value) is _Shared:
+        return value.get()
+    return value
+
+
+def port_many(sources, template, chunk_size=None):
+    """
+    port_many
 
-    if type(dst) in portmap:
-        return portmap[type(dst)](src, dst)
+    Parameters:
+        sources: Iterable: The source data objects (any iterable, read lazily)
+        template: The "destination" object, like port's dst
+        chunk_size: int: If given, yield lists of up to this many results
+    
+    Port every source in sources with the same template. The template
+    gets compiled once for the whole run, and sources are pulled one
+    (or one chunk) at a time as results get consumed, so neither the
+    input nor the output ever has to be a list in memory:
+
+    for record in shapyro.port_many(read_records(), template):
+        write(record)
+
+    for chunk in shapyro.port_many(read_records(), template, chunk_size=1000):
+        write_many(chunk)
+
+    Returns:
+        A lazy iterator of port results (or of lists of them, with chunk_size).
+        Like port, any result may be a coroutine if the template is async.
+    
+    Raises:
+        ValueError if chunk_size isn't a positive int; otherwise whatever
+        port raises, when the offending source is reached.
+    """
+    if chunk_size is not None:
+        _check_positive("chunk_size", chunk_size)
+
+    run = compile(template)
+    if chunk_size is None:
+        return map(run, sources)
     else:
-        h = port_ident(src, dst)
-        if asyncio.iscoroutine(h):
-            return port_async(src, h)
+        return _port_chunks(run, iter(sources), chunk_size)
+
+
+async def port_many_async(sources, template, max_in_flight=100, ordered=True, offload=False):
+    """
+    port_many_async
+
+    Parameters:
+        sources: AsyncIterable (or Iterable): The source data objects
+        template: The "destination" object, like port's dst
+        max_in_flight: int: How many sources can be pulled but not yet
+            handed back as results at any one time
+        ordered: bool: Hand back results in the same order as sources
+            (otherwise, in whatever order they finish)
+        offload: bool: Run the template's shapyro.Blocking callables
+            in their executors (see port)
+
+    Port every source from an async source (a message queue consumer,
+    a paginated API, ...) with an async template, with lots of them
+    in flight at once:
+
+    async for record in shapyro.port_many_async(consume(queue), template, max_in_flight=50):
+        await publish(record)
+
+    No more than max_in_flight sources get pulled ahead of the results
+    that have been taken, so a slow consumer slows down how fast sources
+    get pulled (rather than piling up results in memory). With ordered,
+    one slow source holds up the results behind it (but not the work).
+
+    Returns:
+        An async iterator of port results, which are never coroutines
+
+    Raises:
+        ValueError if max_in_flight isn't a positive int; otherwise whatever
+        port (or sources) raises, when its result would have been handed back.
+        Everything still in flight then gets cancelled.
+    """
+    _check_positive("max_in_flight", max_in_flight)
+    plan = compile(template)
+    if not hasattr(sources, "__aiter__"):
+        sources = _async_iter(sources)
+
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(max_in_flight)
+    # Futures for results, in the order they get handed back in
+    # (or as they finish), and then None once sources has run out
+    results = asyncio.Queue()
+    running = set()
+    # [how many sources have been started, whether that's all of them]
+    started = [0, False]
+
+    async def port_one(src):
+        # Porting happens in here rather than up front, so that a
+        # task that gets cancelled before it starts leaves nothing
+        # half-started behind
+        result = plan(src, offload=offload)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+    def start(future):
+        started[0] += 1
+        running.add(future)
+        future.add_done_callback(running.discard)
+        if ordered:
+            results.put_nowait(future)
         else:
-            return h
+            future.add_done_callback(results.put_nowait)
 
+    async def produce():
+        try:
+            async for src in sources:
+                await slots.acquire()
+                start(asyncio.ensure_future(port_one(src)))
+        except Exception as e:
+            future = loop.create_future()
+            future.set_exception(e)
+            start(future)
+        finally:
+            started[1] = True
+            results.put_nowait(None)
 
-async def port_async(src, dst):
-    real_dst = dst
-    while asyncio.iscoroutine(real_dst):
-        real_dst = await real_dst
-        real_dst = port(src, real_dst)
-    return real_dst
+    producer = asyncio.ensure_future(produce())
+    handed_back = 0
+    try:
+        while True:
+            future = await results.get()
+            if future is not None:
+                result = await future
+                handed_back += 1
+                slots.release()
+                yield result
+            if started[1] and handed_back == started[0]:
+                return
+    finally:
+        producer.cancel()
+        if running:
+            # Give any that haven't started yet a chance to, so that
+            # cancelling them cancels whatever they've got going too
+            await asyncio.sleep(0)
+            for future in running:
+                future.cancel()
+            if running:
+                await asyncio.wait(list(running))
 
 
-def port_dict(src, dst):
-    ret_dict = {}
-    must_async_resolve = False
-    for k, v in dst.items():
+async def _async_iter(iterable):
+    for item in iterable:
+        yield item
+
+
+def _port_chunks(run, sources, chunk_size):
+    while True:
+        chunk = [run(src) for src in itertools.islice(sources, chunk_size)]
+        if not chunk:
+            return
+        yield chunk
+
+
+def port_columns(sources, template, types=None, missing=None, numpy=False):
+    """
+    port_columns
+
+    Parameters:
+        sources: Iterable: The source data objects (any iterable, read lazily)
+        template: dict: A flat template -- a dict whose keys are all constants
+            (or a shapyro.compile'd one)
+        types: dict: Optional array.array typecodes for some of the columns,
+            e.g. {"uid": "q", "score": "d"}
+        missing: object: What goes in a column when its value got skipped
+            (e.g. by OnlyIfExists), since a column can't just leave it out
+        numpy: bool: Return numpy arrays instead (needs numpy installed)
+    
+    Port every source in sources, but instead of one dict per source,
+    collect the results column by column:
+
+    shapyro.port_columns(users, {"name": shapyro.Get['name'], "uid": shapyro.Get['uid']},
+                         types={"uid": "q"})
+    # {"name": ["root", "andy"], "uid": array('q', [0, 1337])}
+
+    That way the keys (and a hash table) aren't repeated for every
+    row, and typed columns store their values unboxed.
+
+    Returns:
+        dict: template's keys, each mapped to a list (or an array.array if
+        it has a typecode in types, or a numpy array if numpy is True)
+    
+    Raises:
+        TypeError if template isn't a flat dict or turns out to be async;
+        ValueError if types names a key that isn't in template;
+        ImportError if numpy is True but numpy isn't installed;
+        otherwise whatever port raises (or array.array raises for a bad value).
+    """
+    plan = compile(template)
+    root = plan._root
+    if type(root) is _Static or type(root) is _Constant:
+        # A template without any callables gets folded into one constant
+        # (or a copy of one), but each of its values still needs a column
+        root = _build(_plan(plan.template))
+    if not isinstance(root, _Dict) or \
+            not all(isinstance(k, _Constant) for k, _ in root.items):
+        raise TypeError("port_columns needs a dict template with constant keys")
+    types = types or {}
+    unknown = set(types) - {k.template for k, _ in root.items}
+    if unknown:
+        raise ValueError(f"types given for keys not in template: {sorted(unknown, key=repr)}")
+    if numpy:
+        import numpy as np
+
+    columns = {
+        k.template: array.array(types[k.template]) if k.template in types else []
+        for k, _ in root.items
+    }
+    entries = [
+        (columns[k.template].append, _constant_or_none(v), _run_or_none(v))
+        for k, v in root.items
+    ]
+    for src in sources:
         try:
-            ret_dict_key = port(src, k)
-            ret_dict_val = port(src, v)
-            if asyncio.iscoroutine(ret_dict_key) or asyncio.iscoroutine(ret_dict_val):
-                must_async_resolve = True
-            ret_dict[ret_dict_key] = ret_dict_val
-        except SkipIteration:
-            pass
-    if must_async_resolve:
-        return async_port_dict(src, ret_dict)
+            for append, value, run in entries:
+                if run is not None:
+                    try:
+                        value = run(src)
+                    except SkipIteration:
+                        value = missing
+                    if value is _SKIPPED:
+                        value = missing
+                    elif _iscoroutine(value):
+                        value.close()
+                        raise TypeError("port_columns can't port async templates")
+                append(value)
+        finally:
+            plan._forget()
+
+    if numpy:
+        return {k: np.asarray(column) for k, column in columns.items()}
+    return columns
+
+
+def port_parallel(sources, template, workers=None, chunk_size=1000):
+    """
+    port_parallel
+
+    Parameters:
+        sources: Iterable: The source data objects (any iterable, read lazily)
+        template: The "destination" object, like port's dst
+        workers: int: How many worker processes to use (default: os.cpu_count())
+        chunk_size: int: How many sources to send to a worker at a time
+    
+    Like port_many, but the porting happens in a pool of worker
+    processes instead of this one, for CPU-bound templates.
+
+    The template gets compiled here and pickled over to each worker
+    once, when the worker starts. After that, only chunks of sources
+    and chunks of results go back and forth, with just a couple of
+    chunks per worker in flight at a time, so memory stays bounded
+    however long sources is.
+
+    That means the template, the sources and the results all have
+    to be picklable: Get chains and the ops in shapyro.op are, as are
+    functions defined at the top level of a module, but lambdas and
+    nested functions aren't. Async templates get resolved inside the
+    workers, so the results are never coroutines.
+
+    Returns:
+        A lazy iterator of port results, in the same order as sources.
+    
+    Raises:
+        ValueError if workers or chunk_size isn't a positive int;
+        otherwise whatever port raises, when the offending chunk is reached.
+    """
+    _check_positive("chunk_size", chunk_size)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    _check_positive("workers", workers)
+    return _port_parallel(compile(template), iter(sources), workers, chunk_size)
+
+
+def _port_parallel(plan, sources, workers, chunk_size):
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(plan,)
+    )
+    in_flight = collections.deque()
+    try:
+        while True:
+            while len(in_flight) < 2 * workers:
+                chunk = list(itertools.islice(sources, chunk_size))
+                if not chunk:
+                    break
+                in_flight.append(executor.submit(_port_worker_chunk, chunk))
+            if not in_flight:
+                return
+            yield from in_flight.popleft().result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+# The plan that this (port_parallel worker) process was started with
+_worker_plan = None
+
+
+def _init_worker(plan):
+    global _worker_plan
+    _worker_plan = plan
+
+
+def _port_worker_chunk(chunk):
+    results = [_worker_plan(src) for src in chunk]
+    if any(asyncio.iscoroutine(result) for result in results):
+        results = asyncio.run(_gather_into(results))
+    return results
+
+
+def port_stream(infile, template, outfile, format="ndjson", batch_size=1000,
+                backend=None, progress=None):
+    """
+    port_stream
+
+    Parameters:
+        infile: A file (text or binary) or path to read JSON records from
+        template: The "destination" object, like port's dst
+        outfile: A file (text or binary) or path to write NDJSON results to
+        format: str: "ndjson" for one record per line, or "array"
+            for one big top-level JSON array of records
+        batch_size: int: How many results to write to outfile at a time
+        backend: str: "orjson" or "json" (default: orjson if it's
+            installed, otherwise the standard library's json)
+        progress: callable(counts): Called after every batch with
+            the counts so far (see Returns)
+
+    Port every JSON record in infile with template, writing each
+    result to outfile as a line of JSON. Records get decoded one at a
+    time as they're read and results get written out a batch at a time,
+    so memory use stays the same however big the files are:
+
+    with open("dump.ndjson", "rb") as infile, open("out.ndjson", "wb") as outfile:
+        shapyro.port_stream(infile, template, outfile)
+
+    A top-level JSON array gets read a piece at a time as well (always
+    with the standard library, which is what can decode part of one).
+    A record that the template skips altogether (by raising
+    SkipIteration) doesn't get written. An async template gets resolved
+    a batch at a time, with all of the batch's coroutines running at once,
+    in an event loop of its own -- so it can't be called from inside a
+    running one (e.g. from a coroutine) with an async template; run it
+    in a thread instead (asyncio.to_thread).
+
+    Returns:
+        dict: counts of records "read", "written" and "skipped",
+        and of "batches" written
+
+    Raises:
+        ValueError for bad JSON (with the line or record it was on),
+        a bad format or backend, or a batch_size that isn't a positive int;
+        ImportError if backend is "orjson" but it isn't installed;
+        RuntimeError if template is (or turns out to be) async while an
+        event loop is running (before reading anything, if analyze can
+        tell); otherwise whatever port raises for a record.
+    """
+    _check_positive("batch_size", batch_size)
+    if format not in ("ndjson", "array"):
+        raise ValueError(f"format must be 'ndjson' or 'array', not {format!r}")
+    loads, dumps = _json_backend(backend)
+
+    if isinstance(infile, (str, os.PathLike)):
+        with open(infile, "rb") as infile:
+            return port_stream(infile, template, outfile, format, batch_size,
+                               backend, progress)
+    if isinstance(outfile, (str, os.PathLike)):
+        with open(outfile, "wb") as outfile:
+            return port_stream(infile, template, outfile, format, batch_size,
+                               backend, progress)
+
+    if format == "ndjson":
+        records = _ndjson_records(infile, loads)
     else:
-        return ret_dict
+        records = _json_array_records(infile)
+    write = _ndjson_writer(outfile, dumps)
+
+    plan = compile(template)
+    if _loop_running():
+        # Find out before anything gets run (and leaves coroutines behind)
+        from shapyro.analysis import analyze
+        if analyze(plan).async_entries:
+            raise _stream_in_loop_error()
+    counts = {"read": 0, "written": 0, "skipped": 0, "batches": 0}
+    while True:
+        batch = []
+        read = 0
+        for src in itertools.islice(records, batch_size):
+            read += 1
+            try:
+                batch.append(plan(src))
+            except SkipIteration:
+                counts["skipped"] += 1
+        if not read:
+            break
+        counts["read"] += read
+        if batch:
+            if any(asyncio.iscoroutine(result) for result in batch):
+                batch = _run_batch(batch)
+            write(batch)
+            counts["written"] += len(batch)
+            counts["batches"] += 1
+        if progress is not None:
+            progress(counts)
+    return counts
+
+
+def _run_batch(batch):
+    """
+    batch with its coroutines resolved, in an event loop of its own
+    """
+    if not _loop_running():
+        return asyncio.run(_gather_into(batch))
+    # A sync callable that returned a coroutine, which analyze can't tell
+    for result in batch:
+        if asyncio.iscoroutine(result):
+            result.close()
+    raise _stream_in_loop_error()
+
+
+def _loop_running():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _stream_in_loop_error():
+    return RuntimeError(
+        "port_stream can't resolve an async template from inside a running "
+        "event loop; call it in a thread (e.g. with asyncio.to_thread)"
+    )
+
+
+def _check_positive(name, value):
+    if not isinstance(value, int) or value < 1:
+        raise ValueError(f"{name} must be a positive int, not {value!r}")
+
+
+async def _resolve(coro, max_concurrency, offload=False):
+    """
+    Resolve the coroutine from running a plan, under its own limiter
+    (and offloading, for anything that gets ported along the way)
+
+    Each port sets up its own limiter (or lack thereof) so that
+    a port being awaited from inside another one's callable never
+    waits on the semaphore that its caller is holding.
+    """
+    if max_concurrency is None:
+        limiter = None
+    else:
+        limiter = asyncio.Semaphore(max_concurrency)
+    token = _limiter.set(limiter)
+    offload_token = _offloading.set(offload)
+    try:
+        return await coro
+    finally:
+        _offloading.reset(offload_token)
+        _limiter.reset(token)
+
+
+async def _gather(coros):
+    """
+    Await coros concurrently and return their results in order
+
+    If any of them raises, the rest get cancelled and the
+    exception propagates, much like awaiting them in turn would.
+    """
+    if len(coros) == 1:
+        return [await coros[0]]
+    tasks = [asyncio.ensure_future(c) for c in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def _gather_into(values):
+    """
+    Replace every coroutine in the list values with its result
+    """
+    indexes = [i for i, value in enumerate(values) if asyncio.iscoroutine(value)]
+    results = await _gather([values[i] for i in indexes])
+    for i, result in zip(indexes, results):
+        values[i] = result
+    return values
+
+
+async def port_async(src, dst):
+    # Only the callable's own coroutine counts against the limiter;
+    # porting what it returned may need slots of its own
+    limiter = _limiter.get()
+    if limiter is None:
+        real_dst = await dst
+    else:
+        async with limiter:
+            real_dst = await dst
+    real_dst = _build(_plan(real_dst)).run(src)
+    if asyncio.iscoroutine(real_dst):
+        real_dst = await real_dst
+    return real_dst
 
 
 async def async_port_dict(src, dst):
-    ret_dict = {}
-    for k, v in dst.items():
-        while asyncio.iscoroutine(k):
-            k = await k
-            k = port(src, k)
-        while asyncio.iscoroutine(v):
-            v = await v
-            v = port(src, v)
-        
-        ret_dict[k] = v
-    
-    return ret_dict
+    keys_values = await _gather_into(list(dst.keys()) + list(dst.values()))
+    n = len(dst)
+    return dict(zip(keys_values[:n], keys_values[n:]))
+
+
+async def async_port_seq(which_type, src, dst):
+    return which_type(await _gather_into(list(dst)))
+
+
+#
+# What port used to delegate to before it ran plans; these are
+# just kept for anything that still calls them directly
+#
+
+def port_dict(src, dst):
+    """
+    port for a dict dst
+    """
+    return port(src, dict(dst))
 
 
 def port_seq(which_type):
+    """
+    A port for sequences (any iterable dst) that gives back a which_type
+    """
     def impl(src, dst):
-        r = []
-        async_resolve = False
-        for i in dst:
-            try:
-                result = port(src, i)
-                r.append(result)
-                if asyncio.iscoroutine(result):
-                    async_resolve = True
-            except SkipIteration:
-                pass
-        if async_resolve:
-            return async_port_seq(which_type, src, r)
-        else:
-            return which_type(r)
+        result = port(src, list(dst))
+        if asyncio.iscoroutine(result):
+            return _converted(which_type, result)
+        return which_type(result)
     return impl
 
 
-async def async_port_seq(which_type, src, dst):
-    r = []
-    for i in dst:
-        while asyncio.iscoroutine(i):
-            i = await i
-            i = port(src, i)
-        r.append(i)
-    return which_type(r)
-        
+async def _converted(which_type, coro):
+    return which_type(await coro)
+
 
 def port_ident(src, dst):
+    """
+    dst(src) if dst is callable (ported once awaited, if that's a
+    coroutine), otherwise dst itself
+    """
     if callable(dst):
         result = dst(src)
         if asyncio.iscoroutine(result):
             return port_async(src, result)
-        else:
-            return result
+        return result
     return dst
+
+
+#
+# Plan nodes
+#
+# Planning a template happens in three steps:
+#
+#   1. _plan classifies every node of the template (once)
+#   2. passes over the resulting nodes can swap out what their
+#      callables actually call (e.g. _share_prefixes)
+#   3. _build gives every node a run(src) closure that does whatever
+#      port would have done for that piece. Containers capture their
+#      childrens' run closures directly so that running a plan is just
+#      calling closures.
+#
+# None of these recurse, so templates can be nested as deeply as you
+# like. Running one can't just be closures calling closures all the
+# way down, though: a container with more than _MAX_CLOSURE_DEPTH
+# levels under it runs by way of _deep_run instead, which keeps track
+# of where it is in an explicit stack (the shallower containers under
+# it still run as closures, since that's faster).
+#
+# Coroutines work like they always have in port: any run() may hand
+# back a coroutine, and a container that gets one back hands back
+# a coroutine of its own that finishes resolving it. (The checks for
+# that are spelled out inline, like in getobj, since they run so often.)
+#
+
+class _Constant(object):
+    """
+    Anything that isn't callable or a container gets returned as-is
+    """
+    def __init__(self, template):
+        self.template = template
+        self.run = None
+
+    def children(self):
+        return ()
+
+    def build(self):
+        template = self.template
+
+        def run(src):
+            return template
+        return run
+
+
+class _Call(object):
+    """
+    A callable gets called with src; coroutines get ported once awaited
+
+    fn starts out as the template itself but passes may replace it
+    with something that gives the same result faster, or even set
+    run_fn to something that can stand in for run itself. (For a Get
+    chain that goes by way of a shared prefix, shared is that prefix
+    and the rest of the chain's steps.)
+    """
+    def __init__(self, template):
+        self.template = template
+        self.fn = template
+        self.run_fn = None
+        self.shared = None
+        self.run = None
+
+    def children(self):
+        return ()
+
+    def build(self):
+        if self.run_fn is not None:
+            return self.run_fn
+        fn = self.fn
+        sync_types = _SYNC_TYPES
+        iscoroutine = asyncio.iscoroutine
+
+        def run(src):
+            result = fn(src)
+            if type(result) not in sync_types and iscoroutine(result):
+                return port_async(src, result)
+            return result
+        return run
+
+
+class _Nested(object):
+    """
+    A Template inside of a template: run its plan in place
+    """
+    def __init__(self, template):
+        self.template = template
+        self.run = None
+
+    def children(self):
+        return ()
+
+    def build(self):
+        # Not __call__, which would resolve any coroutine on its own
+        return self.template._run
+
+
+class _Static(object):
+    """
+    A container without any callables in it: copy() makes a fresh one
+    (see _fold_constants)
+    """
+    def __init__(self, template, copy):
+        self.template = template
+        self.copy = copy
+        self.run = None
+
+    def children(self):
+        return ()
+
+    def build(self):
+        copy = self.copy
+
+        def run(src):
+            return copy()
+        return run
+
+
+class _Skip(object):
+    """
+    shapyro.OnlyIfExists(key): key's value, or SkipIteration if there isn't one
+
+    That's run; the containers use maybe instead, which gives back
+    _SKIPPED rather than raising, and which doesn't raise anything
+    along the way either for a dict key or attribute that isn't there.
+    """
+    def __init__(self, template, key):
+        self.template = template
+        self.key = key
+        self.inner = _Call(key) if callable(key) else None
+        self.run = None
+        self.maybe = None
+
+    def children(self):
+        return () if self.inner is None else (self.inner,)
+
+    def build(self):
+        inner = self.inner
+        if inner is None:
+            key = self.key
+
+            def get(src):
+                return src[key]
+
+            def get_maybe(src):
+                if type(src) is dict:
+                    return src.get(key, _SKIPPED)
+                return src[key]
+        else:
+            get = get_maybe = inner.run
+            if isinstance(inner.fn, _GetChainLink):
+                get_maybe = _maybe_chain_run(inner)
+
+        def maybe(src):
+            try:
+                return get_maybe(src)
+            except (KeyError, AttributeError, IndexError,
+                    ValueError, TypeError, SkipIteration):
+                return _SKIPPED
+        self.maybe = maybe
+
+        def run(src):
+            try:
+                return get(src)
+            except (KeyError, AttributeError, IndexError,
+                    ValueError, TypeError, SkipIteration) as e:
+                raise SkipIteration(e)
+        return run
+
+
+def _maybe_chain_run(node):
+    """
+    A run for node (a Get chain's _Call) that gives back _SKIPPED
+    for a missing dict key or attribute instead of raising
+    """
+    steps = _chain_steps(node.fn)
+    if node.shared is not None:
+        prefix, rest = node.shared
+        return _from_shared_prefix(
+            _maybe_steps_function(steps, _SKIPPED), prefix,
+            _maybe_steps_function(rest, _SKIPPED) if rest else None
+        )
+    evaluate = _maybe_steps_function(steps, _SKIPPED)
+    sync_types = _SYNC_TYPES
+    iscoroutine = asyncio.iscoroutine
+
+    def maybe_chain_run(src):
+        result = evaluate(src)
+        if type(result) not in sync_types and iscoroutine(result):
+            return port_async(src, result)
+        return result
+    return maybe_chain_run
+
+
+class _Dict(object):
+    """
+    Every key and value gets ported; SkipIteration (or _SKIPPED) skips the pair
+    """
+    def __init__(self, template, items):
+        self.template = template
+        self.items = items
+        self.run = None
+
+    def children(self):
+        return [node for item in self.items for node in item]
+
+    def build(self):
+        # Constants don't need to be run (or checked for coroutines),
+        # so each entry carries either the constant or a run closure
+        entries = [
+            (_constant_or_none(k), _run_or_none(k),
+             _constant_or_none(v), _run_or_none(v))
+            for k, v in self.items
+        ]
+        sync_types = _SYNC_TYPES
+        iscoroutine = asyncio.iscoroutine
+        skipped = _SKIPPED
+
+        def run(src):
+            ret_dict = {}
+            must_async_resolve = False
+            for k, k_run, v, v_run in entries:
+                try:
+                    if k_run is not None:
+                        k = k_run(src)
+                        if k is skipped:
+                            continue
+                        if type(k) not in sync_types and iscoroutine(k):
+                            must_async_resolve = True
+                    if v_run is not None:
+                        v = v_run(src)
+                        if v is skipped:
+                            continue
+                        if type(v) not in sync_types and iscoroutine(v):
+                            must_async_resolve = True
+                except SkipIteration:
+                    continue
+                ret_dict[k] = v
+            if must_async_resolve:
+                return async_port_dict(src, ret_dict)
+            return ret_dict
+        return run
+
+    def build_deep(self):
+        self.deep_entries = [
+            (_constant_or_none(k), _run_or_none(k),
+             _constant_or_none(v), _run_or_none(v), _deep_or_none(v))
+            for k, v in self.items
+        ]
+        return _deep_run(self)
+
+    def deep_steps(self, src):
+        """
+        run, for _deep_run: yields each deep child for it to
+        be run, and gets back what that came to
+        """
+        ret_dict = {}
+        pending = False
+        for k, k_run, v, v_run, v_deep in self.deep_entries:
+            try:
+                if k_run is not None:
+                    k = k_run(src)
+                    if k is _SKIPPED:
+                        continue
+                    if _iscoroutine(k):
+                        pending = True
+                if v_deep is not None:
+                    v = yield v_deep
+                    if type(v) is _Pending:
+                        pending = True
+                elif v_run is not None:
+                    v = v_run(src)
+                    if v is _SKIPPED:
+                        continue
+                    if _iscoroutine(v):
+                        pending = True
+            except SkipIteration:
+                continue
+            ret_dict[k] = v
+        if pending:
+            return _Pending(_dict_from_halves, list(ret_dict.keys()) + list(ret_dict.values()))
+        return ret_dict
+
+
+class _Seq(object):
+    """
+    Every item gets ported into a new which_type; SkipIteration (or _SKIPPED) skips the item
+    """
+    def __init__(self, template, which_type, items):
+        self.template = template
+        self.which_type = which_type
+        self.items = items
+        self.run = None
+
+    def children(self):
+        return self.items
+
+    def build(self):
+        which_type = self.which_type
+        entries = [(_constant_or_none(i), _run_or_none(i)) for i in self.items]
+        sync_types = _SYNC_TYPES
+        iscoroutine = asyncio.iscoroutine
+        skipped = _SKIPPED
+
+        def run(src):
+            r = []
+            async_resolve = False
+            for i, i_run in entries:
+                if i_run is not None:
+                    try:
+                        i = i_run(src)
+                    except SkipIteration:
+                        continue
+                    if i is skipped:
+                        continue
+                    if type(i) not in sync_types and iscoroutine(i):
+                        async_resolve = True
+                r.append(i)
+            if async_resolve:
+                return async_port_seq(which_type, src, r)
+            return which_type(r)
+        return run
+
+    def build_deep(self):
+        self.deep_entries = [
+            (_constant_or_none(i), _run_or_none(i), _deep_or_none(i))
+            for i in self.items
+        ]
+        return _deep_run(self)
+
+    def deep_steps(self, src):
+        """
+        run, for _deep_run (see _Dict.deep_steps)
+        """
+        r = []
+        pending = False
+        for i, i_run, i_deep in self.deep_entries:
+            if i_deep is not None:
+                i = yield i_deep
+                if type(i) is _Pending:
+                    pending = True
+            elif i_run is not None:
+                try:
+                    i = i_run(src)
+                except SkipIteration:
+                    continue
+                if i is _SKIPPED:
+                    continue
+                if _iscoroutine(i):
+                    pending = True
+            r.append(i)
+        if pending:
+            return _Pending(self.which_type, r)
+        return self.which_type(r)
+
+
+def _deep_or_none(node):
+    """
+    node, if a container runs it by way of _deep_run
+    """
+    return node if node.depth > _MAX_CLOSURE_DEPTH else None
+
+
+class _Record(object):
+    """
+    A dict template ported into cls: items are the plan nodes for cls's
+    fields (names), in order, and defaults the functions that make their
+    default values (or None for a field without one). The last of them
+    (as many as there are keywords) get passed to cls by keyword.
+    """
+    def __init__(self, template, cls, names, items, defaults, keywords=()):
+        self.template = template
+        self.cls = cls
+        self.names = names
+        self.items = items
+        self.defaults = defaults
+        self.keywords = keywords
+        self.run = None
+
+    def children(self):
+        return self.items
+
+    def build(self):
+        cls = self.cls
+        keywords = self.keywords
+        if issubclass(cls, tuple):
+            # A NamedTuple: skip its __new__
+            def make(values):
+                return tuple.__new__(cls, values)
+        elif keywords:
+            positional = len(self.names) - len(keywords)
+
+            def make(values):
+                return cls(*values[:positional], **dict(zip(keywords, values[positional:])))
+        else:
+            def make(values):
+                return cls(*values)
+        entries = [
+            (_constant_or_none(node), _run_or_none(node), default)
+            for node, default in zip(self.items, self.defaults)
+        ]
+        sync_types = _SYNC_TYPES
+        iscoroutine = asyncio.iscoroutine
+        skipped = _SKIPPED
+
+        def run(src):
+            values = []
+            must_async_resolve = False
+            for value, value_run, default in entries:
+                if value_run is not None:
+                    try:
+                        value = value_run(src)
+                    except SkipIteration:
+                        value = skipped
+                    if value is skipped:
+                        if default is None:
+                            raise SkipIteration()
+                        value = default()
+                    elif type(value) not in sync_types and iscoroutine(value):
+                        must_async_resolve = True
+                values.append(value)
+            if must_async_resolve:
+                return _async_record(make, values)
+            return make(values)
+        return run
+
+
+async def _async_record(make, values):
+    return make(await _gather_into(values))
+
+
+def _record_node(node, record):
+    """
+    A _Record for node (a dict template's plan) and record
+    (a dataclass or NamedTuple class, or True to make one)
+    """
+    if type(node) is not _Dict:
+        raise TypeError(f"Only a dict template can be ported into a record, not {type(node.template).__name__}")
+    by_name = {}
+    for k, v in node.items:
+        name = k.template
+        if type(k) is not _Constant or not isinstance(name, str):
+            raise TypeError(f"Record templates need constant str keys, not {name!r}")
+        by_name[name] = v
+    if record is True:
+        record = dataclasses.make_dataclass("Record", [
+            (name, object, dataclasses.field(default=None)) if type(v) is _Skip else (name, object)
+            for name, v in by_name.items()
+        ], slots=True)
+    keywords = ()
+    if isinstance(record, type) and issubclass(record, tuple) and hasattr(record, "_fields"):
+        fields = [
+            (name, _default_factory(record._field_defaults, name))
+            for name in record._fields
+        ]
+    elif isinstance(record, type) and dataclasses.is_dataclass(record):
+        init_fields = [field for field in dataclasses.fields(record) if field.init]
+        # __init__ takes kw_only fields by keyword, after the rest
+        init_fields.sort(key=lambda field: field.kw_only)
+        fields = [(field.name, _field_default(field)) for field in init_fields]
+        keywords = tuple(field.name for field in init_fields if field.kw_only)
+    else:
+        raise TypeError(f"record needs to be a dataclass or NamedTuple class (or True), not {record!r}")
+
+    items = []
+    defaults = []
+    for name, default in fields:
+        item = by_name.pop(name, None)
+        if item is None:
+            if default is None:
+                raise TypeError(f"{record.__qualname__}.{name} isn't in the template and has no default")
+            item = _Call(lambda src, default=default: default())
+        items.append(item)
+        defaults.append(default)
+    if by_name:
+        raise TypeError(f"{record.__qualname__} has no fields for {', '.join(map(repr, by_name))}")
+    return _Record(node.template, record, [name for name, _ in fields], items, defaults, keywords)
+
+
+def _default_factory(defaults, name):
+    if name not in defaults:
+        return None
+    default = defaults[name]
+    return lambda: default
+
+
+def _field_default(field):
+    if field.default_factory is not dataclasses.MISSING:
+        return field.default_factory
+    elif field.default is not dataclasses.MISSING:
+        default = field.default
+        return lambda: default
+    return None
+
+
+def _constant_or_none(node):
+    return node.template if isinstance(node, _Constant) else None
+
+
+def _run_or_none(node):
+    """
+    What a container runs for node (which may give back _SKIPPED)
+    """
+    if isinstance(node, _Constant):
+        return None
+    elif isinstance(node, _Skip):
+        return node.maybe
+    return node.run
+
+
+def _plan(dst):
+    """
+    Classify dst (and everything under it) into plan nodes
+    """
+    root = _plan_node(dst)
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        which_type = type(node)
+        if which_type is _Dict:
+            node.items = [(_plan_node(k), _plan_node(v)) for k, v in node.template.items()]
+            stack.extend(child for item in node.items for child in item)
+        elif which_type is _Seq:
+            node.items = [_plan_node(i) for i in node.template]
+            stack.extend(node.items)
+    return root
+
+
+def _plan_node(dst):
+    """
+    Classify just dst (_plan fills in a container's items)
+    """
+    which_type = type(dst)
+    if which_type is dict:
+        return _Dict(dst, [])
+    elif which_type in (list, tuple, set):
+        return _Seq(dst, which_type, [])
+    elif which_type is _GetChainLink:
+        # Before the getattr below, which would build (and intern) a new chain
+        return _Call(dst)
+    elif isinstance(dst, Template):
+        return _Nested(dst)
+    elif getattr(dst, "composite", None) is OnlyIfExists \
+            and len(dst.args) == 1 and not dst.kwargs:
+        return _Skip(dst, dst.args[0])
+    elif callable(dst):
+        return _Call(dst)
+    elif asyncio.iscoroutine(dst):
+        # A coroutine sitting right in the template can
+        # only be awaited once, but port has always taken it
+        return _Call(lambda src: dst)
+    else:
+        return _Constant(dst)
+
+
+def _walk(node):
+    """
+    Every node from node on down, parents before children
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(node.children()))
+
+
+def _build(node, timed=None):
+    """
+    Give node (and everything under it) its run closure
+
+    timed maps id(node) to a path for the nodes whose runs
+    should get timed under that path (see _build_profiled).
+    """
+    nodes = []
+    stack = [node]
+    while stack:
+        inner = stack.pop()
+        nodes.append(inner)
+        stack.extend(inner.children())
+    # Children first, so their runs are there for their parents
+    for inner in reversed(nodes):
+        which_type = type(inner)
+        if which_type is _Dict or which_type is _Seq:
+            depth = 0
+            for child in inner.children():
+                if child.depth > depth:
+                    depth = child.depth
+            inner.depth = depth + 1
+            deep = inner.depth > _MAX_CLOSURE_DEPTH
+        else:
+            inner.depth = 1
+            deep = False
+        inner.run = inner.build_deep() if deep else inner.build()
+        if timed is not None and id(inner) in timed:
+            path = timed[id(inner)]
+            inner.run = _timed_run(inner.run, path or "<template>")
+            if isinstance(inner, _Skip):
+                inner.maybe = _timed_run(inner.maybe, path)
+    return node
+
+
+def _build_profiled(node, path):
+    """
+    Like _build, except that everything under node that actually
+    runs something (anything but a constant or a container) gets
+    timed under its path in the template
+    """
+    node = _unnest(node)
+    timed = {}
+    stack = [(node, path)]
+    while stack:
+        inner, path = stack.pop()
+        if isinstance(inner, _Dict):
+            inner.items = [(k, _unnest(v)) for k, v in inner.items]
+            stack.extend((v, _path_join(path, k.template)) for k, v in inner.items)
+        elif isinstance(inner, _Seq):
+            inner.items = [_unnest(item) for item in inner.items]
+            stack.extend((item, f"{path}[{index}]") for index, item in enumerate(inner.items))
+        elif isinstance(inner, _Record):
+            inner.items = [_unnest(item) for item in inner.items]
+            stack.extend(
+                (item, _path_join(path, field))
+                for field, item in zip(inner.names, inner.items)
+            )
+        elif not isinstance(inner, _Constant):
+            timed[id(inner)] = path
+            for call in _walk(inner):
+                if isinstance(call, _Call) and isinstance(call.fn, _GetChainLink):
+                    # so that the first call doesn't get timed compiling it
+                    call.fn.compile()
+    return _build(node, timed)
+
+
+def _unnest(node):
+    """
+    A nested Template's own plan in its place, so that its
+    entries get profiled under their paths in this one
+    """
+    while isinstance(node, _Nested):
+        nested = node.template
+        node = _plan(nested.template)
+        if nested.record is not None:
+            node = _record_node(node, nested.record)
+    return node
+
+
+def _fold_constants(root, shared):
+    """
+    Swap every container under root (or root itself) that doesn't have
+    any callables in it for a _Constant, or for a _Static if it (or
+    anything in it) is a container that port would make a new one of
+    every time and shared is false
+
+    Returns:
+        root, or what it got swapped for
+    """
+    nodes = list(_walk(root))
+    # id(node) -> how deep it goes, for every node without callables
+    static = {}
+    for node in reversed(nodes):
+        which_type = type(node)
+        if which_type is _Constant:
+            static[id(node)] = 1
+        elif which_type is _Dict or which_type is _Seq:
+            depths = [static.get(id(child)) for child in node.children()]
+            if None not in depths:
+                depth = 1 + max(depths, default=0)
+                # Too deep to copy with closures: fold what's under it instead
+                if depth <= _MAX_CLOSURE_DEPTH:
+                    static[id(node)] = depth
+
+    def fold(node):
+        if type(node) is _Constant or id(node) not in static:
+            return node
+        copy = _copier(node.template)
+        if copy is None or shared:
+            return _Constant(node.template)
+        return _Static(node.template, copy)
+
+    for node in nodes:
+        if id(node) in static:
+            continue
+        if type(node) is _Dict:
+            node.items = [(fold(k), fold(v)) for k, v in node.items]
+        elif type(node) is _Seq or type(node) is _Record:
+            node.items = [fold(item) for item in node.items]
+    return fold(root)
+
+
+def _copier(template):
+    """
+    A function that copies template (which has no callables in it) the
+    way port would, or None if port would give back something equal
+    to it that could just as well be template itself
+    """
+    which_type = type(template)
+    if which_type is dict:
+        items = [(k, v, _copier(v)) for k, v in template.items()]
+        if all(copy is None for _, _, copy in items):
+            return template.copy
+
+        def copy_dict():
+            return {k: v if copy is None else copy() for k, v, copy in items}
+        return copy_dict
+    elif which_type in (list, tuple, set):
+        items = [(i, _copier(i)) for i in template]
+        if all(copy is None for _, copy in items):
+            return None if which_type is tuple else template.copy
+
+        def copy_seq():
+            return which_type([i if copy is None else copy() for i, copy in items])
+        return copy_seq
+    return None
+
+
+def _path_join(path, key):
+    """
+    The path to the value under key in the dict at path
+    """
+    if isinstance(key, str) and key.isidentifier():
+        return f"{path}.{key}" if path else key
+    return f"{path}[{key!r}]"
+
+
+def _timed_run(run, path):
+    def timed_run(src):
+        return _timed("path", path, run, src)
+    return timed_run
+
+
+# How deep a container can go (in levels of nesting under it, itself
+# included) and still be run as closures calling closures
+_MAX_CLOSURE_DEPTH = 64
+
+
+def _deep_run(node):
+    """
+    A run for a container too deeply nested to run as closures
+
+    Every deep container gets run as a generator (its deep_steps)
+    that yields each of its deep children in turn; those go on a
+    stack, and whatever each one finishes with gets sent back to
+    its parent. A container that ends up with coroutines in it
+    (anywhere) comes out as a _Pending, and if the whole thing does,
+    run gives back a coroutine that resolves all of them at once.
+    """
+    def run(src):
+        stack = [node.deep_steps(src)]
+        value = None
+        while stack:
+            try:
+                child = stack[-1].send(value)
+            except StopIteration as done:
+                stack.pop()
+                value = done.value
+            else:
+                stack.append(child.deep_steps(src))
+                value = None
+        if type(value) is _Pending:
+            return _resolve_pending(value)
+        return value
+    return run
+
+
+class _Pending(object):
+    """
+    A container from _deep_run that has coroutines (or other
+    _Pendings) among its values: make(values) is what it comes
+    to, once they've all been resolved
+    """
+    def __init__(self, make, values):
+        self.make = make
+        self.values = values
+
+
+def _dict_from_halves(keys_values):
+    n = len(keys_values) // 2
+    return dict(zip(keys_values[:n], keys_values[n:]))
+
+
+async def _resolve_pending(root):
+    """
+    Await every coroutine under root concurrently, then make
+    the containers from the bottom up
+    """
+    pendings = []
+    slots = []
+    coros = []
+    stack = [root]
+    while stack:
+        pending = stack.pop()
+        pendings.append(pending)
+        for index, value in enumerate(pending.values):
+            if type(value) is _Pending:
+                stack.append(value)
+            elif _iscoroutine(value):
+                slots.append((pending.values, index))
+                coros.append(value)
+    results = await _gather(coros) if coros else []
+    for (values, index), result in zip(slots, results):
+        values[index] = result
+    # Children were added after their parents, so they get made first
+    made = {}
+    for pending in reversed(pendings):
+        values = pending.values
+        for index, value in enumerate(values):
+            if type(value) is _Pending:
+                values[index] = made.pop(id(value))
+        made[id(pending)] = pending.make(values)
+    return made[id(root)]
+
+
+#
+# Shared Get prefixes
+#
+# Templates tend to have lots of Get chains that start the same way:
+#
+#   Get['spec']['template']['spec']['containers'][0]['image']
+#   Get['spec']['template']['spec']['containers'][0]['name']
+#
+# so _share_prefixes puts every Get chain in a template into a trie,
+# and every prefix where more than one chain branches off (or ends)
+# gets evaluated at most once per source (per run). Each chain then
+# just runs the rest of its steps from there. Looking a prefix up
+# costs about as much as a step or two, so prefixes only get shared
+# when that saves at least _MIN_SHARED_STEPS steps (or a callable).
+# Only compiled plans do this (port runs its plan once, which wouldn't
+# make up for building the trie).
+#
+# Calling a callable step fewer times is only safe if it doesn't have
+# side effects, so like memo (see shapyro.Pure), prefixes only go
+# through a callable if it's wrapped in shapyro.Pure or the plan
+# has memo=True; otherwise they stop just before it.
+#
+# Each prefix remembers its value along with the src it was for, and
+# Template._run forgets them all at the end of the run; that way a src
+# that gets changed between ports never sees an old value, and ports
+# of different sources running at the same time (threads, or a port
+# inside a callable) only ever cost each other a recomputation. If a
+# shared prefix can't be evaluated, the chains under it run from scratch
+# instead, so that they raise (or get skipped) exactly as if nothing
+# was shared.
+#
+
+# Marks a shared prefix that failed to evaluate
+_UNSHARED = object()
+
+_MIN_SHARED_STEPS = 2
+
+
+class _Shared(object):
+    """
+    A coroutine that several things are waiting on
+
+    Each of them gets its own coroutine from get(), but
+    the original is only ever awaited the once.
+    """
+    def __init__(self, coro):
+        self.coro = coro
+        self.task = None
+
+    async def get(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.coro)
+        return await self.task
+
+
+class _Prefix(object):
+    """
+    A run of steps that more than one chain shares: segment applied
+    to parent's value (or to src, for a prefix starting at the top)
+    """
+    def __init__(self, parent, segment):
+        self.parent = parent
+        self.segment = segment
+        # (src, value), set as one so that it's never half-updated
+        self.cached = None
+
+    def get(self, src):
+        """
+        The prefix's value for src, evaluated at most once per run
+        """
+        cached = self.cached
+        if cached is None or cached[0] is not src:
+            cached = self.cached = (src, self.evaluate(src))
+        value = cached[1]
+        if type(value) is _Shared:
+            return value.get()
+        return value
+
+    def evaluate(self, src):
+        base = src if self.parent is None else self.parent.get(src)
+        if base is _UNSHARED:
+            return _UNSHARED
+        try:
+            value = self.segment(base)
+        except Exception:
+            return _UNSHARED
+        if _iscoroutine(value):
+            return _Shared(value)
+        return value
+
+
+class _TrieNode(object):
+    def __init__(self, step):
+        self.step = step
+        self.children = {}
+        self.count = 0
+        self.prefix = None
+
+    def branches(self):
+        """
+        Whether the chains going through here don't all go on the same way
+        """
+        if len(self.children) != 1:
+            return True
+        child, = self.children.values()
+        return child.count != self.count
+
+
+def _share_prefixes(root, min_steps=_MIN_SHARED_STEPS, share_calls=False):
+    """
+    Point every Get chain under root that has a prefix in common
+    with another one at a shared evaluation of that prefix
+
+    Parameters:
+        root: The plan's root node
+        min_steps: int: The fewest steps worth sharing (unless
+            there's a callable among them)
+        share_calls: bool: Share prefixes with any callable in them,
+            not just shapyro.Pure ones
+
+    Returns:
+        list: every _Prefix in use (for Template._forget)
+    """
+    calls = [
+        node for node in _walk(root)
+        if isinstance(node, _Call) and isinstance(node.fn, _GetChainLink)
+    ]
+
+    trie = _TrieNode(None)
+    paths = []
+    for node in calls:
+        steps = _chain_steps(node.fn)
+        path = []
+        trie_node = trie
+        for op, op_arg in steps:
+            if type(op_arg) is _Each:
+                # A shared prefix can't stop partway through a fan-out
+                break
+            if callable(op_arg) and not share_calls and not isinstance(op_arg, Pure):
+                # It might not give the same thing twice
+                break
+            # types are part of the key so e.g. [1] and [True] stay apart
+            key = (op, _arg_types(op_arg), op_arg)
+            try:
+                child = trie_node.children.get(key)
+            except TypeError:
+                # unhashable (e.g. a slice): nothing past here is shared
+                break
+            if child is None:
+                child = trie_node.children[key] = _TrieNode((op, op_arg))
+            child.count += 1
+            path.append(child)
+            trie_node = child
+        paths.append((node, steps, path))
+
+    prefixes = []
+    for node, steps, path in paths:
+        # Walk down the chain's path keeping track of the
+        # deepest shared prefix so far (and where it ended)
+        prefix = None
+        end = 0
+        for index, trie_node in enumerate(path):
+            if trie_node.count < 2:
+                break
+            if not trie_node.branches():
+                continue
+            if trie_node.prefix is None:
+                segment = [t.step for t in path[end:index + 1]]
+                if len(segment) < min_steps \
+                        and not any(callable(op_arg) for _, op_arg in segment):
+                    continue
+                trie_node.prefix = _Prefix(prefix, _maybe_steps_function(segment, _UNSHARED))
+                prefixes.append(trie_node.prefix)
+            prefix = trie_node.prefix
+            end = index + 1
+        if prefix is not None:
+            rest = _steps_function(steps[end:]) if end < len(steps) else None
+            node.run_fn = _from_shared_prefix(node.fn, prefix, rest)
+            node.shared = (prefix, steps[end:])
+    return prefixes
+
+
+def _share_pure_calls(root):
+    """
+    Point every shapyro.Pure callable under root that appears more
+    than once at a single shared evaluation of it (like a one-step
+    prefix; Pure compares equal by what it wraps)
+
+    Returns:
+        list: the _Prefix for each of them (for Template._forget)
+    """
+    groups = {}
+    for node in _walk(root):
+        if isinstance(node, _Call) and isinstance(node.fn, Pure):
+            try:
+                groups.setdefault(node.fn, []).append(node)
+            except TypeError:
+                # wraps something unhashable; leave it be
+                pass
+
+    prefixes = []
+    for fn, nodes in groups.items():
+        if len(nodes) < 2:
+            continue
+        prefix = _Prefix(None, fn)
+        prefixes.append(prefix)
+        for node in nodes:
+            node.run_fn = _from_shared_prefix(node.fn, prefix, None)
+    return prefixes
+
+
+def _from_shared_prefix(chain, prefix, rest):
+    """
+    A run for chain's _Call node that goes by way of a
+    shared prefix and then the rest of its steps
+    """
+    sync_types = _SYNC_TYPES
+    iscoroutine = asyncio.iscoroutine
+
+    # This runs once per chain per source, so it checks
+    # the cache itself instead of going through prefix.get
+    def from_shared_prefix(src):
+        cached = prefix.cached
+        if cached is not None and cached[0] is src \
+                and type(cached[1]) is not _Shared:
+            result = cached[1]
+        else:
+            result = prefix.get(src)
+        if result is _UNSHARED:
+            # Let the chain raise whatever it's going to raise
+            result = chain(src)
+        elif rest is not None:
+            result = rest(result)
+        if type(result) not in sync_types and iscoroutine(result):
+            return port_async(src, result)
+        return result
+    return from_shared_prefix
+
+
+#
+# Lazy views (port_lazy)
+#
+# These work straight off the plan nodes, so they get all of the same
+# classification as a full port; a view just runs one entry's closure
+# at a time instead of all of them. A view can be read long after (and
+# alongside) other runs, so it never goes by way of shared prefixes,
+# which only keep their values for the length of one run.
+#
+
+def _lazy_value(node, src):
+    """
+    node's value for src: a view for a dict or list/tuple,
+    otherwise the result of running it (with coroutines
+    turned into a _Shared, so that they can be read again)
+    """
+    which_type = type(node)
+    if which_type is _Dict:
+        return _LazyDict(node, src)
+    elif which_type is _Seq and node.which_type is not set:
+        return _LazySeq(node, src)
+    elif which_type is _Nested:
+        return _lazy_value(node.template._lazy_root(), src)
+    value = node.run(src)
+    if type(value) not in _SYNC_TYPES and _iscoroutine(value):
+        return _Shared(value)
+    return value
+
+
+class _LazyDict(collections.abc.Mapping):
+    """
+    What port_lazy gives for a dict in the template
+    """
+    __hash__ = None
+
+    def __init__(self, node, src):
+        self._node = node
+        self._src = src
+        # key -> index into node.items, once the keys are worked out
+        self._keys = None
+        # index -> value, for every value that's been worked out
+        self._values = {}
+
+    def _index(self):
+        keys = self._keys
+        if keys is None:
+            src = self._src
+            keys = {}
+            for index, (k_node, v_node) in enumerate(self._node.items):
+                try:
+                    if type(k_node) is _Constant:
+                        k = k_node.template
+                    else:
+                        k = k_node.run(src)
+                        if _iscoroutine(k):
+                            k.close()
+                            raise TypeError("port_lazy can't use dict keys that have to be awaited")
+                    if type(v_node) is _Skip:
+                        # Whether the pair is there at all depends on it
+                        self._values[index] = _lazy_value(v_node, src)
+                except SkipIteration:
+                    continue
+                keys[k] = index
+            self._keys = keys
+        return keys
+
+    def __getitem__(self, key):
+        index = self._index()[key]
+        values = self._values
+        try:
+            value = values[index]
+        except KeyError:
+            try:
+                value = values[index] = _lazy_value(self._node.items[index][1], self._src)
+            except SkipIteration as e:
+                raise KeyError(key) from e
+        if type(value) is _Shared:
+            return value.get()
+        return value
+
+    def __contains__(self, key):
+        return key in self._index()
+
+    def __iter__(self):
+        return iter(self._index())
+
+    def __len__(self):
+        return len(self._index())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class _LazySeq(collections.abc.Sequence):
+    """
+    What port_lazy gives for a list or tuple in the template
+    """
+    __hash__ = None
+
+    def __init__(self, node, src):
+        self._node = node
+        self._src = src
+        # index into node.items for every item that's there
+        self._present = None
+        self._values = {}
+
+    def _index(self):
+        present = self._present
+        if present is None:
+            src = self._src
+            present = []
+            for index, item in enumerate(self._node.items):
+                if type(item) is _Skip:
+                    try:
+                        self._values[index] = _lazy_value(item, src)
+                    except SkipIteration:
+                        continue
+                present.append(index)
+            self._present = present
+        return present
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return self._node.which_type(
+                self[i] for i in range(*position.indices(len(self)))
+            )
+        index = self._index()[position]
+        values = self._values
+        try:
+            value = values[index]
+        except KeyError:
+            try:
+                value = values[index] = _lazy_value(self._node.items[index], self._src)
+            except SkipIteration as e:
+                raise IndexError(position) from e
+        if type(value) is _Shared:
+            return value.get()
+        return value
+
+    def __len__(self):
+        return len(self._index())
+
+    def __eq__(self, other):
+        if isinstance(other, _LazySeq) or type(other) is self._node.which_type:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self._node.which_type(self))
+
+
+#
+# JSON streaming (port_stream)
+#
+
+# How much of infile to read at a time when it's a JSON array
+_STREAM_READ_SIZE = 1 << 16
+
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def _json_backend(name):
+    """
+    (loads, dumps) for the named JSON library (or the best one there is);
+    dumps gives back str or bytes depending on the library
+    """
+    if name is None:
+        try:
+            return _json_backend("orjson")
+        except ImportError:
+            return _json_backend("json")
+    elif name == "orjson":
+        import orjson
+        option = orjson.OPT_NON_STR_KEYS
+
+        def dumps(obj):
+            return orjson.dumps(obj, option=option)
+        return orjson.loads, dumps
+    elif name == "json":
+        encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+        return json.loads, encode
+    raise ValueError(f"backend must be 'orjson' or 'json', not {name!r}")
+
+
+def _ndjson_records(infile, loads):
+    for line_number, line in enumerate(infile, 1):
+        if not line.strip():
+            continue
+        try:
+            yield loads(line)
+        except ValueError as e:
+            raise ValueError(f"bad JSON on line {line_number}: {e}") from e
+
+
+def _json_array_records(infile):
+    """
+    Every item in the JSON array in infile, decoding as little
+    of the file at a time as it takes to get the next one
+    """
+    read = _text_reader(infile)
+    raw_decode = json.JSONDecoder().raw_decode
+    skip_whitespace = _JSON_WHITESPACE.match
+    buf = ""
+    pos = 0
+    eof = False
+    read_size = _STREAM_READ_SIZE
+    need_more = False
+    # What's allowed next: "[" to start, then a "first" item (or "]"),
+    # then "," (or "]") after each item and an "item" after each comma
+    expect = "["
+    record_number = 0
+    while True:
+        pos = skip_whitespace(buf, pos).end()
+        if not eof and (need_more or pos == len(buf)):
+            chunk = read(read_size)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            need_more = False
+            continue
+        if pos == len(buf):
+            raise ValueError("JSON array ended before its closing ]")
+
+        char = buf[pos]
+        if expect == "[":
+            if char != "[":
+                raise ValueError(f"expected a JSON array, found {char!r}")
+            pos += 1
+            expect = "first"
+        elif char == "]" and expect in ("first", ","):
+            return
+        elif expect == ",":
+            if char != ",":
+                raise ValueError(f"expected , or ] after record {record_number}, found {char!r}")
+            pos += 1
+            expect = "item"
+        else:
+            try:
+                value, end = raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ValueError(f"bad JSON in record {record_number + 1}: {e}") from e
+                end = None
+            if end is None or (end == len(buf) and not eof):
+                # The item might go on past what's been read so far (even
+                # a number could have more digits to it), so read more and
+                # try again -- reading twice as much as last time, so that
+                # a huge item doesn't get decoded over and over
+                read_size = max(read_size, len(buf) - pos) * 2
+                need_more = True
+                continue
+            read_size = _STREAM_READ_SIZE
+            record_number += 1
+            yield value
+            pos = end
+            expect = ","
+
+
+def _text_reader(infile):
+    """
+    A read(size) for infile that always gives str
+    """
+    if isinstance(infile.read(0), str):
+        return infile.read
+    decode = codecs.getincrementaldecoder("utf-8")().decode
+
+    def read(size):
+        while True:
+            data = infile.read(size)
+            text = decode(data, final=not data)
+            # A few bytes of a multi-byte character decode to nothing yet
+            if text or not data:
+                return text
+    return read
+
+
+def _ndjson_writer(outfile, dumps):
+    """
+    A write(results) for outfile that writes each result as a line of JSON
+    """
+    text = isinstance(outfile, io.TextIOBase)
+    if text == isinstance(dumps(None), str):
+        newline = "\n" if text else b"\n"
+
+        def write(results):
+            outfile.write(newline.join(map(dumps, results)) + newline)
+    elif text:
+        def write(results):
+            outfile.write(b"\n".join(map(dumps, results)).decode("utf-8") + "\n")
+    else:
+        def write(results):
+            outfile.write(("\n".join(map(dumps, results)) + "\n").encode("utf-8"))
+    return write
@@ -1,3 +1,4 @@
+import pickle
 import unittest
 
 import shapyro
@@ -86,8 +87,194 @@ class ShapyroGetTests(unittest.TestCase):
         get_first = shapyro.Get[0]
         with self.assertRaises(IndexError):
             get_first(from_list)
-    
 
-    
+    def test_bracket_callable_skipiteration_reraises_cause(self):
+        get_missing = shapyro.Get[shapyro.OnlyIfExists("j")]
+        with self.assertRaises(KeyError):
+            get_missing({"k": "test"})
+
+
+class ShapyroGetCompileTests(unittest.TestCase):
+    # .compile() (and the implicit compile after enough calls)
+    # should never change what a chain returns or raises
+    def setUp(self):
+        class TestObj(object):
+            some_attr = {"k": ["zero", "one"]}
+
+        self._from = {"obj": TestObj()}
+        self._get = shapyro.Get['obj'].some_attr['k'][1]
+
+    def test_compile_returns_chain(self):
+        self.assertIs(self._get.compile(), self._get)
+        self.assertEqual(repr(self._get), "shapyro.Get['obj'].some_attr['k'][1]")
+
+    def test_compiled_matches_uncompiled(self):
+        uncompiled = self._get(self._from)
+        self.assertEqual(self._get.compile()(self._from), uncompiled)
+        self.assertEqual(uncompiled, "one")
+
+    def test_implicit_compile(self):
+        for _ in range(64):
+            self.assertEqual(self._get(self._from), "one")
+
+    def test_compiled_identity(self):
+        self.assertEqual(shapyro.Get.compile()("test"), "test")
+
+    def test_compiled_non_identifier_attr(self):
+        class TestObj(object):
+            pass
+
+        from_obj = TestObj()
+        setattr(from_obj, "class", "test")
+        get_class = getattr(shapyro.Get, "class").compile()
+        self.assertEqual(get_class(from_obj), "test")
+
+    def test_compiled_failures(self):
+        with self.assertRaises(KeyError):
+            shapyro.Get['obj'].some_attr['j'].compile()(self._from)
+        with self.assertRaises(AttributeError):
+            shapyro.Get['obj'].non_exist.compile()(self._from)
+        with self.assertRaises(IndexError):
+            shapyro.Get['obj'].some_attr['k'][2].compile()(self._from)
+        with self.assertRaises(KeyError):
+            shapyro.Get[shapyro.OnlyIfExists("j")].compile()({})
+
+
+class ShapyroGetEachTests(unittest.TestCase):
+    def setUp(self):
+        self.pod = {"spec": {"containers": [
+            {"name": "app", "ports": [80, 443]},
+            {"name": "sidecar"},
+            {"name": "proxy", "ports": [8080]}
+        ]}}
+
+    def _both(self, chain):
+        # Before and after the chain compiles itself
+        return chain(self.pod), chain.compile()(self.pod)
+
+    def test_each(self):
+        get_names = shapyro.Get['spec']['containers'][shapyro.Each]['name']
+        for names in self._both(get_names):
+            self.assertEqual(names, ["app", "sidecar", "proxy"])
+        self.assertEqual(repr(get_names), "shapyro.Get['spec']['containers'][shapyro.Each]['name']")
+
+    def test_each_last(self):
+        get_containers = shapyro.Get['spec']['containers'][shapyro.Each]
+        for containers in self._both(get_containers):
+            self.assertEqual(containers, self.pod["spec"]["containers"])
+
+    def test_each_only_if_exists(self):
+        get_ports = shapyro.Get['spec']['containers'][shapyro.Each][shapyro.OnlyIfExists('ports')]
+        for ports in self._both(get_ports):
+            self.assertEqual(ports, [[80, 443], [8080]])
+        with self.assertRaises(KeyError):
+            shapyro.Get['spec']['containers'][shapyro.Each]['ports'](self.pod)
+
+    def test_each_where_and_flat(self):
+        has_ports = shapyro.Each.where(lambda c: "ports" in c)
+        for ports in self._both(shapyro.Get['spec']['containers'][has_ports.flat]['ports']):
+            self.assertEqual(ports, [80, 443, 8080])
+        not_app = has_ports.where(lambda c: c["name"] != "app")
+        for names in self._both(shapyro.Get['spec']['containers'][not_app]['name']):
+            self.assertEqual(names, ["proxy"])
+
+    def test_nested_each(self):
+        get_ports = shapyro.Get['spec']['containers'][shapyro.Each][
+            shapyro.OnlyIfExists('ports')][shapyro.Each][str]
+        for ports in self._both(get_ports):
+            self.assertEqual(ports, [["80", "443"], ["8080"]])
+
+    def test_each_in_port(self):
+        template = {
+            "names": shapyro.Get['spec']['containers'][shapyro.Each]['name'],
+            "first": shapyro.Get['spec']['containers'][0]['name'],
+            "ports": shapyro.OnlyIfExists(shapyro.Get['spec']['containers'][shapyro.Each]['ports'])
+        }
+        for memo in (False, True):
+            self.assertEqual(
+                shapyro.port(self.pod, template, memo=memo),
+                {"names": ["app", "sidecar", "proxy"], "first": "app"}
+            )
+
+    def test_pickle_each(self):
+        get_flat = shapyro.Get['spec']['containers'][shapyro.Each.flat][shapyro.OnlyIfExists('ports')]
+        self.assertEqual(pickle.loads(pickle.dumps(get_flat))(self.pod), [80, 443, 8080])
+
+
+class ShapyroGetInternTests(unittest.TestCase):
+    def test_interned(self):
+        self.assertIs(shapyro.Get['a'].b[0], shapyro.Get['a'].b[0])
+        self.assertIsNot(shapyro.Get[1], shapyro.Get[True])
+        self.assertIs(pickle.loads(pickle.dumps(shapyro.Get['a'])), shapyro.Get['a'])
+
+    def test_not_interned_across_types(self):
+        self.assertIsNot(shapyro.Get[(True,)], shapyro.Get[(1,)])
+        self.assertNotEqual(shapyro.Get[(True,)], shapyro.Get[(1,)])
+        self.assertEqual(repr(shapyro.Get[(True,)]), "shapyro.Get[(True,)]")
+        self.assertIs(shapyro.Get[(1, "a")], shapyro.Get[(1, "a")])
+
+        class Key(str):
+            pass
+
+        self.assertIsNot(shapyro.Get[Key("a")], shapyro.Get["a"])
+        self.assertEqual(shapyro.Get[Key("a")], shapyro.Get[Key("a")])
+
+    def test_eq_and_hash(self):
+        get_slice = shapyro.Get['a'][1:2]
+        self.assertIsNot(get_slice, shapyro.Get['a'][1:2])
+        self.assertEqual(get_slice, shapyro.Get['a'][1:2])
+        self.assertEqual(hash(get_slice), hash(shapyro.Get['a'][1:2]))
+        self.assertNotEqual(get_slice, shapyro.Get['a'][1:3])
+        self.assertNotEqual(shapyro.Get[1], shapyro.Get[True])
+        self.assertNotEqual(shapyro.Get['a'], shapyro.Get['a']['b'])
+        self.assertNotEqual(shapyro.Get['a'], "a")
+        self.assertEqual({shapyro.Get['a'][0:1]: 1}[shapyro.Get['a'][0:1]], 1)
+
+    def test_long_chain(self):
+        chain = shapyro.Get
+        for _ in range(5000):
+            chain = chain[0]
+        self.assertIsInstance(hash(chain), int)
+
+
+class ShapyroGetPickleTests(unittest.TestCase):
+    def test_pickle_roundtrip(self):
+        _from = {"k": [{"j": "test"}]}
+        get_j = shapyro.Get['k'][shapyro.KeyOrDefault(0, None)]['j']
+        unpickled = pickle.loads(pickle.dumps(get_j))
+        self.assertEqual(repr(unpickled), repr(get_j))
+        self.assertEqual(unpickled(_from), "test")
+
+    def test_pickle_compiled(self):
+        get_k = shapyro.Get['k'].compile()
+        self.assertEqual(pickle.loads(pickle.dumps(get_k))({"k": "test"}), "test")
+
+
+class ShapyroGetAsyncTests(unittest.IsolatedAsyncioTestCase):
+    async def _wrap(self, value):
+        return {"k": [value]}
+
+    async def test_async_link(self):
+        get_wrapped = shapyro.Get['v'][self._wrap]['k'][0]
+        self.assertEqual(await get_wrapped({"v": "test"}), "test")
+        self.assertEqual(await get_wrapped.compile()({"v": "test"}), "test")
+
+    async def test_async_source(self):
+        get_k = shapyro.Get['k'][0].compile()
+        self.assertEqual(await get_k(self._wrap("test")), "test")
+
+    async def test_async_each(self):
+        get_each = shapyro.Get[shapyro.Each][self._wrap]['k'][0]
+        self.assertEqual(await get_each(["a", "b"]), ["a", "b"])
+        self.assertEqual(await get_each.compile()(["a", "b"]), ["a", "b"])
+        get_async = shapyro.Get[self._wrap]['k'][shapyro.Each]
+        self.assertEqual(await get_async.compile()("a"), ["a"])
+
+    async def test_async_failure(self):
+        get_j = shapyro.Get[self._wrap]['j'].compile()
+        with self.assertRaises(KeyError):
+            await get_j("test")
+
+
 if __name__ == "__main__":
     unittest.main()
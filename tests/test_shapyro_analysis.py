@@ -0,0 +1,100 @@
+import unittest
+
+import shapyro
+from shapyro.analysis import Attr
+
+
+async def _async_lookup(src):
+    return src
+
+
+def _lookup(src):
+    return src
+
+
+class AnalyzeTests(unittest.TestCase):
+    def test_reads(self):
+        analysis = shapyro.analyze({
+            "image": shapyro.Get['spec']['containers'][0]['image'],
+            "owner": shapyro.OnlyIfExists(shapyro.FromAttr("owner")),
+            "name": shapyro.OnlyIfExists("name"),
+            "labels": [shapyro.Get.meta[shapyro.KeyOrDefault("app", None)]],
+            "pure": shapyro.Pure(shapyro.Get['spec']['replicas']),
+            "nested": shapyro.compile({"uid": shapyro.Get['uid']}),
+            "kind": "Pod"
+        })
+        self.assertEqual(analysis.reads, [
+            ("spec", "containers", 0, "image"),
+            (Attr("owner"),),
+            ("name",),
+            (Attr("meta"), "app"),
+            ("spec", "replicas"),
+            ("uid",)
+        ])
+        self.assertEqual(analysis.opaque, [])
+        self.assertEqual(analysis.constants, ["kind"])
+        self.assertEqual(analysis.entries["labels[0]"], [(Attr("meta"), "app")])
+        self.assertEqual(analysis.entries["nested.uid"], [("uid",)])
+
+    def test_each(self):
+        each = shapyro.Each
+        analysis = shapyro.analyze(
+            shapyro.Get['spec']['containers'][each.where(shapyro.Get['enabled'])]['name']
+        )
+        self.assertEqual(analysis.reads, [
+            ("spec", "containers", each, "enabled"),
+            ("spec", "containers", each, "name")
+        ])
+        self.assertEqual(analysis.projection(), {
+            "spec": {"containers": {each: {"enabled": True, "name": True}}}
+        })
+
+    def test_string_template(self):
+        analysis = shapyro.analyze(shapyro.StringTemplate("{name} <{user.email}> {tags[0]:>{width}}"))
+        self.assertEqual(
+            analysis.reads,
+            [("name",), ("user", Attr("email")), ("tags", 0), ("width",)]
+        )
+        self.assertEqual(shapyro.analyze(shapyro.StringTemplate("{} {}")).reads, [(0,), (1,)])
+        resolved = shapyro.StringTemplate("{a}", resolver=_lookup)
+        self.assertEqual(shapyro.analyze(resolved).opaque, [()])
+
+    def test_opaque_and_async(self):
+        analysis = shapyro.analyze({
+            "a": shapyro.Get['user'][_lookup]['name'],
+            "b": [shapyro.Get['id'][_async_lookup]],
+            "c": _async_lookup,
+            "d": shapyro.Cached(_async_lookup, key=shapyro.Get['uid'])
+        })
+        self.assertEqual(analysis.reads, [("uid",)])
+        self.assertEqual(analysis.opaque, [("user",), ("id",), ()])
+        self.assertEqual(analysis.async_entries, ["b[0]", "c", "d"])
+        self.assertEqual(analysis.entries["d"], [("uid",), ()])
+
+    def test_projection(self):
+        analysis = shapyro.analyze({
+            "a": shapyro.Get['x']['y'],
+            "b": shapyro.Get['x']['z'][0],
+            "c": shapyro.Get['w'],
+            "d": shapyro.Get['w']['v']
+        })
+        self.assertEqual(analysis.projection(), {"x": {"y": True, "z": {0: True}}, "w": True})
+        self.assertIs(shapyro.analyze(shapyro.Get).projection(), True)
+        self.assertIs(shapyro.analyze({"a": _lookup}).projection(), True)
+        self.assertEqual(shapyro.analyze({"a": 1}).projection(), {})
+        sliced = shapyro.analyze({"a": shapyro.Get['x'][0:2], "b": shapyro.Get['y']['z']})
+        self.assertEqual(sliced.projection(), {"x": True, "y": {"z": True}})
+        self.assertIs(shapyro.analyze(shapyro.Get[0:2]).projection(), True)
+
+    def test_deep_template(self):
+        template = shapyro.Get['v']
+        for n in range(3000):
+            template = {"a": template, "n": n}
+        analysis = shapyro.analyze(template)
+        self.assertEqual(analysis.reads, [("v",)])
+        self.assertEqual(len(analysis.constants), 3000)
+        self.assertEqual(analysis.constants[-1], "n")
+
+
+if __name__ == "__main__":
+    unittest.main()
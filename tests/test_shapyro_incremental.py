@@ -0,0 +1,125 @@
+import asyncio
+import copy
+import unittest
+
+import shapyro
+
+
+class IncrementalPortTests(unittest.TestCase):
+    def setUp(self):
+        self._calls = []
+
+        def count(name):
+            def counted(value):
+                self._calls.append(name)
+                return value
+            return counted
+
+        self._template = {
+            "name": shapyro.Get['metadata']['name'][count("name")],
+            "replicas": shapyro.Get['spec']['replicas'][count("replicas")],
+            "images": shapyro.Get['spec']['containers'][shapyro.Each]['image'][count("image")],
+            "labels": {
+                "app": shapyro.OnlyIfExists(shapyro.Get['metadata']['labels']['app'][count("app")]),
+                "kind": "Deployment"
+            }
+        }
+        self._src = {
+            "metadata": {"uid": "u1", "name": "web", "labels": {"app": "a"}},
+            "spec": {"replicas": 2, "containers": [{"image": "i1"}, {"image": "i2"}]}
+        }
+
+    def _changed(self, **changes):
+        src = copy.deepcopy(self._src)
+        for path, value in changes.items():
+            *parents, last = path.split("__")
+            target = src
+            for step in parents:
+                target = target[int(step) if step.isdigit() else step]
+            if value is None:
+                del target[last]
+            else:
+                target[last] = value
+        return src
+
+    def test_first_and_unchanged(self):
+        incremental = shapyro.IncrementalPort(self._template)
+        output, patch = incremental(self._src)
+        self.assertEqual(output, shapyro.port(self._src, self._template))
+        self.assertEqual(set(patch), {("name",), ("replicas",), ("images",), ("labels", "app"),
+                                      ("labels", "kind")})
+        self._calls.clear()
+        again = incremental(copy.deepcopy(self._src))
+        self.assertEqual(again, (output, {}))
+        self.assertIs(again.output, output)
+        self.assertEqual(self._calls, [])
+
+    def test_changed_fields(self):
+        incremental = shapyro.IncrementalPort(self._template)
+        first = incremental(self._src).output
+        self._calls.clear()
+        src = self._changed(spec__replicas=3)
+        output, patch = incremental(src)
+        self.assertEqual(self._calls, ["replicas"])
+        self.assertEqual(patch, {("replicas",): 3})
+        self.assertEqual(output, shapyro.port(src, self._template))
+        self.assertIs(output["labels"], first["labels"])
+        self.assertEqual(first["replicas"], 2)
+
+        self._calls.clear()
+        src = self._changed(spec__replicas=3, spec__containers__1__image="i3", metadata__labels={})
+        output, patch = incremental(src)
+        self.assertEqual(self._calls, ["image", "image"])
+        self.assertEqual(patch, {("images",): ["i1", "i3"],
+                                 ("labels", "app"): shapyro.IncrementalPort.REMOVED})
+        self.assertEqual(output, shapyro.port(src, self._template))
+
+    def test_explicit_changes_and_keys(self):
+        incremental = shapyro.IncrementalPort(self._template, key=shapyro.Get['metadata']['uid'])
+        incremental(self._src)
+        other = self._changed(metadata__uid="u2", metadata__name="other")
+        self.assertEqual(incremental(other).output["name"], "other")
+        self._calls.clear()
+        # Trusts changed over the sources themselves
+        src = self._changed(metadata__name="renamed", spec__replicas=5)
+        output, patch = incremental(src, changed=[("metadata", "name")])
+        self.assertEqual(self._calls, ["name"])
+        self.assertEqual(patch, {("name",): "renamed"})
+        self.assertEqual(output["replicas"], 2)
+        self.assertEqual(incremental.diff(self._src, src), [("metadata", "name"), ("spec", "replicas")])
+        incremental.forget("u1")
+        self.assertEqual(incremental(src).output["replicas"], 5)
+
+    def test_async(self):
+        async def upper(src):
+            return src["metadata"]["name"].upper()
+
+        incremental = shapyro.IncrementalPort({"upper": upper, "name": shapyro.Get['metadata']['name']})
+        self.assertEqual(asyncio.run(incremental(self._src)).output, {"upper": "WEB", "name": "web"})
+        output, patch = asyncio.run(incremental(self._changed(metadata__name="x")))
+        self.assertEqual(output, {"upper": "X", "name": "x"})
+        self.assertEqual(patch, {("upper",): "X", ("name",): "x"})
+
+    def test_slice(self):
+        incremental = shapyro.IncrementalPort({"a": shapyro.Get['x'][0:2], "b": shapyro.Get['y']})
+        self.assertEqual(incremental({"x": [1, 2, 3], "y": 1}).output, {"a": [1, 2], "b": 1})
+        output, patch = incremental({"x": [1, 5, 3], "y": 1})
+        self.assertEqual(output, {"a": [1, 5], "b": 1})
+        self.assertEqual(patch, {("a",): [1, 5]})
+
+    def test_deep_template(self):
+        template = shapyro.Get['v']
+        for n in range(3000):
+            template = {"a": template, "n": n}
+        incremental = shapyro.IncrementalPort(template)
+        first = incremental({"v": 1}).output
+        output, patch = incremental({"v": 2})
+        self.assertEqual(patch, {("a",) * 3000: 2})
+        self.assertIs(output["a"]["n"], first["a"]["n"])
+        for _ in range(3000):
+            output = output["a"]
+        self.assertEqual(output, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
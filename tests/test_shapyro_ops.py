@@ -1,3 +1,8 @@
+import asyncio
+import concurrent.futures
+import pickle
+import threading
+import time
 import unittest
 
 import shapyro
@@ -159,6 +164,61 @@ class StringTemplateTest(unittest.TestCase):
         with self.assertRaises(IndexError):
             b(a)
 
+    def test_stringtemplate_same_as_format(self):
+        #
+        # Nested fields, attributes, conversions and (nested)
+        # format specs all come out just like str.format
+        #
+        class User:
+            email = "test@example.com"
+
+        user = User()
+        a = {"name": "test", "user": user, "tags": [["x", "y"]], "width": 6, "n": 1.5}
+        template = "'{name!r}' <{user.email}> {tags[0][1]:>{width}} {n:{width}.2f} {{n}} \\\n"
+        self.assertEqual(shapyro.StringTemplate(template)(a), template.format(**a))
+
+        b = ("one", user)
+        self.assertEqual(shapyro.StringTemplate("{1.email}: {0!a:*^9}")(b), "test@example.com: **'one'**")
+
+        c = {"a": {"é": 1, 2: "two", "-1": "minus"}, "w": 3}
+        template = "{a[é]} {a[2]} {a[-1]:>{w}}"
+        self.assertEqual(shapyro.StringTemplate(template)(c), template.format(**c))
+
+    def test_stringtemplate_other_sources(self):
+        #
+        # Anything that isn't a plain dict/list/tuple goes
+        # to str.format, which unpacks it as before
+        #
+        import collections
+        a = collections.defaultdict(lambda: "default", name="test")
+        with self.assertRaises(KeyError):
+            shapyro.StringTemplate("{name} {other}")(a)
+        self.assertEqual(shapyro.StringTemplate("{} {}")(iter(["a", "b"])), "a b")
+
+    def test_stringtemplate_wrong_kind_of_field(self):
+        with self.assertRaises(IndexError):
+            shapyro.StringTemplate("{name} {0}")({"name": "test"})
+        with self.assertRaises(KeyError):
+            shapyro.StringTemplate("{0} {name}")(["test"])
+        with self.assertRaises(ValueError):
+            shapyro.StringTemplate("{0} {}")(["test", "test2"])
+        with self.assertRaises(ValueError):
+            shapyro.StringTemplate("{a!x}")({"a": 1})
+        with self.assertRaises(ValueError):
+            shapyro.StringTemplate("{a:{b!x}}")({"a": 1, "b": 2})
+        with self.assertRaises(ValueError):
+            shapyro.StringTemplate("{a[0]x}")({"a": [1]})
+
+    def test_format_many(self):
+        a = [{"name": "one"}, ["two"], {"name": "three"}]
+        self.assertEqual(
+            shapyro.format_many("<{name}>", a, resolver=lambda s: {"name": s[0]} if isinstance(s, list) else s),
+            ["<one>", "<two>", "<three>"]
+        )
+        self.assertEqual(shapyro.format_many("{0}-{1}", [(1, 2), [3, 4]]), ["1-2", "3-4"])
+        with self.assertRaises(KeyError):
+            shapyro.format_many("{name}", [{"name": "one"}, {}])
+
 class OnlyIfExistsTests(unittest.TestCase):
     def test_index_in_list_exists(self):
         #
@@ -262,5 +322,221 @@ class OnlyIfExistsTests(unittest.TestCase):
         with self.assertRaises(IOError):
             c(a)
 
+class CachedTests(unittest.TestCase):
+    def setUp(self):
+        self._calls = []
+
+        def lookup(src):
+            self._calls.append(src["id"])
+            return src["id"] * 2
+
+        self._lookup = lookup
+
+    def test_cached(self):
+        cached = shapyro.Cached(self._lookup, key=shapyro.Get['id'])
+        template = {"double": cached, "again": shapyro.Get[cached]}
+        for i in (1, 2, 1):
+            self.assertEqual(shapyro.port({"id": i}, template), {"double": i * 2, "again": i * 2})
+        self.assertEqual(self._calls, [1, 2])
+        self.assertEqual(cached.cache_info(), shapyro.op.CacheInfo(4, 2, 1024, 2))
+        cached.cache_clear()
+        self.assertEqual(cached.cache_info(), shapyro.op.CacheInfo(0, 0, 1024, 0))
+
+    def test_cached_lru(self):
+        cached = shapyro.Cached(self._lookup, key=shapyro.Get['id'], maxsize=2)
+        for i in (1, 2, 1, 3, 2, 1):
+            cached({"id": i})
+        # 2 was least recently used when 3 came in, then 1 was when 2 did
+        self.assertEqual(self._calls, [1, 2, 3, 2, 1])
+
+    def test_cached_ttl(self):
+        cached = shapyro.Cached(self._lookup, key=shapyro.Get['id'], ttl=0.01)
+        cached({"id": 1})
+        cached({"id": 1})
+        time.sleep(0.02)
+        cached({"id": 1})
+        self.assertEqual(self._calls, [1, 1])
+
+    def test_cached_ttl_unbounded(self):
+        cached = shapyro.Cached(self._lookup, key=shapyro.Get['id'], maxsize=None, ttl=0.01)
+        for i in range(100):
+            cached({"id": i})
+        self.assertEqual(cached.cache_info().currsize, 100)
+        time.sleep(0.02)
+        cached({"id": 100})
+        self.assertEqual(cached.cache_info().currsize, 1)
+        time.sleep(0.02)
+        self.assertEqual(cached.cache_info().currsize, 0)
+
+    def test_cached_unhashable_and_errors(self):
+        cached = shapyro.Cached(self._lookup)
+        cached({"id": 1})
+        cached({"id": 1})
+        self.assertEqual(self._calls, [1, 1])
+        with self.assertRaises(KeyError):
+            cached({})
+        self.assertEqual(cached.cache_info().misses, 3)
+        with self.assertRaises(ValueError):
+            shapyro.Cached(self._lookup, maxsize=0)
+        with self.assertRaises(TypeError):
+            shapyro.Cached(None)
+
+    def test_cached_async_single_flight(self):
+        started = []
+
+        async def fetch(src):
+            started.append(src["id"])
+            await asyncio.sleep(0.01)
+            return src["id"]
+
+        cached = shapyro.Cached(fetch, key=shapyro.Get['id'])
+        template = [cached, cached, {"a": cached}]
+        self.assertEqual(asyncio.run(shapyro.port({"id": 1}, template)), [1, 1, {"a": 1}])
+        self.assertEqual(asyncio.run(shapyro.port({"id": 1}, template)), [1, 1, {"a": 1}])
+        self.assertEqual(started, [1])
+
+    def test_cached_async_failure_not_cached(self):
+        async def fail(src):
+            raise ValueError(src)
+
+        cached = shapyro.Cached(fail)
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                asyncio.run(shapyro.port(1, cached))
+        self.assertEqual(cached.cache_info().currsize, 0)
+
+
+class BlockingTests(unittest.TestCase):
+    def setUp(self):
+        self._threads = []
+
+    def _slow(self, src):
+        self._threads.append(threading.current_thread())
+        time.sleep(0.05)
+        return src["k"]
+
+    def test_sync_inline(self):
+        self.assertEqual(shapyro.port({"k": 1}, {"v": shapyro.Blocking(self._slow)}), {"v": 1})
+        self.assertEqual(self._threads, [threading.current_thread()])
+
+    def test_sync_inline_in_loop(self):
+        # A sync port stays sync with an event loop running, unless it asks to offload
+        async def port():
+            return shapyro.port({"k": 1}, {"v": shapyro.Blocking(self._slow)})
+
+        self.assertEqual(asyncio.run(port()), {"v": 1})
+        self.assertEqual(self._threads, [threading.current_thread()])
+
+    def test_async_offloaded(self):
+        blocking = shapyro.Blocking(self._slow)
+
+        async def ticks(src):
+            # keeps running while the blocking calls are out in threads
+            for _ in range(5):
+                await asyncio.sleep(0.01)
+            return "ticked"
+
+        async def port():
+            start = time.perf_counter()
+            result = await shapyro.port({"k": 1}, [blocking, blocking, blocking, ticks], offload=True)
+            return result, time.perf_counter() - start
+
+        result, elapsed = asyncio.run(port())
+        self.assertEqual(result, [1, 1, 1, "ticked"])
+        self.assertLess(elapsed, 0.14)
+        self.assertNotIn(threading.current_thread(), self._threads)
+
+    def test_executor(self):
+        with concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="mine") as executor:
+            blocking = shapyro.Blocking(self._slow, executor=executor)
+
+            async def port():
+                return await shapyro.port({"k": 2}, blocking, offload=True)
+
+            self.assertEqual(asyncio.run(port()), 2)
+        self.assertTrue(self._threads[0].name.startswith("mine"))
+
+    def test_not_callable(self):
+        with self.assertRaises(TypeError):
+            shapyro.Blocking("k")
+
+
+class BatchedTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self._batches = []
+
+    async def _fetch(self, keys):
+        self._batches.append(keys)
+        await asyncio.sleep(0)
+        return [key * 10 for key in keys]
+
+    def _sources(self, *ids):
+        return [{"id": i} for i in ids]
+
+    async def test_batches_concurrent_ports(self):
+        batched = shapyro.Batched(self._fetch, key=shapyro.Get['id'])
+        template = {"id": shapyro.Get['id'], "value": batched}
+        results = await asyncio.gather(*(shapyro.port(src, template) for src in self._sources(1, 2, 1, 3)))
+        self.assertEqual([r["value"] for r in results], [10, 20, 10, 30])
+        self.assertEqual(self._batches, [[1, 2, 3]])
+
+    async def test_port_many_async_and_max_batch(self):
+        batched = shapyro.Batched(self._fetch, key=shapyro.Get['id'], max_batch=4, max_wait_ms=20)
+        results = shapyro.port_many_async(self._sources(*range(10)), batched, max_in_flight=10)
+        self.assertEqual([r async for r in results], [i * 10 for i in range(10)])
+        self.assertEqual([len(keys) for keys in self._batches], [4, 4, 2])
+
+    async def test_mapping_and_failures(self):
+        def fetch(keys):
+            self._batches.append(keys)
+            return {key: key.upper() for key in keys if key != "missing"}
+
+        batched = shapyro.Batched(fetch)
+        self.assertEqual(await shapyro.port("a", batched), "A")
+        with self.assertRaises(KeyError):
+            await shapyro.port("missing", batched)
+
+        async def fail(keys):
+            raise ValueError(keys)
+
+        failing = shapyro.Batched(fail)
+        results = await asyncio.gather(failing(1), failing(2), return_exceptions=True)
+        self.assertEqual([type(r) for r in results], [ValueError, ValueError])
+        with self.assertRaises(TypeError):
+            await shapyro.Batched(fetch)(["unhashable"])
+
+    async def test_wrong_count(self):
+        with self.assertRaises(ValueError):
+            await shapyro.Batched(lambda keys: [])(1)
+
+    def test_bad_args(self):
+        with self.assertRaises(ValueError):
+            shapyro.Batched(self._fetch, max_batch=0)
+        with self.assertRaises(TypeError):
+            shapyro.Batched("nope")
+
+
+class PickleTests(unittest.TestCase):
+    def test_ops_pickle(self):
+        a = {"k": "test"}
+        ops = [
+            shapyro.FromAttr("not_the_attr", "but_default"),
+            shapyro.KeyOrDefault("v", "the_default"),
+            shapyro.StringTemplate("Test value: {k}"),
+            shapyro.OnlyIfExists(shapyro.Get['k']),
+            shapyro.Cached(shapyro.Get['k'], maxsize=10),
+            shapyro.Blocking(shapyro.Get['k'])
+        ]
+        batched = shapyro.Batched(len, key=shapyro.Get['k'], max_batch=5)
+        self.assertEqual(repr(pickle.loads(pickle.dumps(batched))), repr(batched))
+        for op in ops:
+            unpickled = pickle.loads(pickle.dumps(op))
+            self.assertEqual(unpickled(a), op(a))
+            self.assertEqual(repr(unpickled), repr(op))
+
+    def test_op_keywords_pickle(self):
+        b = shapyro.StringTemplate("{0}", resolver=sorted)
+        self.assertEqual(pickle.loads(pickle.dumps(b))(["z", "a"]), "a")
+
 if __name__=="__main__":
     unittest.main()
\ No newline at end of file
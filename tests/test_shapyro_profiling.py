@@ -0,0 +1,61 @@
+import asyncio
+import unittest
+
+import shapyro
+
+
+class ProfileTests(unittest.TestCase):
+    def setUp(self):
+        self._template = {
+            "spec": {"containers": [{"image": shapyro.Get['spec']['containers'][0]['image']}]},
+            "maybe": shapyro.OnlyIfExists("nope"),
+            "nested": shapyro.compile({"name": shapyro.Get['name']}),
+            2: "constant"
+        }
+        self._src = {"spec": {"containers": [{"image": "img"}]}, "name": "fx"}
+
+    def test_profile_paths(self):
+        with shapyro.profile() as stats:
+            result = shapyro.port(self._src, self._template)
+            shapyro.port(self._src, self._template)
+        self.assertEqual(result, shapyro.port(self._src, self._template))
+        self.assertEqual(
+            sorted(stats.paths), ["maybe", "nested.name", "spec.containers[0].image"]
+        )
+        image = stats.paths["spec.containers[0].image"]
+        self.assertEqual((image.calls, image.sync, image.skips), (2, 2, 0))
+        self.assertGreaterEqual(image.total_time, image.max_time)
+        self.assertEqual(stats.paths["maybe"].skips, 2)
+        self.assertEqual(stats.chains["shapyro.Get['name']"].calls, 2)
+        self.assertIn("spec.containers[0].image", stats.report())
+
+    def test_profile_errors_and_coroutines(self):
+        async def get_name(src):
+            return src["name"]
+
+        with shapyro.profile() as stats:
+            with self.assertRaises(KeyError):
+                shapyro.port({}, self._template)
+            self.assertEqual(asyncio.run(shapyro.port(self._src, [get_name])), ["fx"])
+        self.assertEqual(stats.paths["spec.containers[0].image"].errors, 1)
+        self.assertEqual(stats.paths["[0]"].coroutines, 1)
+
+    def test_profile_hook(self):
+        events = []
+        with shapyro.profile(hook=lambda *event: events.append(event)):
+            shapyro.Get['name'](self._src)
+        self.assertEqual(len(events), 1)
+        kind, key, elapsed, outcome = events[0]
+        self.assertEqual((kind, key, outcome), ("chain", "shapyro.Get['name']", "sync"))
+        self.assertIsInstance(elapsed, float)
+
+    def test_profile_off(self):
+        with shapyro.profile() as stats:
+            pass
+        shapyro.port(self._src, self._template)
+        self.assertEqual(stats.paths, {})
+        self.assertEqual(stats.chains, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
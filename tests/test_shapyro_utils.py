@@ -1,8 +1,26 @@
 
+import array
+import asyncio
+import collections
+import collections.abc
+import dataclasses
+import importlib.util
+import io
+import json
+import pickle
+import typing
 import unittest
 
 import shapyro
 
+
+async def _async_upper(src):
+    return src["name"].upper()
+
+
+async def _async_upper_user(src):
+    return src["user"]["name"].upper()
+
 class PortTests(unittest.TestCase):
     """
     This set of tests is going to be structured
@@ -84,6 +102,817 @@ class PortTests(unittest.TestCase):
         }
         self.assertEqual(dst(self._input), expect)
 
+    def test_seq_types(self):
+        src = self._input
+        dst = {
+            "list": [shapyro.Get['user']['id'], shapyro.OnlyIfExists("nope")],
+            "tuple": (shapyro.Get['user']['id'], "const"),
+            "set": {shapyro.Get['user']['group']}
+        }
+        expect = {
+            "list": [0],
+            "tuple": (0, "const"),
+            "set": {"Admin"}
+        }
+        self.assertEqual(shapyro.port(src, dst), expect)
+
+    def test_callable_key(self):
+        src = self._input
+        dst = {shapyro.Get['user']['name']: shapyro.Get['user']['id']}
+        self.assertEqual(shapyro.port(src, dst), {"test": 0})
+
+    def test_old_helpers(self):
+        from shapyro.utils import port_dict, port_ident, port_seq
+        src = self._input
+        self.assertEqual(port_dict(src, {"id": shapyro.Get['user']['id']}), {"id": 0})
+        self.assertEqual(port_seq(tuple)(src, [shapyro.Get['user']['id'], 1]), (0, 1))
+        self.assertEqual(port_ident(src, shapyro.Get['user']['name']), "test")
+        self.assertEqual(port_ident(src, "const"), "const")
+        self.assertEqual(asyncio.run(port_seq(set)(src, [_async_upper_user])), {"TEST"})
+
+
+class CompileTests(unittest.TestCase):
+    def setUp(self):
+        self._inputs = [
+            {"user": {"name": "test", "attrs": {"admin": True}}},
+            {"user": {"name": "test2"}}
+        ]
+        self._template = {
+            "author": shapyro.Get['user']['name'],
+            "attrs": shapyro.OnlyIfExists(shapyro.Get['user']['attrs']),
+            "meta": {"source": "test", "names": [shapyro.Get['user']['name']]}
+        }
+        self._expect = [
+            {
+                "author": "test",
+                "attrs": {"admin": True},
+                "meta": {"source": "test", "names": ["test"]}
+            },
+            {
+                "author": "test2",
+                "meta": {"source": "test", "names": ["test2"]}
+            }
+        ]
+
+    def test_compile_matches_port(self):
+        plan = shapyro.compile(self._template)
+        for src, expect in zip(self._inputs, self._expect):
+            self.assertEqual(plan(src), expect)
+            self.assertEqual(shapyro.port(src, self._template), expect)
+
+    def test_template_is_plan(self):
+        plan = shapyro.Template(self._template)
+        self.assertIs(shapyro.compile(plan), plan)
+        self.assertEqual([plan(src) for src in self._inputs], self._expect)
+
+    def test_nested_template(self):
+        plan = shapyro.compile({"inner": shapyro.Template(self._template)})
+        self.assertEqual(plan(self._inputs[1]), {"inner": self._expect[1]})
+
+    def test_fresh_containers(self):
+        #
+        # Every call should build new containers,
+        # even for parts of the template without callables
+        #
+        plan = shapyro.compile(self._template)
+        first = plan(self._inputs[0])
+        second = plan(self._inputs[0])
+        self.assertIsNot(first["meta"], second["meta"])
+        self.assertIsNot(first["meta"], self._template["meta"])
+
+    def test_constant_folding(self):
+        template = {
+            "name": shapyro.Get['user']['name'],
+            "static": {"labels": {"a": "b"}, "ports": [80, 443], "set": {1, 2}},
+            "args": ("--a", "--b"),
+            "mixed": ("x", ["y"]),
+            "seq": [{"k": "v"}, shapyro.Get['user']['name']]
+        }
+        expect = {
+            "name": "test2",
+            "static": {"labels": {"a": "b"}, "ports": [80, 443], "set": {1, 2}},
+            "args": ("--a", "--b"),
+            "mixed": ("x", ["y"]),
+            "seq": [{"k": "v"}, "test2"]
+        }
+        plan = shapyro.compile(template)
+        first = plan(self._inputs[1])
+        self.assertEqual(first, expect)
+        self.assertIs(first["args"], template["args"])
+        second = plan(self._inputs[1])
+        for result in (first, second):
+            self.assertIsNot(result["static"], template["static"])
+            self.assertIsNot(result["static"]["labels"], template["static"]["labels"])
+            self.assertIsNot(result["mixed"][1], template["mixed"][1])
+            self.assertIsNot(result["seq"][0], template["seq"][0])
+        self.assertIsNot(first["static"]["ports"], second["static"]["ports"])
+        self.assertIsNot(shapyro.port({}, [1, 2]), shapyro.port({}, [1, 2]))
+
+    def test_shared_constants(self):
+        meta = {"source": "test", "tags": ["a", "b"]}
+        template = {"name": shapyro.Get['user']['name'], "meta": meta}
+        plan = shapyro.compile(template, shared_constants=True)
+        self.assertEqual(plan(self._inputs[1]), {"name": "test2", "meta": meta})
+        self.assertIs(plan(self._inputs[1])["meta"], meta)
+        static = {"a": [1]}
+        self.assertIs(shapyro.port({}, static, shared_constants=True), static)
+        self.assertIs(shapyro.compile(plan), plan)
+        self.assertTrue(shapyro.compile(shapyro.Template(template), shared_constants=True).shared_constants)
+        self.assertEqual(repr(plan), f"shapyro.Template({template!r}, shared_constants=True)")
+        self.assertTrue(pickle.loads(pickle.dumps(plan)).shared_constants)
+
+    def test_onlyifexists_missing_key_raises_skipiteration(self):
+        plan = shapyro.compile(shapyro.OnlyIfExists("nope"))
+        with self.assertRaises(shapyro.SkipIteration):
+            plan({})
+
+
+@dataclasses.dataclass(slots=True)
+class _UserRecord:
+    author: str
+    attrs: dict = None
+    tags: list = dataclasses.field(default_factory=list)
+
+
+@dataclasses.dataclass(slots=True)
+class _UserKwRecord:
+    attrs: dict = dataclasses.field(default=None, kw_only=True)
+    author: str = "anon"
+    tags: list = dataclasses.field(default_factory=list, kw_only=True)
+
+
+class _UserTuple(typing.NamedTuple):
+    author: str
+    attrs: dict = {}
+
+
+class RecordTests(unittest.TestCase):
+    def setUp(self):
+        self._inputs = [
+            {"user": {"name": "test", "attrs": {"admin": True}}},
+            {"user": {"name": "test2"}}
+        ]
+        self._template = {
+            "author": shapyro.Get['user']['name'],
+            "attrs": shapyro.OnlyIfExists(shapyro.Get['user']['attrs'])
+        }
+
+    def test_dataclass(self):
+        plan = shapyro.compile(self._template, record=_UserRecord)
+        self.assertEqual(
+            [plan(src) for src in self._inputs],
+            [_UserRecord("test", {"admin": True}), _UserRecord("test2")]
+        )
+        self.assertIsNot(plan({"user": {"name": "x"}}).tags, plan({"user": {"name": "x"}}).tags)
+        self.assertIs(shapyro.compile(plan, record=_UserRecord), plan)
+        self.assertEqual(pickle.loads(pickle.dumps(plan))(self._inputs[1]), _UserRecord("test2"))
+
+    def test_dataclass_kw_only(self):
+        plan = shapyro.compile(dict(self._template, tags=shapyro.Get['user']['name']), record=_UserKwRecord)
+        self.assertEqual(
+            [plan(src) for src in self._inputs],
+            [_UserKwRecord("test", attrs={"admin": True}, tags="test"), _UserKwRecord("test2", tags="test2")]
+        )
+
+    def test_namedtuple(self):
+        self.assertEqual(
+            shapyro.port(self._inputs[1], self._template, record=_UserTuple),
+            _UserTuple("test2", {})
+        )
+
+    def test_from_keys(self):
+        plan = shapyro.compile(self._template, record=True)
+        first = plan(self._inputs[0])
+        self.assertIsInstance(first, plan.record)
+        self.assertEqual((first.author, first.attrs), ("test", {"admin": True}))
+        self.assertIsNone(plan(self._inputs[1]).attrs)
+        self.assertFalse(hasattr(first, "__dict__"))
+        self.assertEqual(repr(plan), f"shapyro.Template({self._template!r}, record=True)")
+
+    def test_nested_profiled(self):
+        plan = shapyro.compile({"n": shapyro.Template(self._template, record=_UserRecord)})
+        expect = {"n": _UserRecord("test2")}
+        self.assertEqual(plan(self._inputs[1]), expect)
+        with shapyro.profile() as stats:
+            self.assertEqual(plan(self._inputs[1]), expect)
+        self.assertIn("n.author", stats.paths)
+
+    def test_skipped_required_field(self):
+        template = {"author": shapyro.OnlyIfExists(shapyro.Get['user']['nick'])}
+        with self.assertRaises(shapyro.SkipIteration):
+            shapyro.port(self._inputs[0], template, record=_UserRecord)
+
+    def test_async(self):
+        async def name(src):
+            return src["user"]["name"]
+
+        result = asyncio.run(shapyro.port(self._inputs[1], {"author": name}, record=_UserTuple))
+        self.assertEqual(result, _UserTuple("test2", {}))
+
+    def test_bad_templates(self):
+        for template, record in [
+            ([shapyro.Get['x']], True),
+            ({shapyro.Get['x']: 1}, True),
+            ({"author": 1, "nope": 2}, _UserRecord),
+            ({"attrs": 1}, _UserRecord),
+            ({"author": 1}, dict)
+        ]:
+            with self.assertRaises(TypeError):
+                shapyro.compile(template, record=record)
+
+
+class SharedPrefixTests(unittest.TestCase):
+    def setUp(self):
+        self._calls = 0
+
+        def count(value):
+            self._calls += 1
+            return value
+
+        self._count = count
+        spec = shapyro.Get['spec']['template'][shapyro.Pure(count)]['containers'][0]
+        self._template = {
+            "image": spec['image'],
+            "name": spec['name'],
+            "ports": shapyro.OnlyIfExists(spec['ports']),
+            "first_port": {"port": shapyro.OnlyIfExists(spec['ports'][0])},
+            "labels": [spec['labels']['app'], shapyro.Get['spec']['template'][shapyro.Pure(count)]['labels']]
+        }
+
+    def _src(self, **container):
+        return {"spec": {"template": {"containers": [container], "labels": "x"}}}
+
+    def test_shared_prefix(self):
+        plan = shapyro.compile(self._template)
+        src = self._src(image="img", name="n", ports=[80], labels={"app": "a"})
+        expect = {
+            "image": "img",
+            "name": "n",
+            "ports": [80],
+            "first_port": {"port": 80},
+            "labels": ["a", "x"]
+        }
+        self.assertEqual(plan(src), expect)
+        self.assertEqual(self._calls, 1)
+        self.assertEqual(plan(src), expect)
+        self.assertEqual(self._calls, 2)
+
+    def test_shared_prefix_impure(self):
+        # Without Pure (or memo), a callable gets called for every chain
+        spec = shapyro.Get['spec'][self._count]['template']
+        template = {"a": spec['a'], "b": spec['b'], "c": shapyro.Get['spec']['template']['c']}
+        src = {"spec": {"template": {"a": 1, "b": 2, "c": 3}}}
+        self.assertEqual(shapyro.compile(template)(src), {"a": 1, "b": 2, "c": 3})
+        self.assertEqual(self._calls, 2)
+        self.assertEqual(shapyro.compile(template, memo=True)(src), {"a": 1, "b": 2, "c": 3})
+        self.assertEqual(self._calls, 3)
+
+    def test_shared_prefix_changed_source(self):
+        plan = shapyro.compile(self._template)
+        src = self._src(image="img", name="n", labels={"app": "a"})
+        self.assertEqual(plan(src)["image"], "img")
+        src["spec"]["template"]["containers"][0]["image"] = "img2"
+        self.assertEqual(plan(src)["image"], "img2")
+
+    def test_shared_prefix_skips_and_errors(self):
+        plan = shapyro.compile(self._template)
+        src = self._src(image="img", name="n", labels={"app": "a"})
+        self.assertEqual(plan(src)["first_port"], {})
+        self.assertNotIn("ports", plan(src))
+
+        with self.assertRaises(IndexError):
+            plan({"spec": {"template": {"containers": [], "labels": "x"}}})
+        with self.assertRaises(KeyError):
+            plan({"spec": {}})
+
+    def test_shared_prefix_async(self):
+        async def wrap(value):
+            self._calls += 1
+            return value
+
+        spec = shapyro.Get['spec'][shapyro.Pure(wrap)]['template']
+        plan = shapyro.compile({"a": spec['a'], "b": spec['b'], "c": [spec['c']]})
+        src = {"spec": {"template": {"a": 1, "b": 2, "c": 3}}}
+        self.assertEqual(asyncio.run(plan(src)), {"a": 1, "b": 2, "c": [3]})
+        self.assertEqual(self._calls, 1)
+
+
+class SkipTests(unittest.TestCase):
+    class _Obj(object):
+        a = 1
+
+    def setUp(self):
+        self._src = {
+            "a": {"b": 1},
+            "obj": self._Obj(),
+            "default": collections.defaultdict(int),
+            "list": [1]
+        }
+
+    def test_skip_missing(self):
+        template = {
+            "there": shapyro.OnlyIfExists(shapyro.Get['a']['b']),
+            "missing_key": shapyro.OnlyIfExists(shapyro.Get['a']['x']),
+            "deeper": shapyro.OnlyIfExists(shapyro.Get['a']['b']['c']),
+            "attr": shapyro.OnlyIfExists(shapyro.Get['obj'].a),
+            "missing_attr": shapyro.OnlyIfExists(shapyro.Get['obj'].b),
+            "defaultdict": shapyro.OnlyIfExists(shapyro.Get['default']['k']),
+            "index": shapyro.OnlyIfExists(shapyro.Get['list'][3]),
+            "user_skip": shapyro.OnlyIfExists(shapyro.Get[shapyro.OnlyIfExists("x")]),
+            "list": [shapyro.OnlyIfExists("a"), shapyro.OnlyIfExists("x")]
+        }
+        expect = {"there": 1, "attr": 1, "defaultdict": 0, "list": [{"b": 1}]}
+        plan = shapyro.compile(template)
+        # Enough times for the chains to compile themselves
+        for _ in range(20):
+            self.assertEqual(plan(self._src), expect)
+
+    def test_skip_shared_prefix(self):
+        labels = shapyro.Get['meta']['spec']['labels']
+        plan = shapyro.compile({
+            "app": shapyro.OnlyIfExists(labels['app']),
+            "tier": shapyro.OnlyIfExists(labels['tier']),
+            "name": shapyro.OnlyIfExists(shapyro.Get['meta']['spec']['name'])
+        })
+        for _ in range(20):
+            self.assertEqual(plan({"meta": {}}), {})
+            self.assertEqual(
+                plan({"meta": {"spec": {"labels": {"app": "a"}, "name": "n"}}}),
+                {"app": "a", "name": "n"}
+            )
+
+    def test_skip_top_level(self):
+        with self.assertRaises(shapyro.SkipIteration):
+            shapyro.port({}, shapyro.OnlyIfExists("x"))
+        with self.assertRaises(shapyro.SkipIteration):
+            shapyro.port({}, shapyro.OnlyIfExists(shapyro.Get['x']))
+
+    def test_skip_async(self):
+        async def wrap(src):
+            return src
+
+        template = {
+            "there": shapyro.OnlyIfExists(shapyro.Get[wrap]['a']),
+            "missing": shapyro.OnlyIfExists(shapyro.Get['x'][wrap])
+        }
+        self.assertEqual(asyncio.run(shapyro.port(self._src, template)), {"there": {"b": 1}})
+
+
+class DeepTemplateTests(unittest.TestCase):
+    # Deeper than the recursion limit, with a skip and a duplicate key at every level
+    _DEPTH = 3000
+
+    def _template(self, leaf):
+        template = leaf
+        for i in range(self._DEPTH):
+            if i % 2:
+                template = {"a": template, "b": [shapyro.Get['x'], shapyro.OnlyIfExists("y")]}
+            else:
+                template = (template, shapyro.Get['x'])
+        return template
+
+    def _check(self, result):
+        # assertEqual would recurse too
+        for i in reversed(range(self._DEPTH)):
+            if i % 2:
+                self.assertEqual(result.keys(), {"a", "b"})
+                self.assertEqual(result["b"], [1])
+                result = result["a"]
+            else:
+                self.assertEqual(len(result), 2)
+                self.assertEqual(result[1], 1)
+                result = result[0]
+        self.assertEqual(result, "leaf")
+
+    def test_deep_port(self):
+        self._check(shapyro.port({"x": 1}, self._template("leaf")))
+        plan = shapyro.compile(self._template(shapyro.Get['z']), memo=True)
+        self._check(plan({"x": 1, "z": "leaf"}))
+
+    def test_deep_port_async(self):
+        async def leaf(src):
+            return "leaf"
+
+        self._check(asyncio.run(shapyro.port({"x": 1}, self._template(leaf), max_concurrency=2)))
+
+    def test_deep_profile(self):
+        with shapyro.profile() as stats:
+            self._check(shapyro.port({"x": 1}, self._template("leaf")))
+        self.assertEqual(stats.paths["b[0]"].calls, 1)
+
+    def test_shallow_container_in_deep_one(self):
+        template = {"deep": self._template("leaf"), "async": [shapyro.Get['x'], _async_upper]}
+        result = asyncio.run(shapyro.port({"x": 1, "name": "n"}, template))
+        self.assertEqual(result["async"], [1, "N"])
+        self._check(result["deep"])
+
+
+class MemoTests(unittest.TestCase):
+    def setUp(self):
+        self._calls = 0
+
+        def lookup(src):
+            self._calls += 1
+            return src["owner"].upper()
+
+        self._lookup = lookup
+        self._template = {
+            "owner": shapyro.Pure(lookup),
+            "contact": {"name": shapyro.Pure(lookup), "id": shapyro.Get['id']},
+            "ids": [shapyro.Get['id'], shapyro.OnlyIfExists(shapyro.Get['id'])]
+        }
+        self._src = {"owner": "fx", "id": 7}
+        self._expect = {"owner": "FX", "contact": {"name": "FX", "id": 7}, "ids": [7, 7]}
+
+    def test_memo_pure(self):
+        self.assertEqual(shapyro.port(self._src, self._template, memo=True), self._expect)
+        self.assertEqual(self._calls, 1)
+        self.assertEqual(shapyro.port(self._src, self._template, memo=True), self._expect)
+        self.assertEqual(self._calls, 2)
+
+    def test_no_memo(self):
+        self.assertEqual(shapyro.port(self._src, self._template), self._expect)
+        self.assertEqual(self._calls, 2)
+
+    def test_memo_compile(self):
+        plan = shapyro.compile(self._template)
+        self.assertFalse(plan.memo)
+        self.assertIs(shapyro.compile(plan), plan)
+        memo_plan = shapyro.compile(plan, memo=True)
+        self.assertTrue(memo_plan.memo)
+        self.assertIs(shapyro.compile(memo_plan, memo=True), memo_plan)
+        self.assertTrue(pickle.loads(pickle.dumps(shapyro.compile({"a": 1}, memo=True))).memo)
+
+    def test_memo_errors(self):
+        with self.assertRaises(KeyError):
+            shapyro.port({"id": 1}, self._template, memo=True)
+        with self.assertRaises(KeyError):
+            shapyro.port({"owner": "fx"}, self._template, memo=True)
+
+    def test_memo_async(self):
+        async def lookup(src):
+            self._calls += 1
+            await asyncio.sleep(0)
+            return src["owner"]
+
+        pure = shapyro.Pure(lookup)
+        template = {"a": pure, "b": [pure, shapyro.Pure(lookup)]}
+        result = asyncio.run(shapyro.port(self._src, template, memo=True))
+        self.assertEqual(result, {"a": "fx", "b": ["fx", "fx"]})
+        self.assertEqual(self._calls, 1)
+
+    def test_pure(self):
+        self.assertEqual(shapyro.Pure(self._lookup), shapyro.Pure(self._lookup))
+        self.assertEqual(shapyro.Pure(self._lookup)(self._src), "FX")
+        with self.assertRaises(TypeError):
+            shapyro.Pure("not callable")
+
+
+class PortLazyTests(unittest.TestCase):
+    def setUp(self):
+        self._calls = []
+
+        def track(name):
+            def get(src):
+                self._calls.append(name)
+                return src[name]
+            return get
+
+        self._template = {
+            "a": track("a"),
+            "b": {"c": track("c"), "d": [track("d"), shapyro.OnlyIfExists("nope"), 1]},
+            "maybe": shapyro.OnlyIfExists("e"),
+            "const": "x"
+        }
+        self._src = {"a": 1, "c": 2, "d": 3}
+
+    def test_port_lazy_on_access(self):
+        doc = shapyro.port_lazy(self._src, self._template)
+        self.assertIsInstance(doc, collections.abc.Mapping)
+        self.assertEqual(doc["a"], 1)
+        self.assertEqual(doc["a"], 1)
+        self.assertEqual(self._calls, ["a"])
+        self.assertEqual(doc["b"]["d"][0], 3)
+        self.assertEqual(self._calls, ["a", "d"])
+
+    def test_port_lazy_matches_port(self):
+        doc = shapyro.port_lazy(self._src, self._template)
+        self.assertEqual(doc, shapyro.port(self._src, self._template))
+        self.assertNotIn("maybe", doc)
+        self.assertEqual(list(doc), ["a", "b", "const"])
+        self.assertEqual(len(doc["b"]["d"]), 2)
+        self.assertEqual(doc["b"]["d"][-1], 1)
+        self.assertEqual(doc["b"]["d"][:1], [3])
+        with self.assertRaises(KeyError):
+            doc["maybe"]
+
+        src = dict(self._src, e=5)
+        self.assertEqual(shapyro.port_lazy(src, self._template)["maybe"], 5)
+
+    def test_port_lazy_read_only(self):
+        doc = shapyro.port_lazy(self._src, self._template)
+        with self.assertRaises(TypeError):
+            doc["a"] = 2
+        with self.assertRaises(TypeError):
+            doc["b"]["d"][0] = 2
+
+    def test_port_lazy_errors(self):
+        doc = shapyro.port_lazy({}, self._template)
+        self.assertEqual(doc["const"], "x")
+        with self.assertRaises(KeyError):
+            doc["a"]
+
+    def test_port_lazy_not_container(self):
+        self.assertEqual(shapyro.port_lazy({"a": 1}, shapyro.Get['a']), 1)
+        self.assertEqual(shapyro.port_lazy({"a": 1}, {shapyro.Get['a']}), {1})
+
+    def test_port_lazy_compiled(self):
+        x = shapyro.Get['x']['y']
+        plan = shapyro.compile({"a": x['a'], "b": x['b']})
+        src = {"x": {"y": {"a": 1, "b": 2}}}
+        doc = shapyro.port_lazy(src, plan)
+        self.assertEqual(doc["a"], 1)
+        src["x"] = {"y": {"a": 3, "b": 4}}
+        self.assertEqual(plan(src), {"a": 3, "b": 4})
+        self.assertEqual(doc["b"], 4)
+
+    def test_port_lazy_async(self):
+        async def get_a(src):
+            return src["a"]
+
+        doc = shapyro.port_lazy(self._src, {"a": get_a})
+        self.assertEqual(asyncio.run(doc["a"]), 1)
+        self.assertEqual(asyncio.run(doc["a"]), 1)
+
+
+class PortManyTests(unittest.TestCase):
+    def setUp(self):
+        self._template = {"name": shapyro.Get['name'], "attrs": shapyro.OnlyIfExists("attrs")}
+
+    def _sources(self, n):
+        for i in range(n):
+            if i % 2:
+                yield {"name": f"user{i}", "attrs": i}
+            else:
+                yield {"name": f"user{i}"}
+
+    def test_port_many(self):
+        expect = [shapyro.port(src, self._template) for src in self._sources(5)]
+        self.assertEqual(list(shapyro.port_many(self._sources(5), self._template)), expect)
+
+    def test_port_many_chunks(self):
+        chunks = list(shapyro.port_many(self._sources(5), self._template, chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual(chunks[2], [{"name": "user4"}])
+
+    def test_port_many_is_lazy(self):
+        #
+        # Sources should only be consumed as results are
+        #
+        sources = self._sources(1000000)
+        results = shapyro.port_many(sources, self._template, chunk_size=3)
+        self.assertEqual(len(next(results)), 3)
+        self.assertEqual(next(sources), {"name": "user3", "attrs": 3})
+
+    def test_port_many_bad_chunk_size(self):
+        with self.assertRaises(ValueError):
+            shapyro.port_many([], self._template, chunk_size=0)
+
+
+class PortManyAsyncTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self._in_flight = 0
+        self._most_in_flight = 0
+
+    async def _sources(self, n):
+        for i in range(n):
+            await asyncio.sleep(0)
+            yield {"n": i}
+
+    async def _slow(self, src):
+        self._in_flight += 1
+        self._most_in_flight = max(self._most_in_flight, self._in_flight)
+        # later sources finish first
+        await asyncio.sleep(0.001 * (10 - src["n"] % 10))
+        self._in_flight -= 1
+        return src["n"]
+
+    async def _collect(self, results):
+        return [result async for result in results]
+
+    async def test_port_many_async_ordered(self):
+        results = shapyro.port_many_async(self._sources(30), {"n": self._slow}, max_in_flight=5)
+        self.assertEqual(await self._collect(results), [{"n": i} for i in range(30)])
+        self.assertEqual(self._most_in_flight, 5)
+
+    async def test_port_many_async_unordered(self):
+        results = await self._collect(shapyro.port_many_async(
+            self._sources(20), self._slow, max_in_flight=10, ordered=False
+        ))
+        self.assertEqual(sorted(results), list(range(20)))
+        self.assertNotEqual(results, list(range(20)))
+        self.assertEqual(self._most_in_flight, 10)
+
+    async def test_port_many_async_sync_sources(self):
+        results = shapyro.port_many_async([{"n": 1}, {"n": 2}], shapyro.Get['n'])
+        self.assertEqual(await self._collect(results), [1, 2])
+        self.assertEqual(await self._collect(shapyro.port_many_async([], shapyro.Get['n'])), [])
+
+    async def test_port_many_async_failure(self):
+        async def fail(src):
+            if src["n"] == 3:
+                raise ValueError("nope")
+            return await self._slow(src)
+
+        for ordered in (True, False):
+            with self.assertRaises(ValueError):
+                await self._collect(shapyro.port_many_async(self._sources(10), fail, ordered=ordered))
+        with self.assertRaises(KeyError):
+            await self._collect(shapyro.port_many_async([{"n": 1}, {}], shapyro.Get['n']))
+
+    async def test_port_many_async_bad_max_in_flight(self):
+        with self.assertRaises(ValueError):
+            await self._collect(shapyro.port_many_async([], shapyro.Get, max_in_flight=0))
+
+
+class PortColumnsTests(unittest.TestCase):
+    def setUp(self):
+        self._sources = [
+            {"name": "root", "uid": 0, "score": 1.5},
+            {"name": "andy", "uid": 1337}
+        ]
+        self._template = {
+            "name": shapyro.Get['name'],
+            "uid": shapyro.Get['uid'],
+            "score": shapyro.OnlyIfExists("score"),
+            "kind": "user"
+        }
+
+    def test_port_columns(self):
+        expect = {
+            "name": ["root", "andy"],
+            "uid": [0, 1337],
+            "score": [1.5, None],
+            "kind": ["user", "user"]
+        }
+        self.assertEqual(shapyro.port_columns(iter(self._sources), self._template), expect)
+
+    def test_port_columns_typed(self):
+        columns = shapyro.port_columns(self._sources, self._template,
+                                       types={"uid": "q", "score": "d"}, missing=0.0)
+        self.assertEqual(columns["uid"], array.array("q", [0, 1337]))
+        self.assertEqual(columns["score"], array.array("d", [1.5, 0.0]))
+        self.assertEqual(columns["name"], ["root", "andy"])
+
+    def test_port_columns_compiled(self):
+        plan = shapyro.compile(self._template)
+        columns = shapyro.port_columns(self._sources, plan, types={"uid": "q"})
+        self.assertEqual(columns["uid"], array.array("q", [0, 1337]))
+        self.assertEqual(columns["kind"], ["user", "user"])
+        with self.assertRaises(ValueError):
+            shapyro.port_columns(self._sources, plan, types={"nope": "q"})
+
+    def test_port_columns_no_callables(self):
+        template = {"a": 1, "b": "x", "c": [1]}
+        columns = shapyro.port_columns([{}, {}], template)
+        self.assertEqual(columns, {"a": [1, 1], "b": ["x", "x"], "c": [[1], [1]]})
+        self.assertIsNot(columns["c"][0], columns["c"][1])
+        self.assertEqual(shapyro.port_columns([{}], shapyro.compile(template, shared_constants=True))["a"], [1])
+
+    def test_port_columns_not_flat(self):
+        with self.assertRaises(TypeError):
+            shapyro.port_columns(self._sources, [shapyro.Get['name']])
+        with self.assertRaises(TypeError):
+            shapyro.port_columns(self._sources, {shapyro.Get['name']: "x"})
+        with self.assertRaises(ValueError):
+            shapyro.port_columns(self._sources, self._template, types={"nope": "q"})
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy"), "numpy not installed")
+    def test_port_columns_numpy(self):
+        columns = shapyro.port_columns(self._sources, self._template,
+                                       types={"uid": "q"}, numpy=True)
+        self.assertEqual(columns["uid"].tolist(), [0, 1337])
+
+
+class PortParallelTests(unittest.TestCase):
+    def setUp(self):
+        self._template = shapyro.Template({
+            "name": shapyro.Get['name'],
+            "attrs": shapyro.OnlyIfExists("attrs"),
+            "label": shapyro.StringTemplate("user-{name}")
+        })
+        self._sources = [{"name": f"user{i}", "attrs": i} if i % 3 else {"name": f"user{i}"} for i in range(50)]
+
+    def test_template_pickle(self):
+        unpickled = pickle.loads(pickle.dumps(self._template))
+        self.assertEqual(unpickled(self._sources[1]), self._template(self._sources[1]))
+
+    def test_port_parallel(self):
+        expect = list(shapyro.port_many(self._sources, self._template))
+        result = shapyro.port_parallel(iter(self._sources), self._template, workers=2, chunk_size=7)
+        self.assertEqual(list(result), expect)
+
+    def test_port_parallel_async(self):
+        result = shapyro.port_parallel(self._sources[:3], {"upper": _async_upper}, workers=1)
+        self.assertEqual(list(result), [{"upper": "USER0"}, {"upper": "USER1"}, {"upper": "USER2"}])
+
+    def test_port_parallel_failure(self):
+        with self.assertRaises(KeyError):
+            list(shapyro.port_parallel(self._sources, {"x": shapyro.Get['x']}, workers=1))
+
+    def test_port_parallel_bad_workers(self):
+        with self.assertRaises(ValueError):
+            shapyro.port_parallel([], self._template, workers=0)
+
+
+class PortStreamTests(unittest.TestCase):
+    def setUp(self):
+        self._template = {"name": shapyro.Get['name'], "uid": shapyro.OnlyIfExists("uid")}
+        self._records = [{"name": "root", "uid": 0}, {"name": "andy"}, {"name": "\u00e9", "uid": 2}]
+        self._expect = [{"name": "root", "uid": 0}, {"name": "andy"}, {"name": "\u00e9", "uid": 2}]
+
+    def _ndjson(self):
+        return "\n".join(json.dumps(r) for r in self._records) + "\n\n"
+
+    def _read(self, out):
+        out.seek(0)
+        return [json.loads(line) for line in out.read().splitlines()]
+
+    def test_port_stream_ndjson(self):
+        for backend in (None, "json"):
+            out = io.StringIO()
+            counts = shapyro.port_stream(io.StringIO(self._ndjson()), self._template, out,
+                                         backend=backend)
+            self.assertEqual(self._read(out), self._expect)
+            self.assertEqual(counts, {"read": 3, "written": 3, "skipped": 0, "batches": 1})
+
+    def test_port_stream_binary(self):
+        out = io.BytesIO()
+        shapyro.port_stream(io.BytesIO(self._ndjson().encode()), self._template, out)
+        self.assertEqual(self._read(out), self._expect)
+
+    def test_port_stream_array(self):
+        data = json.dumps(self._records * 1000, indent=1).encode("utf-8")
+        out = io.BytesIO()
+        shapyro.port_stream(io.BytesIO(data), self._template, out, format="array")
+        self.assertEqual(self._read(out), self._expect * 1000)
+
+        for data in ("[]", " [ 12345 , [1, 2], \"x\" ] "):
+            out = io.StringIO()
+            counts = shapyro.port_stream(io.StringIO(data), shapyro.Get, out, format="array")
+            self.assertEqual(self._read(out), json.loads(data))
+            self.assertEqual(counts["read"], len(json.loads(data)))
+
+    def test_port_stream_array_small_reads(self):
+        import shapyro.utils
+        size = shapyro.utils._STREAM_READ_SIZE
+        shapyro.utils._STREAM_READ_SIZE = 3
+        try:
+            out = io.BytesIO()
+            data = json.dumps([12345678, "\u00e9\u00e9\u00e9", {"a": [1, 2, 3]}]).encode("utf-8")
+            shapyro.port_stream(io.BytesIO(data), shapyro.Get, out, format="array")
+            self.assertEqual(self._read(out), json.loads(data))
+        finally:
+            shapyro.utils._STREAM_READ_SIZE = size
+
+    def test_port_stream_batches_and_skips(self):
+        progress = []
+        out = io.StringIO()
+        counts = shapyro.port_stream(
+            io.StringIO(self._ndjson()), shapyro.OnlyIfExists("uid"), out,
+            batch_size=1, progress=lambda c: progress.append(dict(c))
+        )
+        self.assertEqual(self._read(out), [0, 2])
+        self.assertEqual(counts, {"read": 3, "written": 2, "skipped": 1, "batches": 2})
+        self.assertEqual([c["read"] for c in progress], [1, 2, 3])
+
+    def test_port_stream_async(self):
+        out = io.StringIO()
+        shapyro.port_stream(io.StringIO(self._ndjson()), {"name": _async_upper}, out)
+        self.assertEqual(self._read(out), [{"name": "ROOT"}, {"name": "ANDY"}, {"name": "\u00c9"}])
+
+    def test_port_stream_async_in_loop(self):
+        async def stream(template):
+            return shapyro.port_stream(io.StringIO(self._ndjson()), template, io.StringIO())
+
+        # Fine for a sync template, but an async one needs a loop of its own
+        self.assertEqual(asyncio.run(stream(self._template))["written"], 3)
+        with self.assertRaisesRegex(RuntimeError, "running event loop"):
+            asyncio.run(stream({"name": _async_upper}))
+
+    def test_port_stream_bad_input(self):
+        with self.assertRaisesRegex(ValueError, "line 2"):
+            shapyro.port_stream(io.StringIO('{}\n{"a": \n'), shapyro.Get, io.StringIO())
+        with self.assertRaises(ValueError):
+            shapyro.port_stream(io.StringIO('[{}, {"a"'), shapyro.Get, io.StringIO(), format="array")
+        with self.assertRaises(ValueError):
+            shapyro.port_stream(io.StringIO('{}'), shapyro.Get, io.StringIO(), format="array")
+        with self.assertRaises(ValueError):
+            shapyro.port_stream(io.StringIO(), shapyro.Get, io.StringIO(), format="csv")
+        with self.assertRaises(ValueError):
+            shapyro.port_stream(io.StringIO(), shapyro.Get, io.StringIO(), backend="yaml")
+
+
 class PortAsyncTest(unittest.IsolatedAsyncioTestCase):
     def setUp(self):
         self._input = {
@@ -143,6 +972,62 @@ class PortAsyncTest(unittest.IsolatedAsyncioTestCase):
 
         self.assertEqual(await shapyro.port(src, dst), expect)
 
+    async def test_async_concurrent(self):
+        #
+        # Independent coroutines should overlap rather than
+        # taking the sum of their latencies, and come back in order
+        #
+        running = []
+        most_running = []
+
+        def sleeper(i):
+            async def sleep(_):
+                running.append(i)
+                most_running.append(len(running))
+                await asyncio.sleep(0.01)
+                running.remove(i)
+                return i
+            return sleep
+
+        dst = {f"k{i}": sleeper(i) for i in range(10)}
+        dst["list"] = [sleeper(i) for i in range(10)]
+        result = await shapyro.port(self._input, dst)
+        self.assertEqual(list(result), [f"k{i}" for i in range(10)] + ["list"])
+        self.assertEqual(result["list"], list(range(10)))
+        self.assertEqual(max(most_running), 20)
+
+        most_running.clear()
+        result = await shapyro.port(self._input, dst, max_concurrency=3)
+        self.assertEqual(result["list"], list(range(10)))
+        self.assertEqual(max(most_running), 3)
+
+    async def test_async_concurrency_limit_nested(self):
+        #
+        # A limit of 1 must not deadlock when a coroutine's
+        # result has coroutines of its own to resolve
+        #
+        src = self._input
+        dst = [self._get_addrinfo, {"addrinfo": self._get_addrinfo}]
+        expect = [
+            {"host": "localhost", "ip": "127.0.0.1"},
+            {"addrinfo": {"host": "localhost", "ip": "127.0.0.1"}}
+        ]
+        result = await asyncio.wait_for(shapyro.port(src, dst, max_concurrency=1), 1)
+        self.assertEqual(result, expect)
+
+    async def test_async_failure_propagates(self):
+        async def fail(_):
+            raise KeyError("nope")
+
+        with self.assertRaises(KeyError):
+            await shapyro.port(self._input, [self._get_IP, fail])
+
+    async def test_async_compiled_seq(self):
+        plan = shapyro.compile([shapyro.Get['user']['name'], self._get_addrinfo])
+        expect = ["test", {"host": "localhost", "ip": "127.0.0.1"}]
+        self.assertEqual(await plan(self._input), expect)
+        self.assertEqual(await plan(self._input), expect)
+
 
 if __name__=="__main__":
     unittest.main()
\ No newline at end of file